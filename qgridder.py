@@ -47,6 +47,8 @@ from .qgridder_dialog_preproc import QGridderDialogPreProc
 from .qgridder_dialog_plot import QGridderDialogPlot
 from .qgridder_dialog_export import QGridderDialogExport
 from .qgridder_dialog_settings import QGridderDialogSettings
+from .qgridder_utils.rgrid_provider import register_rgrid_provider
+from .qgridder_utils.journal import GridJournal
 
 #  ---------------------------------------------
 class QGridder:
@@ -144,6 +146,10 @@ class QGridder:
         self.iface.addPluginToMenu("Qgridder", self.action_settings)
         self.iface.addPluginToMenu("Qgridder", self.action_preproc)
 
+        # virtual grid provider, used by layers saved in projects
+        # (not available with older Qgis versions)
+        self.settings.virtual_grids = register_rgrid_provider()
+
 
     def unload(self):
         """
@@ -179,6 +185,10 @@ class QGridder:
         self.settings.load_settings( QgsProject.instance() )
         # Populate layer list
         self.dlg_new.populate_layer_list(self.dlg_new.listSourceLayer)
+        # virtual grids are only offered if the provider is registered
+        self.dlg_new.checkVirtual.setVisible( self.settings.virtual_grids )
+        if not self.settings.virtual_grids :
+            self.dlg_new.checkVirtual.setChecked( False )
         # Get update extents from map canvas
         self.dlg_new.update_from_canvas()
         # show the dialog
@@ -296,8 +306,14 @@ class QgridderSettings :
         self.dic_settings  = {}
         # support model types (grid topology)
         self.model_types = ['Modflow','Nested']
-        # initialize list of grid backups
-        self.list_grid_bckup = []
+        # initialize journal of grid changes (undo / redo of refinements)
+        self.grid_journal = GridJournal()
+        # ids of layers edited by a pending background task
+        self.pending_layers = set()
+        # vertical connectivity of the last checked pseudo-3D grid (VerticalConnectivity), for exporters
+        self.vertical_connectivity = None
+        # True if the virtual structured grid provider is registered (see rgrid_provider.py)
+        self.virtual_grids = False
         # load settings from Qgis project
         self.load_settings(self.proj)
 
@@ -320,7 +336,9 @@ class QgridderSettings :
                 'plot_obs':'True',
                 'plot_simul':'False',
                 'grid_backup':'True',
-                'max_grid_backup':'5'
+                'max_grid_backup':'5',
+                # number of worker processes for grid build and 3D check (1 : no process pool)
+                'nproc':'1'
                 }
 
 
@@ -67,6 +67,9 @@ class QGridderDialogCheck3D(QGridderDialog, Ui_QGridderCheck3D):
 
         # Set encoding 
         self.encoding = 'System'
+
+        # References to running background tasks
+        self.tasks = []
         
 
     # ========== update listLayers3D
@@ -139,6 +142,12 @@ class QGridderDialogCheck3D(QGridderDialog, Ui_QGridderCheck3D):
             if layer.source()== OutFileName:
                 QgsMapLayerRegistry.instance().removeMapLayers( layer.id() )
         ftools_utils.addShapeToCanvas( OutFileName )
+        # copy the rotation angle of the reference grid
+        angle = qgridder_utils.get_grid_angle( ReferenceGridLayer )
+        if angle is not None :
+            for layer in QgsProject.instance().mapLayers().values() :
+                if layer.source().split('|')[0] == OutFileName :
+                    qgridder_utils.set_grid_angle( layer, angle )
 
         # add new layer to listLayers3D
         self.listLayers3D.addItem(newLayerName)
@@ -162,7 +171,44 @@ class QGridderDialogCheck3D(QGridderDialog, Ui_QGridderCheck3D):
             vLayerName = self.listLayers3D.item(row).text()
             vLayer  = ftools_utils.getMapLayerByName( unicode( vLayerName ) )
             allLayers.append(vLayer)
-        qgridder_utils.correct_pseudo3D_grid(allLayers, topoRules)
+        # layers edited by a pending task (refinement or check) can not be checked
+        if any( [ vLayer.id() in self.settings.pending_layers for vLayer in allLayers ] ) :
+            QMessageBox.information(self, self.tr("Qgridder"),
+                    self.tr("A grid layer is being modified by a running task, please wait until it is completed")
+                    )
+            return()
+        # Check and correct grid in a background task, layers are updated
+        # by check3D_task_finished once the check is completed
+        # Journal of grid layer changes, for undo
+        journal = None
+        if self.settings.dic_settings['grid_backup'] == 'True' :
+            journal = self.settings.grid_journal
+            journal.max_steps = int( self.settings.dic_settings['max_grid_backup'] )
+        # with nproc > 1, cells are checked in worker processes, and layers split concurrently
+        nproc = int( self.settings.dic_settings['nproc'] )
+        task = qgridder_utils.Check3DTask( "Qgridder : check pseudo-3D grid", allLayers, topoRules,
+                nproc = nproc, on_finished = self.check3D_task_finished, journal = journal )
+        task.progressChanged.connect( lambda value : self.progressBarCheck3D_2.setValue( int(value) ) )
+        self.settings.pending_layers.update( [ grid_copy.layer_id for grid_copy in task.grid_copies ] )
+        self.tasks.append(task)
+        QgsApplication.taskManager().addTask(task)
+        return()
+
+    def check3D_task_finished(self, task, result):
+        self.tasks.remove(task)
+        self.settings.pending_layers.difference_update( [ grid_copy.layer_id for grid_copy in task.grid_copies ] )
+        if not result :
+            message = self.tr("pseudo-3D grid check canceled, grid layers unchanged")
+            if task.exception is not None :
+                message = self.tr("pseudo-3D grid check failed : ") + str(task.exception)
+            QMessageBox.information(self, self.tr("Qgridder"), message)
+            return
+        # without journal step, former steps of corrected layers can not be undone
+        if task.journal is None :
+            for grid_copy in task.grid_copies :
+                self.settings.grid_journal.clear(grid_copy.layer)
+        # vertical connections of the corrected layers, kept for exporters and post-processing
+        self.settings.vertical_connectivity = task.connectivity
         QMessageBox.information(self, self.tr("Qgridder"),
             self.tr('pseudo-3D grid topology successfully checked and corrected')
         )
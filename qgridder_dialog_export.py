@@ -113,15 +113,16 @@ class QGridderDialogExport(QGridderDialog, Ui_QGridderExport):
         feature_count = gridLayer.dataProvider().featureCount()
 
         # Initialize progress bar
-        progress=QProgressDialog("Exporting attributes...", "Abort Export", 0, feature_count);
-        progress.setWindowModality(Qt.WindowModal)
+        progress_dialog=QProgressDialog("Exporting attributes...", "Abort Export", 0, 100);
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress = qgridder_utils.ProgressReporter(progress_dialog, total = feature_count)
 
         # Select all features along with their attributes
         allAttrs = gridLayer.pendingAllAttributesList()
         gridLayer.select(allAttrs)
 
         # Iterate over grid cells
-        for feat in gridLayer.getFeatures():
+        for count, feat in enumerate(gridLayer.getFeatures()):
             p0, p1, p2, p3 = ftools_utils.extractPoints(feat.geometry())[:4]
             txtfile.write(str(feat.id()) + ' AUTO' + lineterminator)
             for point in [p0,p1,p2,p3,p0]:
@@ -129,12 +130,13 @@ class QGridderDialogExport(QGridderDialog, Ui_QGridderExport):
                 ycoor = round(point.y(), max_decimals)
                 txtfile.write('\t' + str(xcoor) + delimiter + str(ycoor) + lineterminator)
             txtfile.write('END' + lineterminator)
-            progress.setValue(feat.id())
-            if (progress.wasCanceled()):
+            if progress.update(count):
+                   progress_dialog.close()
+                   txtfile.close()
                    return "Export canceled "
 
         txtfile.write('END' + lineterminator)
 
-        progress.close()
+        progress_dialog.close()
         txtfile.close()
 
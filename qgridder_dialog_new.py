@@ -37,6 +37,7 @@ from .ui_qgridder_new import Ui_QGridderNew
 
 from . import qgridder_utils
 from .qgridder_utils import ftools_utils
+from .qgridder_utils import rgrid_provider
 
 import numpy as np
 
@@ -56,6 +57,8 @@ class QGridderDialogNew(QGridderDialog, Ui_QGridderNew):
         # Set up widgets
         self.checkRatio.setChecked(True)
         self.checkLoadLayer.setChecked(True)
+        self.checkGraded.setChecked(False)
+        self.set_graded()
 
         # Connect buttons
         self.buttonUpdateFromLayer.clicked.connect(self.update_from_layer)
@@ -72,6 +75,7 @@ class QGridderDialogNew(QGridderDialog, Ui_QGridderNew):
         self.sboxXres.valueChanged.connect(self.estim_number_grid_cells)
         self.sboxYres.valueChanged.connect(self.estim_number_grid_cells)
         self.textOutFilename.textChanged.connect(self.set_out_file)
+        self.checkGraded.toggled.connect(self.set_graded)
         
         # Populate model name list
         self.populate_layer_list(self.listSourceLayer)
@@ -96,16 +100,25 @@ class QGridderDialogNew(QGridderDialog, Ui_QGridderNew):
         self.OutFileName = 'grid.shp'
         self.encoding = 'System'
 
+        # References to running background tasks
+        self.tasks = []
+
 
     #  ======= Update automatically when 1:1 ratio is checked
     def set_Yres(self, value):
         if self.checkRatio.isChecked():
             self.sboxYres.setValue(value)
 
+    #  ======= Enable graded resolution widgets
+    def set_graded(self, value = None):
+        self.sboxResMin.setEnabled( self.checkGraded.isChecked() )
+        self.sboxGrowth.setEnabled( self.checkGraded.isChecked() )
+
     #  ======= Choose output shape file
     def out_file(self):
         self.textOutFilename.clear()
-        ( self.OutFileName, self.encoding ) = ftools_utils.saveDialog( self )
+        ( self.OutFileName, self.encoding ) = ftools_utils.saveDialog( self,
+                filtering="Shapefiles (*.shp *.SHP);;GeoPackages (*.gpkg *.GPKG)" )
         #if self.OutFileName is None or self.encoding is None:
         #    QMessageBox.information(parent, "Gridder",
         #            str( 'encoding' + str(self.encoding) + 'file: ' + str(self.OutFileName) ))
@@ -161,6 +174,30 @@ class QGridderDialogNew(QGridderDialog, Ui_QGridderNew):
 
         self.labelNumberCells.setText( unicode(N) )
 
+    # ======= Grid task completed ========================================
+    def grid_task_finished(self, task, result):
+        self.tasks.remove(task)
+        if not result :
+            if task.exception is not None :
+                QMessageBox.information(self, self.tr("Gridder"),
+                        self.tr("Grid build failed : ") + str(task.exception)
+                        )
+            if not task.output_deleted :
+                QMessageBox.warning(self, self.tr("Gridder"),
+                        self.tr("Incomplete grid file could not be deleted : ") + task.file_name
+                        )
+            return
+        # Load output layer
+        if task.load_layer :
+            ftools_utils.addShapeToCanvas( task.file_name )
+            # keep the rotation angle with the layer, it can not be read back from
+            # cells beyond 45 degrees
+            for layer in QgsProject.instance().mapLayers().values() :
+                if layer.source().split('|')[0] == task.file_name :
+                    qgridder_utils.set_grid_angle( layer, task.angle )
+            # update layer list in plugin
+            self.populate_layer_list(self.listSourceLayer)
+
     # ======= Build grid ========================================
     def run_write_grid(self):
         self.buttonWriteGrid.setEnabled( False )
@@ -171,11 +208,11 @@ class QGridderDialogNew(QGridderDialog, Ui_QGridderNew):
             QMessageBox.information(self, self.tr("Gridder"),
                     self.tr("Please specify valid extent coordinates")
                     )
-        elif self.textOutFilename.text() == "":
+        elif self.textOutFilename.text() == "" and not self.checkVirtual.isChecked():
             QMessageBox.information(self, self.tr("Gridder"),
-                    self.tr("Please specify valid output shapefile")
+                    self.tr("Please specify valid output file")
                     )
-        elif self.sboxXres.value() == 0:
+        elif self.sboxXres.value() == 0 or self.sboxYres.value() == 0:
             QMessageBox.information(self, self.tr("Gridder"),
                     self.tr("Please specify valid resolution")
                     )
@@ -198,13 +235,35 @@ class QGridderDialogNew(QGridderDialog, Ui_QGridderNew):
             Xres = self.sboxXres.value()
             Yres = self.sboxYres.value()
 
-            # Compute number of elements
-            n = int( round( (boundBox.yMaximum() - boundBox.yMinimum()) / Yres ) )
-            m = int( round( (boundBox.xMaximum() - boundBox.xMinimum()) / Xres ) )
+            # Variable cell dimensions, for graded grids
+            delr = delc = None
+
+            # Rotation of the grid around (X Min, Y Min)
+            angle = self.sboxAngle.value()
+            origin = ( boundBox.xMinimum(), boundBox.yMinimum() )
+
+            if self.checkGraded.isChecked() :
+                # Cells are refined around the features of the source layer,
+                # from the minimum resolution up to Xres (columns) and Yres (rows)
+                source_layer = ftools_utils.getVectorLayerByName( unicode( self.listSourceLayer.currentText() ) )
+                if source_layer is None or self.sboxResMin.value() <= 0 :
+                    QMessageBox.information(self, self.tr("Gridder"),
+                            self.tr("Please specify a valid source layer and minimum resolution")
+                            )
+                    self.buttonWriteGrid.setEnabled( True )
+                    return
+                delr, delc = qgridder_utils.get_graded_delr_delc(boundBox,
+                        self.sboxResMin.value(), Xres, self.sboxGrowth.value(),
+                        source_layer.getFeatures(), angle, origin, res_max_y = Yres )
+                n, m = len(delc), len(delr)
+            else :
+                # Compute number of elements
+                n = int( round( (boundBox.yMaximum() - boundBox.yMinimum()) / Yres ) )
+                m = int( round( (boundBox.xMaximum() - boundBox.xMinimum()) / Xres ) )
 
-            # Adjust bounding box to respect Yres and Xres with linspace
-            boundBox.setXMaximum( boundBox.xMinimum() + m*Xres )
-            boundBox.setYMaximum( boundBox.yMinimum() + n*Yres )
+                # Adjust bounding box to respect Yres and Xres with linspace
+                boundBox.setXMaximum( boundBox.xMinimum() + m*Xres )
+                boundBox.setYMaximum( boundBox.yMinimum() + n*Yres )
 
             if n*m <= 0 :
                 QMessageBox.information(self, self.tr("Gridder"),
@@ -226,49 +285,57 @@ class QGridderDialogNew(QGridderDialog, Ui_QGridderNew):
             else :
                 crs = None
 
+            # Virtual grid : cells are generated on the fly by the provider,
+            # use "Save Features As" to write the grid to a file.
+            if self.checkVirtual.isChecked() :
+                if delr is None :
+                    delr, delc = [Xres]*m, [Yres]*n
+                xoff, yoff = qgridder_utils.rotate( boundBox.xMinimum(), boundBox.yMaximum(), angle, origin )
+                sgrid = qgridder_utils.StructuredGrid( xoff, yoff, delr, delc, angle = angle )
+                layer_name = QFileInfo( self.textOutFilename.text() ).baseName() or 'grid'
+                grid_layer = rgrid_provider.make_virtual_rgrid_layer( sgrid, crs, layer_name )
+                qgridder_utils.set_grid_angle( grid_layer, angle )
+                QgsProject.instance().addMapLayer( grid_layer )
+                self.populate_layer_list(self.listSourceLayer)
+                QApplication.restoreOverrideCursor()
+                self.buttonWriteGrid.setEnabled( True )
+                return
+
             # Initialize field for base feature
             # TO DO : add useful attributes
             #fields = {0:QgsField("ID", QVariant.Int)}
             fields = QgsFields()
             fields.append(QgsField("ID", QVariant.Int))
-            # Initialize base rectangle feature
-            rectFeat = QgsFeature()
-            rectGeom = QgsGeometry()
-            rectFeat.setGeometry(rectGeom.fromRect(boundBox))
-            rectFeat.initAttributes(1)
-            idVar = 0
-            rectFeat.setAttribute(0, idVar)
+
+            # If the output layer is loaded, unload it.
+            # Note : reload() doesn't work.
+            for (name,layer) in QgsProject.instance().mapLayers().items():
+                if layer.source().split('|')[0]==self.OutFileName:
+                    QgsProject.instance().removeMapLayer( layer.id() )
 
             # if the file exits, remove it
-            check = QFile(self.OutFileName)
+            is_gpkg = self.OutFileName.lower().endswith('.gpkg')
             if QFile(self.OutFileName).exists():
-                if not QgsVectorFileWriter.deleteShapeFile(self.OutFileName):
+                if is_gpkg :
+                    deleted = QFile(self.OutFileName).remove()
+                else :
+                    deleted = QgsVectorFileWriter.deleteShapeFile(self.OutFileName)
+                if not deleted :
                     QMessageBox.information(self, self.tr("Generate Vector Grid"),
                     "Cannot delete file:\n" + unicode(self.OutFileName) + "\n")
                     return
 
-            # Load shape file writer
-            writer = QgsVectorFileWriter(unicode(self.textOutFilename.text()), 
-                    self.encoding, fields, QgsWkbTypes.Polygon, 
-                    crs, driverName="ESRI Shapefile")
-
-            # Call function to make grid
-            qgridder_utils.make_rgrid(rectFeat, n, m, writer, self.progressBarBuildGrid)
-
-            # Delete writer
-            del writer
-            
-            # Load output layer if it is not already loaded
-            if self.checkLoadLayer.isChecked():
-                # list currently loaded layer. If the layer is loaded, unload it.
-                for (name,layer) in QgsProject.instance().mapLayers().items():
-                    # Note : reload() doesn't work.
-                    if layer.source()==self.OutFileName:
-                        QgsProject.instance().removeMapLayer( layer.id() )
-                # load layer
-                ftools_utils.addShapeToCanvas( self.OutFileName )
-                # update layer list in plugin
-                self.populate_layer_list(self.listSourceLayer)
+            # Build grid in a background task, the output layer is loaded
+            # by grid_task_finished once the file is written
+            # with nproc > 1, cell geometries are built by worker processes (see make_rgrid)
+            nproc = int( self.settings.dic_settings['nproc'] )
+            task = qgridder_utils.RGridTask( "Qgridder : build grid " + QFileInfo(self.OutFileName).fileName(),
+                    boundBox, n, m, unicode(self.OutFileName), self.encoding, fields, crs,
+                    delr = delr, delc = delc, nproc = nproc, angle = angle, on_finished = self.grid_task_finished )
+            task.load_layer = self.checkLoadLayer.isChecked()
+            task.progressChanged.connect( lambda value : self.progressBarBuildGrid.setValue( int(value) ) )
+            self.tasks.append(task)
+            QgsApplication.taskManager().addTask(task)
 
         # Post-operation information
         QApplication.restoreOverrideCursor()
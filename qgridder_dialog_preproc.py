@@ -72,7 +72,12 @@ class QGridderDialogPreProc(QGridderDialog, Ui_QGridderPreProc):
         # Load input grid layer
         grid_layer = ftools_utils.getMapLayerByName( unicode( grid_layer_name ) )
 
-        res = qgridder_utils.rgrid_numbering(grid_layer)
+        progress = QProgressDialog("Numbering grid cells...", "Abort", 0, 100, self)
+        progress.setWindowModality(Qt.WindowModal)
+
+        res = qgridder_utils.rgrid_numbering(grid_layer, progress_bar = progress)
+
+        progress.close()
 
         if res == True :
             QMessageBox.information(self, self.tr("Gridder"),
@@ -50,18 +50,20 @@ class QGridderDialogRefinement(QGridderDialog, Ui_QGridderRefinement):
         self.settings = settings
         self.setupUi(self)
 
-        # init undo button
-        if len(self.settings.list_grid_bckup) > 0 :
-            self.buttonUndoRefine.setEnabled(True)
-        else :
-            self.buttonUndoRefine.setEnabled(False)
-
         # Connect buttons
         self.buttonRefine.clicked.connect(self.run_regular_refine)
         self.buttonUndoRefine.clicked.connect(self.run_undo_refine)
+        self.buttonRedoRefine.clicked.connect(self.run_redo_refine)
+        self.buttonCoarsen.clicked.connect(self.run_coarsen)
+        self.buttonAutoRefine.clicked.connect(self.run_auto_refine)
         
         # Populate model name list
         self.populate_layer_list(self.listGridLayer)
+        self.populate_layer_list(self.listRefineLayer)
+
+        # init undo and redo buttons
+        self.listGridLayer.currentIndexChanged.connect(self.update_undo_buttons)
+        self.update_undo_buttons()
 
         # check boxes
         self.checkTopo.setChecked(True)
@@ -71,6 +73,9 @@ class QGridderDialogRefinement(QGridderDialog, Ui_QGridderRefinement):
         self.labelIterations.hide()
         self.labelIter.hide()
 
+        # References to running background tasks
+        self.tasks = []
+
     #  ======= Update automatically when 1:1 ratio is checked
     def set_divide_vert(self, value):
         if self.checkDivideRatio.isChecked():
@@ -115,6 +120,106 @@ class QGridderDialogRefinement(QGridderDialog, Ui_QGridderRefinement):
                 return
 
         # Set up topo Rules
+        topoRules = self.get_topo_rules()
+        if topoRules is None :
+            return
+
+
+        # Load input grid layer
+        grid_layer = ftools_utils.getMapLayerByName( unicode( grid_layer_name ) )
+
+        if (grid_layer.selectedFeatureCount() == 0):
+            QMessageBox.information(self, self.tr("Gridder"),
+                    self.tr("No selected features in the chosen grid layer.")
+                    )
+            return
+
+        if not self.check_layer_available(grid_layer) :
+            return
+
+        # Journal of grid layer changes, for undo
+        journal = self.get_grid_journal()
+
+        # Fetch selected features from input grid_layer
+        selected_fIds = grid_layer.selectedFeatureIds()
+
+        # Clean user selection
+        grid_layer.selectByIds([])
+
+        # Refine grid in a background task, grid_layer is updated
+        # by refine_task_finished once refinement is completed
+        task = qgridder_utils.RefineTask( "Qgridder : refine " + grid_layer.name(),
+                grid_layer, selected_fIds, n, m, topoRules, on_finished = self.refine_task_finished,
+                journal = journal )
+        task.progressChanged.connect( lambda value : self.progressBarRegularRefine.setValue( int(value) ) )
+        self.start_task(task)
+
+
+    # ======= Coarsen grid ========================================
+    def run_coarsen(self):
+
+        # selected grid layer name
+        grid_layer_name = self.listGridLayer.currentText()
+
+        # number of merged rows and columns
+        n =  self.sboxDivideHoriz.value()
+        m = self.sboxDivideVert.value()
+
+        # Check input data
+        if (type(n) != int or type(m) != int or m<1 or n<1 or n*m < 2):
+            QMessageBox.information(self, self.tr("Gridder"),
+                    self.tr("Can't merge features, please verify the number of elements")
+                    )
+            return
+        elif (grid_layer_name == "") :
+            QMessageBox.information(self, self.tr("Gridder"),
+                    self.tr("Please specify a valid vector layer shapefile")
+                    )
+            return
+
+        if self.settings.dic_settings['model_type'] == 'Nested':
+            if n != m or n not in (2, 4) :
+                QMessageBox.information(self, self.tr("Qgridder"),
+                        self.tr("For Nested, you can only merge cells by 2x2 or 4x4")
+                    )
+                return
+
+        # Set up topo Rules
+        topoRules = self.get_topo_rules()
+        if topoRules is None :
+            return
+
+        # Load input grid layer
+        grid_layer = ftools_utils.getMapLayerByName( str( grid_layer_name ) )
+
+        if (grid_layer.selectedFeatureCount() == 0):
+            QMessageBox.information(self, self.tr("Gridder"),
+                    self.tr("No selected features in the chosen grid layer.")
+                    )
+            return
+
+        if not self.check_layer_available(grid_layer) :
+            return
+
+        # Journal of grid layer changes, for undo
+        journal = self.get_grid_journal()
+
+        # Fetch selected features from input grid_layer
+        selected_fIds = grid_layer.selectedFeatureIds()
+
+        # Clean user selection
+        grid_layer.selectByIds([])
+
+        # Coarsen grid in a background task
+        task = qgridder_utils.CoarsenTask( "Qgridder : coarsen " + grid_layer.name(),
+                grid_layer, selected_fIds, n, m, topoRules, on_finished = self.refine_task_finished,
+                journal = journal )
+        task.progressChanged.connect( lambda value : self.progressBarRegularRefine.setValue( int(value) ) )
+        self.start_task(task)
+
+
+    # ======= Topological rules of the selected model ========================================
+    def get_topo_rules(self):
         if self.checkTopo.isChecked() :
             if self.settings.dic_settings['model_type'] == 'Modflow':
                 topoRules = {'model':'modflow','nmax':1}
@@ -124,82 +229,145 @@ class QGridderDialogRefinement(QGridderDialog, Ui_QGridderRefinement):
                 QMessageBox.information(self, self.tr("Gridder"),
                     self.tr("Unknown model name for topology check")
                     )
-                return
+                return(None)
         else :
             topoRules = {'model': None, 'nmax': None}
+        return(topoRules)
+
+
+    # ======= Journal of grid changes ========================================
+    def get_grid_journal(self):
+        # journal recording refinement steps, None if grid backup is disabled
+        if self.settings.dic_settings['grid_backup'] != 'True' :
+            return(None)
+        self.settings.grid_journal.max_steps = int( self.settings.dic_settings['max_grid_backup'] )
+        return(self.settings.grid_journal)
+
+
+    # ======= Update edit, undo and redo buttons ========================================
+    def update_undo_buttons(self):
+        grid_layer = ftools_utils.getMapLayerByName( str( self.listGridLayer.currentText() ) )
+        journal = self.settings.grid_journal
+        # grid layer edited by a pending task : no other edit until it is committed
+        pending = grid_layer is not None and grid_layer.id() in self.settings.pending_layers
+        for button in (self.buttonRefine, self.buttonCoarsen, self.buttonAutoRefine) :
+            button.setEnabled(not pending)
+        self.buttonUndoRefine.setEnabled( grid_layer is not None and not pending and journal.can_undo(grid_layer) )
+        self.buttonRedoRefine.setEnabled( grid_layer is not None and not pending and journal.can_redo(grid_layer) )
+
+
+    # ======= Layers edited by pending tasks ========================================
+    def check_layer_available(self, grid_layer):
+        # False (with a message) if grid_layer is being edited by a pending task
+        if grid_layer.id() in self.settings.pending_layers :
+            QMessageBox.information(self, self.tr("Gridder"),
+                    self.tr("The grid layer is being modified by a running task, please wait until it is completed")
+                    )
+            return(False)
+        return(True)
 
+    def start_task(self, task):
+        # locks the grid layer of task until refine_task_finished
+        self.settings.pending_layers.add( task.grid_copy.layer_id )
+        self.update_undo_buttons()
+        self.tasks.append(task)
+        QgsApplication.taskManager().addTask(task)
 
-        # Load input grid layer
-        grid_layer = ftools_utils.getMapLayerByName( unicode( grid_layer_name ) )
 
-        if (grid_layer.selectedFeatureCount() == 0):
+    # ======= Automatic refinement around features ========================================
+    def run_auto_refine(self):
+
+        # selected grid layer and rule layer names
+        grid_layer_name = self.listGridLayer.currentText()
+        refine_layer_name = self.listRefineLayer.currentText()
+
+        if grid_layer_name == "" or refine_layer_name == "" :
             QMessageBox.information(self, self.tr("Gridder"),
-                    self.tr("No selected features in the chosen grid layer.")
+                    self.tr("Please specify a valid grid layer and a layer to refine around")
                     )
             return
 
-        # Set "wait" cursor and disable button
-        QApplication.setOverrideCursor(Qt.WaitCursor)
-        self.buttonRefine.setEnabled( False )
+        grid_layer = ftools_utils.getMapLayerByName( str( grid_layer_name ) )
+        refine_layer = ftools_utils.getMapLayerByName( str( refine_layer_name ) )
 
-        # Backup input grid layer
-        if self.settings.dic_settings['grid_backup'] == 'True' :
-            if len( self.settings.list_grid_bckup ) < int( self.settings.dic_settings['max_grid_backup'] ) :
-                backup_grid_layer = QgsVectorLayer("Polygon?crs=" + grid_layer.crs().authid(), 'backupLayer', providerLib =  'memory')
-                success, feature = backup_grid_layer.dataProvider().addFeatures( [feat for feat in grid_layer.getFeatures()] )
-                self.settings.list_grid_bckup.append( backup_grid_layer )
+        if refine_layer is None or refine_layer.type() != QgsMapLayer.VectorLayer or refine_layer == grid_layer :
+            QMessageBox.information(self, self.tr("Gridder"),
+                    self.tr("Please specify a vector layer (points, lines or polygons) other than the grid layer")
+                    )
+            return
 
-        # Fetch selected features from input grid_layer
-        selected_fIds = grid_layer.selectedFeatureIds()
+        # Set up topo Rules
+        topoRules = self.get_topo_rules()
+        if topoRules is None :
+            return
 
-        # Clean user selection
-        grid_layer.selectByIds([])
+        # refinement rule : target cell size at the features, growing away from them
+        growth = self.sboxGrowth.value()
+        rules = [ {'layer':refine_layer, 'size':self.sboxTargetSize.value(),
+            'growth': growth if growth > 1 else None} ]
 
-        # Init labels
-        self.labelIterations.show()
-        self.labelIter.show()
-        self.labelIter.setText(unicode(1))
+        if not self.check_layer_available(grid_layer) :
+            return
 
-        # Refine grid
-        qgridder_utils.refine_by_split(selected_fIds, n, m, topoRules, grid_layer, self.progressBarRegularRefine, self.labelIter)
+        # Journal of grid layer changes, for undo
+        journal = self.get_grid_journal()
 
-        # Refresh refined grid layer
-        self.iface.mapCanvas().refresh()
+        # Refine grid in a background task
+        task = qgridder_utils.RefineRulesTask( "Qgridder : refine " + grid_layer.name() + " around " + refine_layer.name(),
+                grid_layer, rules, topoRules, on_finished = self.refine_task_finished,
+                journal = journal )
+        task.progressChanged.connect( lambda value : self.progressBarRegularRefine.setValue( int(value) ) )
+        self.start_task(task)
 
-        # Post-operation information
-        QMessageBox.information(self, self.tr("Gridder"),
-                self.tr("Vector Grid Refined")
-                )
 
-        # Enable Write Grid button and reset cursor
-        self.buttonRefine.setEnabled( True )
-        QApplication.restoreOverrideCursor()
+    # ======= Refine task completed ========================================
+    def refine_task_finished(self, task, result):
+        self.tasks.remove(task)
+        self.settings.pending_layers.discard( task.grid_copy.layer_id )
+        self.update_undo_buttons()
+
+        if not result :
+            message = self.tr("Refinement canceled, grid layer unchanged")
+            if task.exception is not None :
+                message = self.tr("Refinement failed : ") + str(task.exception)
+            QMessageBox.information(self, self.tr("Gridder"), message)
+            return
 
         # Refresh map canvas
         self.iface.mapCanvas().refresh()
 
+        # Post-operation information
+        if isinstance(task, qgridder_utils.CoarsenTask) :
+            message = self.tr("Vector Grid Coarsened")
+        else :
+            message = self.tr("Vector Grid Refined")
+        QMessageBox.information(self, self.tr("Gridder"), message)
+
         # Enable undo button
-        if self.settings.dic_settings['grid_backup'] == 'True' :
-            self.buttonUndoRefine.setEnabled(True)
+        self.update_undo_buttons()
 
 
     # ======= Undo Refine grid ========================================
     def run_undo_refine(self) :
-        if len(self.settings.list_grid_bckup) > 0 :
-            # selected grid layer name
-            grid_layer_name = self.listGridLayer.currentText()
-            # Load input grid layer
-            grid_layer = ftools_utils.getMapLayerByName( unicode( grid_layer_name ) )
-            # retrieve last backup layer
-            backup_grid_layer = self.settings.list_grid_bckup[-1]
-            # remove all elements in grid layer
-            grid_layer.dataProvider().deleteFeatures( [feat.id() for feat in grid_layer.getFeatures()] )
-            # populate grid layer with backup layer features
-            grid_layer.dataProvider().addFeatures( [feat for feat in backup_grid_layer.getFeatures()] )
-            # remove last backup
-            self.settings.list_grid_bckup.pop()
-
-
-
+        # selected grid layer name
+        grid_layer_name = self.listGridLayer.currentText()
+        # Load input grid layer
+        grid_layer = ftools_utils.getMapLayerByName( str( grid_layer_name ) )
+        if grid_layer is not None and self.check_layer_available(grid_layer) :
+            # restore cells removed by the last refinement step
+            self.settings.grid_journal.undo(grid_layer)
+            self.iface.mapCanvas().refresh()
+        self.update_undo_buttons()
 
 
+    # ======= Redo Refine grid ========================================
+    def run_redo_refine(self) :
+        # selected grid layer name
+        grid_layer_name = self.listGridLayer.currentText()
+        # Load input grid layer
+        grid_layer = ftools_utils.getMapLayerByName( str( grid_layer_name ) )
+        if grid_layer is not None and self.check_layer_available(grid_layer) :
+            # apply again the last undone refinement step
+            self.settings.grid_journal.redo(grid_layer)
+            self.iface.mapCanvas().refresh()
+        self.update_undo_buttons()
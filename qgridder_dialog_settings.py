@@ -100,6 +100,7 @@ class QGridderDialogSettings(QGridderDialog, Ui_QGridderSettings):
         plot_obs =  self.settings.dic_settings['plot_obs']
         plot_simul =  self.settings.dic_settings['plot_simul']
         grid_backup =  self.settings.dic_settings['grid_backup']
+        nproc = self.settings.dic_settings['nproc']
 
         self.listModelTypes.setCurrentIndex(self.listModelTypes.findText(model_type))
         self.listGridLayer.setCurrentIndex(self.listGridLayer.findText(support_grid_layer_name))
@@ -124,6 +125,8 @@ class QGridderDialogSettings(QGridderDialog, Ui_QGridderSettings):
         else :
             self.checkGridBackup.setChecked( False )
 
+        self.sboxProcesses.setValue( int(nproc) )
+
 
     def browse_simul_file(self):
         """
@@ -206,6 +209,7 @@ class QGridderDialogSettings(QGridderDialog, Ui_QGridderSettings):
         dic_settings['plot_obs'] = str(self.checkPlotObs.isChecked())
         dic_settings['plot_simul'] = str(self.checkPlotSimul.isChecked())
         dic_settings['grid_backup'] = str(self.checkGridBackup.isChecked())
+        dic_settings['nproc'] = str(self.sboxProcesses.value())
 
         # update self.settings.dic_settings
         self.settings.update_settings(dic_settings)
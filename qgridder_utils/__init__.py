@@ -2,4 +2,12 @@
 """
 """
 from .base import *
+from .rgrid import *
+from .qtree import *
+from .adjacency import *
+from .extents import *
+from .journal import *
+from .vertical import *
+from .progress import *
 from .pproc import *
+from .tasks import *
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qgridder_utils_adjacency.py
+                                 Qgridder - A QGIS plugin
+
+ This file provides the adjacency graph of grid cells : for each cell,
+ the ids of the cells sharing an edge, the direction of the neighbor and
+ the length of the shared edge, stored as CSR (compressed sparse row) arrays.
+ It only relies on Numpy.
+
+ Qgridder Builds 2D regular and unstructured grids and comes together with
+ pre- and post-processing capabilities for spatially distributed modeling.
+
+                              -------------------
+        begin                : 2013-04-08
+        copyright            : (C) 2013 by Pryet
+        email                : alexandre.pryet@ensegid.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import numpy as np
+
+from .rgrid import rotate, estimate_angle
+
+# ======================================================================================
+
+# Global constants
+
+# Direction of neighbors, as in find_neighbors()
+# | 8 | 1 | 5 |
+# | 4 | 0 | 2 |
+# | 7 | 3 | 6 |
+ADJ_TOP = 1
+ADJ_RIGHT = 2
+ADJ_BOTTOM = 3
+ADJ_LEFT = 4
+
+FACE_DTYPE = np.dtype([ ('coord', '<f8'), ('bound', '<f8') ])
+
+# ======================================================================================
+def face_pairs(coord_a, lo_a, hi_a, coord_b, lo_b, hi_b):
+    """
+    Description
+    ----------
+    Matches two sets of axis-aligned faces (cell edges) : face a of coordinate coord_a
+    spanning [lo_a, hi_a] is matched with the faces b of same coordinate which overlap it
+    with a positive length. Faces of b with the same coordinate must not overlap
+    each other (e.g. left edges of the cells of a grid).
+    This is a vectorized sorted join : b faces are sorted by (coord, lo) and
+    matching ranges are found with binary searches.
+
+    Parameters
+    ----------
+    coord_a, lo_a, hi_a : arrays of coordinates and bounds of faces a
+    coord_b, lo_b, hi_b : arrays of coordinates and bounds of faces b
+
+    Returns
+    -------
+    (ia, ib, length) : indexes of matching faces of a and b, and length of their overlap
+
+    Examples
+    --------
+    >>> ia, ib, length = face_pairs(xmax, ymin, ymax, xmin, ymin, ymax)
+    """
+    coord_a, lo_a, hi_a = [ np.asarray(v, dtype=float) for v in (coord_a, lo_a, hi_a) ]
+    coord_b, lo_b, hi_b = [ np.asarray(v, dtype=float) for v in (coord_b, lo_b, hi_b) ]
+    if coord_a.size == 0 or coord_b.size == 0 :
+        empty = np.array([], dtype=np.int64)
+        return( empty, empty, np.array([], dtype=float) )
+
+    # sort b faces by coordinate and lower bound
+    order = np.lexsort( (lo_b, coord_b) )
+    b_lo = np.empty(order.size, dtype=FACE_DTYPE)
+    b_lo['coord'], b_lo['bound'] = coord_b[order], lo_b[order]
+    # faces of same coordinate do not overlap : upper bounds are sorted as well
+    b_hi = np.empty(order.size, dtype=FACE_DTYPE)
+    b_hi['coord'], b_hi['bound'] = coord_b[order], hi_b[order]
+
+    # first b face with hi_b > lo_a, and first b face with lo_b >= hi_a
+    query = np.empty(coord_a.size, dtype=FACE_DTYPE)
+    query['coord'], query['bound'] = coord_a, lo_a
+    start = np.searchsorted(b_hi, query, 'right')
+    query['bound'] = hi_a
+    end = np.searchsorted(b_lo, query, 'left')
+    counts = np.maximum(end - start, 0)
+
+    # expand ranges into pairs
+    ia = np.repeat( np.arange(coord_a.size), counts )
+    offsets = np.repeat( np.cumsum(counts) - counts, counts )
+    ib = order[ np.repeat(start, counts) + np.arange(ia.size) - offsets ]
+    length = np.minimum(hi_a[ia], hi_b[ib]) - np.maximum(lo_a[ia], lo_b[ib])
+
+    valid = (length > 0) & (coord_a[ia] == coord_b[ib])
+    return( ia[valid], ib[valid], length[valid] )
+
+
+# ======================================================================================
+def extent_pairs(xmin, xmax, ymin, ymax):
+    """
+    Description
+    ----------
+    Finds the pairs of axis-aligned rectangular cells sharing an edge,
+    from the extents of the cells (see face_pairs).
+
+    Parameters
+    ----------
+    xmin, xmax, ymin, ymax : arrays of cell extents
+
+    Returns
+    -------
+    (src, dst, direction, length) : arrays of cell indexes, direction of dst
+    from src (ADJ_TOP, ADJ_RIGHT, ADJ_BOTTOM, ADJ_LEFT) and length of the shared edge.
+    Each pair is given in both directions.
+
+    Examples
+    --------
+    >>> src, dst, direction, length = extent_pairs(xmin, xmax, ymin, ymax)
+    """
+    # right edges against left edges, top edges against bottom edges
+    i_left, i_right, len_x = face_pairs(xmax, ymin, ymax, xmin, ymin, ymax)
+    i_bottom, i_top, len_y = face_pairs(ymax, xmin, xmax, ymin, xmin, xmax)
+
+    src = np.concatenate( (i_left, i_right, i_bottom, i_top) )
+    dst = np.concatenate( (i_right, i_left, i_top, i_bottom) )
+    direction = np.concatenate( ( np.full(i_left.size, ADJ_RIGHT), np.full(i_right.size, ADJ_LEFT),
+        np.full(i_bottom.size, ADJ_TOP), np.full(i_top.size, ADJ_BOTTOM) ) ).astype(np.int8)
+    length = np.concatenate( (len_x, len_x, len_y, len_y) )
+    return(src, dst, direction, length)
+
+
+# ======================================================================================
+class CellAdjacency(object):
+    """
+    Description
+    -----------
+    Adjacency graph of the rectangular cells of a grid (structured, nested or
+    refined). Neighbors are the cells sharing an edge with a positive length.
+    Rotated grids are handled in the grid frame, rotated by angle around origin.
+
+    The graph is available as CSR arrays (see csr()) : the neighbors of the
+    k-th cell of fids are indices[indptr[k]:indptr[k+1]], with their direction
+    and the length of the shared edge. It is updated incrementally when cells
+    are split or merged (see update()).
+
+    Attributes
+    ----------
+    fids : sorted array of feature ids
+    xmin, xmax, ymin, ymax : cell extents in the grid frame (same order as fids)
+    angle, origin : rotation of the grid frame
+    decimals : number of decimals considered to compare coordinates
+
+    Examples
+    --------
+    >>> adjacency = CellAdjacency.from_corners(fids, cx, cy)
+    >>> nbr_fids, direction, length = adjacency.neighbors(fid)
+    >>> fids, indptr, indices, direction, length = adjacency.csr()
+    """
+
+    def __init__(self, fids, xmin, xmax, ymin, ymax, angle = 0., origin = (0., 0.), decimals = 6):
+        self.angle = float(angle)
+        self.origin = ( float(origin[0]), float(origin[1]) )
+        self.decimals = decimals
+        fids = np.asarray(fids, dtype=np.int64)
+        order = np.argsort(fids)
+        self.fids = fids[order]
+        self.xmin, self.xmax, self.ymin, self.ymax = [ np.around( np.asarray(v, dtype=float)[order], decimals ) \
+                for v in (xmin, xmax, ymin, ymax) ]
+        # edges, stored as feature ids (both directions)
+        src, dst, self.direction, self.length = extent_pairs(self.xmin, self.xmax, self.ymin, self.ymax)
+        self.src, self.dst = self.fids[src], self.fids[dst]
+        self._csr = None
+
+    @classmethod
+    def from_corners(cls, fids, cx, cy, decimals = 6, angle = None):
+        """
+        Description
+        ----------
+        Builds the adjacency graph from the corners of the cells
+
+        Parameters
+        ----------
+        fids : array of feature ids
+        cx, cy : arrays of shape (N, 4) with the corner coordinates of the cells
+        decimals : number of decimals considered to compare coordinates
+        angle (optional) : rotation angle of the grid, estimated from the cells
+                 if not provided (see estimate_angle)
+
+        Returns
+        -------
+        CellAdjacency instance
+
+        Examples
+        --------
+        >>> adjacency = CellAdjacency.from_corners(fids, cx, cy)
+        """
+        cx = np.asarray(cx, dtype=float).reshape(-1, 4)
+        cy = np.asarray(cy, dtype=float).reshape(-1, 4)
+        if angle is None :
+            angle = estimate_angle(cx, cy) if cx.shape[0] > 0 else 0.
+        origin = (cx[0,0], cy[0,0]) if cx.shape[0] > 0 else (0., 0.)
+        lx, ly = rotate(cx, cy, -angle, origin)
+        return( cls(fids, lx.min(axis=1), lx.max(axis=1), ly.min(axis=1), ly.max(axis=1),
+            angle, origin, decimals) )
+
+    def __len__(self):
+        return(self.fids.size)
+
+    def local_extents(self, cx, cy):
+        """ extents of cells in the grid frame, from their corners (map coordinates) """
+        cx = np.asarray(cx, dtype=float).reshape(-1, 4)
+        cy = np.asarray(cy, dtype=float).reshape(-1, 4)
+        lx, ly = rotate(cx, cy, -self.angle, self.origin)
+        return( [ np.around(v, self.decimals) for v in (lx.min(axis=1), lx.max(axis=1),
+            ly.min(axis=1), ly.max(axis=1)) ] )
+
+    def index(self, fids):
+        """
+        Description
+        ----------
+        Returns the position of fids in self.fids.
+        Raises KeyError if a fid is not in the grid.
+        """
+        fids = np.atleast_1d( np.asarray(fids, dtype=np.int64) )
+        pos = np.clip( np.searchsorted(self.fids, fids), 0, max(self.fids.size - 1, 0) )
+        if self.fids.size == 0 or np.any( self.fids[pos] != fids ) :
+            raise KeyError('Feature ids not found in grid : %s' % fids)
+        return(pos)
+
+    def csr(self):
+        """
+        Description
+        ----------
+        Returns the adjacency graph as CSR arrays
+
+        Returns
+        -------
+        (fids, indptr, indices, direction, length) : neighbors of fids[k] are
+        indices[indptr[k]:indptr[k+1]] (feature ids), with their direction
+        (ADJ_TOP, ADJ_RIGHT, ADJ_BOTTOM, ADJ_LEFT) and the length of the shared edge
+
+        Examples
+        --------
+        >>> fids, indptr, indices, direction, length = adjacency.csr()
+        """
+        if self._csr is None :
+            order = np.lexsort( (self.direction, self.src) )
+            indptr = np.searchsorted( self.src[order], self.fids, 'left' )
+            indptr = np.append( indptr, order.size )
+            self._csr = ( self.fids, indptr, self.dst[order], self.direction[order], self.length[order] )
+        return(self._csr)
+
+    def neighbors(self, fid):
+        """
+        Description
+        ----------
+        Returns the neighbors of cell fid
+
+        Returns
+        -------
+        (fids, direction, length) : arrays of neighbor ids, direction of neighbors
+        and length of shared edges
+
+        Examples
+        --------
+        >>> nbr_fids, direction, length = adjacency.neighbors(fid)
+        """
+        fids, indptr, indices, direction, length = self.csr()
+        k = self.index(fid)[0]
+        start, end = indptr[k], indptr[k+1]
+        return( indices[start:end], direction[start:end], length[start:end] )
+
+    def extents(self, fids):
+        """ extents (xmin, xmax, ymin, ymax) of cells fids in the grid frame """
+        pos = self.index(fids)
+        return( self.xmin[pos], self.xmax[pos], self.ymin[pos], self.ymax[pos] )
+
+    def update(self, deleted_fids, fids, cx, cy):
+        """
+        Description
+        ----------
+        Updates the graph when cells deleted_fids are replaced by cells fids
+        (split or merge). New cells must lie within the area of deleted cells,
+        so that their neighbors are new cells or neighbors of deleted cells.
+        Only these cells are compared.
+
+        Parameters
+        ----------
+        deleted_fids : ids of deleted cells
+        fids : ids of new cells
+        cx, cy : arrays of shape (N, 4) with the corner coordinates of new cells
+
+        Examples
+        --------
+        >>> new_fids = split_cells(fix_set, grid_layer)
+        >>> adjacency.update(fix_set.ids, new_fids, cx, cy)
+        """
+        deleted_fids = np.asarray(deleted_fids, dtype=np.int64)
+        fids = np.asarray(fids, dtype=np.int64)
+
+        # neighbors of deleted cells, which may be neighbors of new cells
+        is_deleted_src = np.isin(self.src, deleted_fids)
+        is_deleted_dst = np.isin(self.dst, deleted_fids)
+        candidates = np.unique( self.dst[is_deleted_src & ~is_deleted_dst] )
+
+        # remove deleted cells and their edges
+        keep = ~( is_deleted_src | is_deleted_dst )
+        self.src, self.dst = self.src[keep], self.dst[keep]
+        self.direction, self.length = self.direction[keep], self.length[keep]
+        keep = ~np.isin(self.fids, deleted_fids)
+        self.fids, self.xmin, self.xmax, self.ymin, self.ymax = [ v[keep] for v in \
+                (self.fids, self.xmin, self.xmax, self.ymin, self.ymax) ]
+
+        # edges between new cells, and between new cells and candidates
+        xmin, xmax, ymin, ymax = self.local_extents(cx, cy)
+        pos = self.index(candidates) if candidates.size > 0 else np.array([], dtype=np.int64)
+        local_fids = np.concatenate( (fids, self.fids[pos]) )
+        src, dst, direction, length = extent_pairs( np.concatenate( (xmin, self.xmin[pos]) ),
+            np.concatenate( (xmax, self.xmax[pos]) ), np.concatenate( (ymin, self.ymin[pos]) ),
+            np.concatenate( (ymax, self.ymax[pos]) ) )
+        new = (src < fids.size) | (dst < fids.size)
+        self.src = np.concatenate( (self.src, local_fids[src[new]]) )
+        self.dst = np.concatenate( (self.dst, local_fids[dst[new]]) )
+        self.direction = np.concatenate( (self.direction, direction[new]) )
+        self.length = np.concatenate( (self.length, length[new]) )
+
+        # add new cells, keeping fids sorted
+        all_fids = np.concatenate( (self.fids, fids) )
+        order = np.argsort(all_fids)
+        self.fids = all_fids[order]
+        self.xmin, self.xmax, self.ymin, self.ymax = [ np.concatenate( (old, new_values) )[order] for old, new_values in \
+                zip( (self.xmin, self.xmax, self.ymin, self.ymax), (xmin, xmax, ymin, ymax) ) ]
+        self._csr = None
@@ -37,7 +37,17 @@ from qgis.core import *
 
 import numpy as np
 import multiprocessing as mp
+import collections
+import concurrent.futures
+import os
+import sys
 from . import ftools_utils
+from .rgrid import *
+from .qtree import *
+from .adjacency import *
+from .extents import *
+from .vertical import *
+from .progress import *
 import time
 
 # ======================================================================================
@@ -46,21 +56,43 @@ import time
 
 TOLERANCE = 1e-6  # absolute tolerance
 MAX_DECIMALS = 6  # used to limit the effects of numerical noise
+BAND_SIZE = 100000  # default number of cells built and flushed at once by make_rgrid
+GRID_ANGLE_PROPERTY = 'qgridder/angle'  # layer custom property : rotation angle of the grid
 
 # ======================================================================================
-def make_rgrid(input_feat, n, m, vprovider, progress_bar = None ):
+def make_rgrid(input_feat, n, m, vprovider, progress_bar = None, band_size = None, delr = None, delc = None, nproc = 1,
+        angle = 0., origin = None ):
     """
     Description
     ----------
     Builds regular grid of n lines and m columns, from QgsRectangle bbox.
-    Resulting features are appended to vprovider
+    Resulting features are appended to vprovider.
+    Cell coordinates are computed at once with Numpy and packed into
+    a single WKB buffer, from which geometries are loaded.
+    The grid is produced in bands of lines, each band being flushed to
+    vprovider before the next one is built, so that peak memory is bounded
+    by the band size.
+    With nproc > 1, the WKB buffers of the bands are built by a pool of
+    processes, and features are appended in the same order as with nproc = 1.
+    If delr and delc are provided, cells of variable dimensions are built
+    from the top-left corner of the bounding box, and n, m are ignored.
+    If angle is provided, the bounding box is considered in the grid frame,
+    and all cell corners are rotated by angle around origin.
 
     Parameters
     ----------
     input_feat : Qgis feature whose bounding box will be used to define the extents of the grid.
                 It can be generated by QgsRectangle()
     n, m      : number of rows and columns of output grid, respectively
-    vprovider : Qgis vector provider to which the output grid will be appended
+    vprovider : Qgis vector provider (or QgsVectorFileWriter) to which the output grid will be appended
+    progress_bar : progress bar in dialog (or ProgressReporter). If canceled, the
+                   bands already built are kept and no further band is built.
+    band_size : number of grid lines per band. If None, bands of about BAND_SIZE cells are used.
+    delr (optional) : array of column widths, from left to right
+    delc (optional) : array of row heights, from top to bottom
+    nproc : number of processes building cell geometries
+    angle : rotation angle of the grid, in degrees (counter-clockwise)
+    origin : (x, y) center of rotation, defaults to the bottom-left corner of the bounding box
 
     Returns
     -------
@@ -77,66 +109,300 @@ def make_rgrid(input_feat, n, m, vprovider, progress_bar = None ):
     attr = input_feat.attributes()
 
     # Compute grid coordinates
-    x = np.linspace(bbox.xMinimum(), bbox.xMaximum(), m+1)
-    y = np.linspace(bbox.yMinimum(), bbox.yMaximum(), n+1)
-    xx, yy = np.meshgrid(x, y)
+    if delr is not None and delc is not None :
+        delr = np.atleast_1d( np.asarray(delr, dtype=float) )
+        delc = np.atleast_1d( np.asarray(delc, dtype=float) )
+        n, m = delc.size, delr.size
+        x = bbox.xMinimum() + np.concatenate( ([0.], np.cumsum(delr)) )
+        y = ( bbox.yMaximum() - np.concatenate( ([0.], np.cumsum(delc)) ) )[::-1]
+    else :
+        x = np.linspace(bbox.xMinimum(), bbox.xMaximum(), m+1)
+        y = np.linspace(bbox.yMinimum(), bbox.yMaximum(), n+1)
+
+    # Center of rotation
+    if origin is None :
+        origin = (bbox.xMinimum(), bbox.yMinimum())
+
+    # Number of lines per band
+    if band_size is None :
+        band_size = max(1, BAND_SIZE // m)
+
+    # Check type of vector provider
+    # If vprovider is a layer provider, new feature ids are returned
+    is_provider = repr(QgsVectorDataProvider) == str(type(vprovider))
 
     # Initialize progress bar
-    if progress_bar is not None : 
-        progress_bar.setRange(0,100)
-        progress_bar.setValue(0)
-    count = 0
-    countMax = n*m
-    countUpdate = countMax * 0.05 # update each 5%
-
-    # Initialize feature output list
-    out_feat_list = []
-
-    # iterate over grid lines
-    for i in range(len(y)-1):
-        # iterate over grid columns
-        for j in range(len(x)-1):
-            # compute feature coordinate
-            # clock-wise point numbering (top-left, top-right, bottom-right, bottom-left)
-            # i for lines (top to bottom), j for columns (left to right)
-            x1, x2, x3, x4 = xx[i+1,j],  xx[i+1,j+1],  xx[i,j+1],  xx[i,j]
-            y1, y2, y3, y4 = yy[i+1,j],  yy[i+1,j+1],  yy[i,j+1],  yy[i,j]
-            # define feature points
-            pt1, pt2, pt3, pt4 =  QgsPointXY(x1, y1), QgsPointXY(x2, y2), QgsPointXY(x3, y3), QgsPointXY(x4, y4)
-            pt5 = pt1
-            # define polygon from points
-            polygon = [[pt1, pt2, pt3, pt4, pt5]]
+    progress = get_progress_reporter(progress_bar, total = n)
+
+    # Initialize output list of feature ids
+    out_feat_ids = []
+
+    # bands of grid lines
+    bands = [ (i_start, min(i_start + band_size, n)) for i_start in range(0, n, band_size) ]
+    wkb_size = WKB_RECT_DTYPE.itemsize
+
+    # iterate over bands of grid lines
+    # The corners of all cells in the band are packed into one WKB buffer
+    # clock-wise point numbering (top-left, top-right, bottom-right, bottom-left)
+    # cells are ordered by lines (bottom to top), then columns (left to right)
+    for (i_start, i_end), wkb in zip( bands, iter_rgrid_wkb(x, y, bands, nproc, angle, origin) ):
+
+        # Initialize feature list of the band
+        out_feat_list = []
+
+        # iterate over the cells of the band
+        for k in range( (i_end - i_start)*m ):
             # initialize new feature
             out_feat = QgsFeature()
             out_feat.setAttributes(attr)
             out_geom = QgsGeometry()
-            out_feat.setGeometry(out_geom.fromPolygonXY(polygon))
+            out_geom.fromWkb( wkb[k*wkb_size:(k+1)*wkb_size] )
+            out_feat.setGeometry(out_geom)
             # save features
             out_feat_list.append(out_feat)
-            # update counter
-            count += 1
-            # update ID (TO DO : check numbering)
-            #idvar = count
-            # each 5%, update progress bar
-            if int( np.fmod( count, countUpdate ) ) == 0:
-                    prog = int( count / countMax * 100 )
-                    if progress_bar is not None : 
-                        progress_bar.setValue(prog)
-                    QApplication.processEvents()
-
-    if progress_bar is not None : 
-        progress_bar.setValue(100)
-    # Check type of vector provider
-    # If vprovider is a layer provider
-    if repr(QgsVectorDataProvider) == str(type(vprovider)):
-        isFeatureAddSuccessful, newFeatures = vprovider.addFeatures(out_feat_list)
-        return([feat.id() for feat in newFeatures])
 
-    # Else, if provider is a writer
+        # flush band to vprovider
+        if is_provider :
+            isFeatureAddSuccessful, newFeatures = vprovider.addFeatures(out_feat_list)
+            out_feat_ids.extend( [feat.id() for feat in newFeatures] )
+        else :
+            vprovider.addFeatures(out_feat_list)
+
+        # release band
+        del out_feat_list, wkb
+
+        # update progress bar at the end of each band
+        if progress.update(i_end) :
+            break
+
+    progress.finish()
+
+    return(out_feat_ids)
+
+
+# ======================================================================================
+def create_grid_writer(file_name, encoding, fields, crs = None):
+    """
+    Description
+    ----------
+    Returns a QgsVectorFileWriter for a new grid file.
+    The driver is chosen from the file extension : GeoPackage for .gpkg files,
+    ESRI Shapefile otherwise.
+    For GeoPackages, the spatial index is not updated at each insertion, it has
+    to be built once the file is written with build_spatial_index().
+    Features are written within a single transaction, committed when the writer
+    is deleted, so that appending them by bands (see make_rgrid) avoids per-row commits.
+
+    Parameters
+    ----------
+    file_name : path of the output file
+    encoding : file encoding
+    fields : QgsFields of the grid
+    crs : QgsCoordinateReferenceSystem of the grid
+
+    Returns
+    -------
+    QgsVectorFileWriter
+
+    Examples
+    --------
+    >>> writer = create_grid_writer('grid.gpkg', 'UTF-8', fields, crs)
+    """
+    if os.path.splitext(file_name)[1].lower() == '.gpkg' :
+        driver_name = "GPKG"
+        layer_options = ['SPATIAL_INDEX=NO']
+    else :
+        driver_name = "ESRI Shapefile"
+        layer_options = []
+
+    return( QgsVectorFileWriter(file_name, encoding, fields, QgsWkbTypes.Polygon,
+        crs, driverName = driver_name, layerOptions = layer_options) )
+
+
+# ======================================================================================
+def build_spatial_index(file_name):
+    """
+    Description
+    ----------
+    Builds, at once, the spatial index of a grid file written with create_grid_writer()
+
+    Parameters
+    ----------
+    file_name : path of the grid file
+
+    Returns
+    -------
+    True if the spatial index has been built
+
+    Examples
+    --------
+    >>> build_spatial_index('grid.gpkg')
+    """
+    v_layer = QgsVectorLayer(file_name, 'grid', 'ogr')
+    if not v_layer.isValid() :
+        return(False)
+    if not v_layer.dataProvider().capabilities() & QgsVectorDataProvider.CreateSpatialIndex :
+        return(False)
+    return( v_layer.dataProvider().createSpatialIndex() )
+
+
+# ======================================================================================
+def get_python_executable():
+    """
+    Description
+    ----------
+    Returns the path of the python interpreter used to launch worker processes.
+    Within Qgis, sys.executable is usually Qgis itself (Windows, macOS, and some
+    Linux packages), so that the interpreter is searched in sys.exec_prefix.
+
+    Returns
+    -------
+    path of the python interpreter
+
+    Examples
+    --------
+    >>> get_python_executable()
+    '/usr/bin/python3'
+    """
+    if os.path.basename(sys.executable).lower().startswith('python') :
+        return(sys.executable)
+    if sys.platform == 'win32' :
+        candidates = [ os.path.join(sys.exec_prefix, 'pythonw.exe'), os.path.join(sys.exec_prefix, 'python.exe') ]
     else :
-        for out_feat in out_feat_list:
-            vprovider.addFeature(out_feat)
-        return([])
+        version = '%d.%d' % sys.version_info[:2]
+        candidates = [ os.path.join(sys.exec_prefix, 'bin', 'python' + version),
+                os.path.join(sys.exec_prefix, 'bin', 'python3') ]
+    for candidate in candidates :
+        if os.path.isfile(candidate) :
+            return(candidate)
+    return(sys.executable)
+
+
+_PROCESS_CONTEXT = None
+
+def get_process_pool(nproc):
+    """
+    Description
+    ----------
+    Returns a pool of nproc worker processes.
+    Worker processes are always spawned, since forking the multithreaded
+    Qgis process (e.g. from a QgsTask) is unsafe. The python interpreter
+    of workers (see get_python_executable) is set once, on the spawn context.
+
+    Parameters
+    ----------
+    nproc : number of processes
+
+    Returns
+    -------
+    multiprocessing.Pool
+
+    Examples
+    --------
+    >>> pool = get_process_pool(4)
+    """
+    global _PROCESS_CONTEXT
+    if _PROCESS_CONTEXT is None :
+        _PROCESS_CONTEXT = mp.get_context('spawn')
+        _PROCESS_CONTEXT.set_executable( get_python_executable() )
+    return( _PROCESS_CONTEXT.Pool(nproc) )
+
+
+# ======================================================================================
+def iter_rgrid_wkb(x, y, bands, nproc = 1, angle = 0., origin = (0., 0.)):
+    """
+    Description
+    ----------
+    Yields the WKB buffers of bands of a regular grid, in band order.
+    With nproc > 1, buffers are built by a pool of processes. At most
+    2*nproc bands are pending at once, so that memory remains bounded
+    when buffers are consumed slower than they are produced.
+
+    Parameters
+    ----------
+    x : array of increasing x coordinates of column edges
+    y : array of increasing y coordinates of row edges
+    bands : list of (i_start, i_end) line ranges
+    nproc : number of processes
+    angle, origin : rotation of the grid (see rgrid_corners)
+
+    Returns
+    -------
+    Generator of WKB buffers (see rgrid_wkb)
+
+    Examples
+    --------
+    >>> for wkb in iter_rgrid_wkb(x, y, [(0, 10), (10, 20)], nproc = 2) :
+    """
+    if nproc <= 1 or len(bands) <= 1 :
+        for i_start, i_end in bands :
+            yield( rgrid_wkb(x, y[i_start:i_end+1], angle, origin) )
+        return
+
+    pool = get_process_pool(nproc)
+    try :
+        pending = collections.deque()
+        for i_start, i_end in bands :
+            pending.append( pool.apply_async(rgrid_wkb, (x, y[i_start:i_end+1], angle, origin)) )
+            if len(pending) >= 2*nproc :
+                yield( pending.popleft().get() )
+        while len(pending) > 0 :
+            yield( pending.popleft().get() )
+    finally :
+        pool.terminate()
+
+
+# ======================================================================================
+def get_graded_delr_delc(bbox, res_min, res_max, growth, features, angle = 0., origin = None, res_max_y = None):
+    """
+    Description
+    ----------
+    Computes variable cell dimensions (delr, delc) over bbox, with cells of size
+    res_min over the extents of control features (e.g. wells, rivers) and cells
+    growing smoothly away from them, up to res_max (res_max_y along y). See graded_edges()
+
+    Parameters
+    ----------
+    bbox : QgsRectangle, extent of the grid
+    res_min, res_max : minimum and maximum cell sizes
+    growth : growth rate of cell sizes away from control features (>= 1)
+    features : iterable of control features (points, lines or polygons)
+    angle, origin (optional) : rotation of the grid, as in make_rgrid. Control features
+            are then projected in the grid frame.
+    res_max_y (optional) : maximum cell size along y (rows), res_max by default
+
+    Returns
+    -------
+    (delr, delc) arrays, delr from left to right and delc from top to bottom,
+    to be passed to make_rgrid
+
+    Examples
+    --------
+    >>> delr, delc = get_graded_delr_delc(layer.extent(), 10., 100., 1.2, wells.getFeatures())
+    """
+    if origin is None :
+        origin = (bbox.xMinimum(), bbox.yMinimum())
+    if res_max_y is None :
+        res_max_y = res_max
+
+    # project the extent of control features on x and y axes (of the grid frame)
+    x_controls, y_controls = [], []
+    for feat in features :
+        if angle != 0 :
+            points = ftools_utils.extractPoints(feat.geometry())
+            x, y = rotate( [p.x() for p in points], [p.y() for p in points], -angle, origin )
+            x_controls.append( (x.min(), x.max()) )
+            y_controls.append( (y.min(), y.max()) )
+        else :
+            feat_bbox = feat.geometry().boundingBox()
+            x_controls.append( (feat_bbox.xMinimum(), feat_bbox.xMaximum()) )
+            y_controls.append( (feat_bbox.yMinimum(), feat_bbox.yMaximum()) )
+
+    x = graded_edges(bbox.xMinimum(), bbox.xMaximum(), res_min, res_max, x_controls, growth)
+    y = graded_edges(bbox.yMinimum(), bbox.yMaximum(), res_min, res_max_y, y_controls, growth)
+
+    # delc from top to bottom
+    return( np.diff(x), np.diff(y)[::-1] )
 
 
 # ======================================================================================
@@ -151,32 +417,72 @@ def make_rgrid(input_feat, n, m, vprovider, progress_bar = None ):
 
 
 # ======================================================================================
-def rect_size(input_feature):
+def rect_size(input_feature, extents = None):
     """
     Description
 
     Parameters
     ----------
     input_feature : Qgis vector feature
+    extents (optional) : CellExtentCache of the layer of input_feature (see get_cell_extents).
+                If provided, the size is read from the cache.
 
     Returns
     -------
 
-    Dictionary {'dx':dx,'dy':dy} where dx and dy are the extents of input_feature.
+    Dictionary {'dx':dx,'dy':dy} where dx and dy are the dimensions of input_feature
+    along its own edges (so that the size of rotated cells is correct).
 
     Examples
     --------
     >>>
     """
 
+    if extents is not None :
+        dx, dy = extents.sizes( input_feature.id() )
+        return( {'dx':float(dx[0]),'dy':float(dy[0])} )
+
     # Extract the four corners of input_feature
     # Note : rectangle points are numbered from top-left to bottom-left, clockwise
     p0, p1, p2, p3 = ftools_utils.extractPoints(input_feature.geometry())[:4]
     # Compute size
-    dx = abs(p1.x() - p0.x())
-    dy = abs(p3.y() - p0.y())
+    dx = np.hypot( p1.x() - p0.x(), p1.y() - p0.y() )
+    dy = np.hypot( p3.x() - p0.x(), p3.y() - p0.y() )
     return( {'dx':dx,'dy':dy} )
 
+# ======================================================================================
+def get_cell_frame(input_feature):
+    """
+    Description
+    ----------
+    Returns the rotation angle of a rectangular cell, and its geometry in the
+    cell frame (rotated by -angle around its top-left corner), so that it can
+    be split with make_rgrid(..., angle = angle, origin = origin).
+
+    Parameters
+    ----------
+    input_feature : Qgis vector feature (rectangular cell)
+
+    Returns
+    -------
+    (angle, origin, bbox) : angle in degrees (counter-clockwise), origin (x, y) of the
+    top-left corner, and QgsRectangle of the cell in the cell frame.
+
+    Examples
+    --------
+    >>> angle, origin, bbox = get_cell_frame(feat)
+    """
+    # Note : rectangle points are numbered from top-left to bottom-left, clockwise
+    points = ftools_utils.extractPoints(input_feature.geometry())[:4]
+    cx = np.array( [[ p.x() for p in points ]] )
+    cy = np.array( [[ p.y() for p in points ]] )
+    # orientation of the top edge, so that corner numbering is preserved in split cells
+    angle = np.around( np.degrees( np.arctan2(cy[0,1] - cy[0,0], cx[0,1] - cx[0,0]) ), 9 ) + 0.
+    origin = (cx[0,0], cy[0,0])
+    lx, ly = rotate(cx, cy, -angle, origin)
+    bbox = QgsRectangle( lx.min(), ly.min(), lx.max(), ly.max() )
+    return(angle, origin, bbox)
+
 # ======================================================================================
 def build_vect(p1, p2):
     """
@@ -225,44 +531,143 @@ def is_colinear(v1, v2):
         return False
 
 
+# ======================================================================================
+class FixSet(object):
+    """
+    Description
+    -----------
+    Set of features to be split, with the number of splits n and m
+    along rows and columns of each feature. Records are hashed by feature id :
+    adding a feature that is already in the set keeps the maximum of n and m.
+    Features are kept in insertion order.
+    For compatibility with fix dictionaries, fix_set['id'], fix_set['n']
+    and fix_set['m'] return the corresponding lists.
+
+    Examples
+    --------
+    >>> fix_set = FixSet([12, 13], 2, 2)
+    >>> fix_set.add(12, 4, 4)
+    >>> fix_set.merge( check_topo(featId, n, m, topo_rules, all_features, v_layer, v_layerIndex) )
+    >>> split_cells(fix_set, grid_layer)
+    """
+
+    def __init__(self, ids = (), n = 1, m = 1):
+        self._splits = {}
+        self.update(ids, n, m)
+
+    @classmethod
+    def from_arrays(cls, ids, n = 1, m = 1):
+        """
+        Description
+        ----------
+        Builds a FixSet from arrays of feature ids and splits (or scalar splits),
+        duplicated ids being merged (maximum of n and m) with Numpy.
+
+        Examples
+        --------
+        >>> fix_set = FixSet.from_arrays(fids[overlap_count > pmax], 2, 2)
+        """
+        ids = np.atleast_1d( np.asarray(ids, dtype=np.int64) )
+        n = np.broadcast_to( np.asarray(n, dtype=np.int64), ids.shape )
+        m = np.broadcast_to( np.asarray(m, dtype=np.int64), ids.shape )
+        fix_set = cls()
+        if ids.size == 0 :
+            return(fix_set)
+        # group duplicates, and keep the order of first occurrences
+        order = np.argsort(ids, kind='stable')
+        unique_ids, starts = np.unique(ids[order], return_index=True)
+        n_max = np.maximum.reduceat(n[order], starts)
+        m_max = np.maximum.reduceat(m[order], starts)
+        first = np.argsort( order[starts], kind='stable' )
+        fix_set._splits = dict( zip( unique_ids[first].tolist(),
+            zip( n_max[first].tolist(), m_max[first].tolist() ) ) )
+        return(fix_set)
+
+    def add(self, fid, n, m):
+        """ adds feature fid, or updates it with the maximum of splits """
+        splits = self._splits.get(fid)
+        if splits is None :
+            self._splits[fid] = (n, m)
+        else :
+            self._splits[fid] = ( max(n, splits[0]), max(m, splits[1]) )
+
+    def update(self, ids, n = 1, m = 1):
+        """ adds features ids, n and m being lists or scalars """
+        ids = list(ids)
+        if np.isscalar(n) :
+            n = [n]*len(ids)
+        if np.isscalar(m) :
+            m = [m]*len(ids)
+        for fid, fid_n, fid_m in zip(ids, n, m) :
+            self.add(fid, fid_n, fid_m)
+
+    def merge(self, other):
+        """ merges another FixSet (or fix dictionary) into this one """
+        if isinstance(other, FixSet) :
+            for fid, (n, m) in other._splits.items() :
+                self.add(fid, n, m)
+        else :
+            self.update(other['id'], other['n'], other['m'])
+        return(self)
+
+    def items(self):
+        """ iterates over (fid, n, m) records """
+        return( ( (fid, n, m) for fid, (n, m) in self._splits.items() ) )
+
+    @property
+    def ids(self):
+        return( list(self._splits.keys()) )
+
+    def __getitem__(self, key):
+        if key == 'id' :
+            return( self.ids )
+        elif key == 'n' :
+            return( [ n for n, m in self._splits.values() ] )
+        elif key == 'm' :
+            return( [ m for n, m in self._splits.values() ] )
+        raise KeyError(key)
+
+    def __contains__(self, fid):
+        return( fid in self._splits )
+
+    def __len__(self):
+        return( len(self._splits) )
+
+    def __iter__(self):
+        return( iter(self._splits) )
+
+    def __repr__(self):
+        return( 'FixSet(%s)' % self._splits )
+
+
 # ======================================================================================
 def update_fix_dict(fix_dict, this_fix_dict):
     """
     Description
     ----------
-    Appends records of this_fix_dict to fix_dict
-    this_fix_dict and fix_dict should have the same structure : fix_dict = { 'id':[] , 'n':[], 'm':[] }
+    Merges records of this_fix_dict into fix_dict (see FixSet.merge)
     n and m correponds to the number split to perform along rows and columns, respectively.
-    If a record of this_fix_dict is already in fix_dict, updates the corresponding record
-    If not, simply appends the record to fix_dict
+    If a record of this_fix_dict is already in fix_dict, the maximum of n and m is kept.
+    If fix_dict is a fix dictionary { 'id':[] , 'n':[], 'm':[] }, it is converted
+    into a FixSet, which is returned.
+
     Parameters
     ----------
-    fix_dict : The feature dictionary to be extended, { 'id':[] , 'n':[], 'm':[] }
-    this_fix_dict : The feature dictionary to append to fix_dict
+    fix_dict : FixSet (or fix dictionary) to be extended
+    this_fix_dict : FixSet (or fix dictionary) to merge into fix_dict
 
     Returns
     -------
 
-    fix_dict with features from this_fix_dict appended.
+    FixSet with features from this_fix_dict merged.
 
     Examples
     --------
-    >>>
+    >>> fix_set = update_fix_dict(fix_set, this_fix_set)
     """
-
-    for fId, n, m in zip( this_fix_dict['id'], this_fix_dict['n'], this_fix_dict['m'] ):
-        # if the feature is already in fix_dict, update this record
-        if fId in fix_dict['id']:
-            i = fix_dict['id'].index(fId)
-            fix_dict['n'][i] = max( n, fix_dict['n'][i] )
-            fix_dict['m'][i] = max( m, fix_dict['m'][i] )
-         # if the feature is not in fix_dict, append it
-        else :
-            fix_dict['id'].append(fId)
-            fix_dict['n'].append(n)
-            fix_dict['m'].append(m)
-
-    return fix_dict
+    if not isinstance(fix_dict, FixSet) :
+        fix_dict = FixSet(fix_dict['id'], fix_dict['n'], fix_dict['m'])
+    return( fix_dict.merge(this_fix_dict) )
 
 
 # ======================================================================================
@@ -294,217 +699,1426 @@ def is_equal(a,b, tol =TOLERANCE):
 
 
 # ======================================================================================
-def is_over(geomA,geomB,relativeError=TOLERANCE):
+def is_over(geomA,geomB,relativeError=TOLERANCE):
+    """
+    Description
+    ----------
+    Checks wheter two QgsPoints are identical for a given tolerance interval.
+
+    Parameters
+    ----------
+    geomA, geomB : Qgis vector feature geometry.
+
+    Returns
+    -------
+    relativeError : float value representative of the tolerance
+
+    Examples
+    --------
+    >>>
+    """
+
+    return ( is_equal( geomA.x(), geomB.x() ) and
+            is_equal( geomA.y(), geomB.y() )
+            )
+
+# ======================================================================================
+def refine_by_split(featIds, n, m, topo_rules, grid_layer, progress_bar = None, labelIter = None ) :
+    """
+    Description
+    ----------
+    Split input_features in grid_layer and check their topology
+
+    Parameters
+    ----------
+    featIds : ids of features from grid_layer to be refined
+    n : number of split for selected cells in the horizontal direction
+    m : number of split for selected cells in the vertical direction
+    topo_rules : topological rules for the propagation of refinement
+    grid_layer : grid layer to be refined
+    progress_bar : progress bar in dialog (or ProgressReporter). If canceled, the
+                   refinement stops after the current iteration.
+    labelIter : iteration label in dialog
+
+    Returns
+    -------
+    Nothing, just grid_layer is updated
+
+    Examples
+    --------
+    >>>
+    """
+    start_time = time.time()
+
+    # --  Procedure for regular structured grids (MODFLOW , n_max = 1) and nested grids
+    # which are quadtrees : cells are refined by index arithmetic (see get_split_grid).
+    grid = get_split_grid(grid_layer, n, m, topo_rules)
+    if isinstance(grid, StructuredGrid) :
+        refine_rgrid(featIds, n, m, grid_layer, grid, progress_bar)
+        return()
+    if isinstance(grid, QuadTreeGrid) :
+        refine_qtree(featIds, n, grid_layer, grid, topo_rules['nmax'], progress_bar, labelIter)
+        return()
+
+    # --  Fallback for grids that are not structured (spatial queries over rows and columns)
+    if topo_rules['nmax'] == 1 :
+        # build feature dictionary
+        all_features = {feature.id(): feature for feature in grid_layer.getFeatures()}
+
+        # init fix sets
+        rowFixSet = FixSet()
+        colFixSet = FixSet()
+
+        # Initialize spatial index
+        grid_layerIndex = QgsSpatialIndex(grid_layer.getFeatures())
+
+        # get bbox of grid layer
+        grid_bbox = grid_layer.extent()
+
+        # iterate over initial feature set
+        # -- cells that have to be split horizontally
+        if n > 1 :
+            for featId in featIds :
+                # only consider featId if current row has not been considered before
+                if featId not in rowFixSet :
+                    # build bounding box over row
+                    bbox = all_features[featId].geometry().boundingBox()
+                    bbox.setXMinimum( grid_bbox.xMinimum() )
+                    bbox.setXMaximum( grid_bbox.xMaximum()  )
+                    bbox.setYMinimum( bbox.yMinimum() + TOLERANCE )
+                    bbox.setYMaximum( bbox.yMaximum() - TOLERANCE )
+                    # get features in current row
+                    rowFeatIds = grid_layerIndex.intersects( bbox )
+                    # update fix set with features in current row
+                    rowFixSet.update(rowFeatIds, n, 1)
+
+        # --  cells that have to be split along columns
+        if m > 1 :
+            for featId in featIds :
+                # only consider featId if current row has not been considered before
+                if featId not in colFixSet :
+                    # build bounding box over column
+                    bbox = all_features[featId].geometry().boundingBox()
+                    bbox.setXMinimum( bbox.xMinimum() + TOLERANCE )
+                    bbox.setXMaximum( bbox.xMaximum() - TOLERANCE )
+                    bbox.setYMinimum( grid_bbox.yMinimum() )
+                    bbox.setYMaximum( grid_bbox.yMaximum() )
+                    # get features in current column
+                    colFeatIds = grid_layerIndex.intersects( bbox )
+                    # update fix set with features in current column
+                    colFixSet.update(colFeatIds, 1, m)
+
+        fix_dict = FixSet().merge(rowFixSet).merge(colFixSet)
+        newFeatIds = split_cells(fix_dict, grid_layer)
+        #print("OPTIM OVER %s sec" % (time.time() - start_time))
+        return()
+
+    # -- Refinement procedure for nested grids which are not quadtrees
+
+    # init iteration counter
+    itCount = 0
+
+    # Initialize progress bar
+    progress = get_progress_reporter(progress_bar, label = labelIter)
+
+    # init fix set
+    fix_dict = FixSet(featIds, n, m)
+
+    # Get all the features, once : the feature cache and the spatial index
+    # are then updated by split_cells with deleted and new cells only
+    all_features = {feature.id(): feature for feature in grid_layer.getFeatures()}
+    grid_layerIndex = QgsSpatialIndex()
+    for feat in all_features.values():
+        grid_layerIndex.insertFeature(feat)
+
+    # Cell adjacency graph, updated with split cells
+    adjacency = get_cell_adjacency(grid_layer, all_features.values())
+
+    # Continue until input_features is empty
+    while len(fix_dict) > 0:
+
+        # Split input_features (all_features and grid_layerIndex are updated)
+        newFeatIds = split_cells(fix_dict, grid_layer, all_features, grid_layerIndex)
+        new_fids, cx, cy = get_cell_corners(grid_layer, [ all_features[featId] for featId in newFeatIds ])
+        adjacency.update(fix_dict.ids, new_fids, cx, cy)
+
+        # re-initialize the set of features to be fixed
+        fix_dict = FixSet()
+
+        # Initialize progress bar
+        progress.start( len(newFeatIds) )
+
+        # Iterate over newFeatures to check topology
+        for count, newFeatId in enumerate(newFeatIds):
+            # Get the neighbors of newFeatId that must be fixed
+            this_fix_dict = check_topo( newFeatId, n, m, topo_rules, all_features, grid_layer, grid_layerIndex, adjacency)
+            # Update fix_dict with this_fix_dict
+            fix_dict.merge(this_fix_dict)
+            # update progress_bar
+            if progress.update(count) :
+                break
+
+        progress.finish()
+
+        # Update iteration counter
+        itCount+=1
+        progress.set_text(str(itCount))
+
+        # stop refinement if canceled
+        if progress.is_canceled() :
+            break
+
+
+# ======================================================================================
+def get_split_grid(grid_layer, n, m, topo_rules, cells = None, angle = None) :
+    """
+    Description
+    ----------
+    Returns the array representation of grid_layer used to split cells by index
+    arithmetic (see refine_by_split) : the StructuredGrid of structured (modflow,
+    nmax = 1) grids, the QuadTreeGrid of nested grids split by 2 or 4,
+    or None for grids refined by the geometric procedure.
+
+    Parameters
+    ----------
+    grid_layer : grid layer to be refined
+    n, m : number of split for selected cells, horizontally and vertically
+    topo_rules : topological rules for the propagation of refinement
+    cells (optional) : CellExtents of the cells (e.g. GridCells), read instead of grid_layer
+    angle (optional) : rotation angle of the grid, the angle stored with grid_layer by default
+
+    Returns
+    -------
+    StructuredGrid, QuadTreeGrid or None
+
+    Examples
+    --------
+    >>> grid = get_split_grid(grid_layer, 2, 2, {'model':'nested','nmax':2})
+    """
+    try :
+        if topo_rules['nmax'] == 1 :
+            return( get_structured_grid(grid_layer, angle, cells) )
+        # Nested grids are refined as quadtrees, by key arithmetic (cells split by 2 or 4).
+        if topo_rules['model'] == 'nested' and n == m and n in (2, 4) and \
+                topo_rules['nmax'] in (2, 4) :
+            return( get_quadtree_grid(grid_layer, angle, cells) )
+    except ValueError :
+        pass
+    return(None)
+
+
+# ======================================================================================
+def split_grid_cells(grid, featIds, n, m, topo_rules, progress_bar = None) :
+    """
+    Description
+    ----------
+    Computes the refinement of a StructuredGrid or QuadTreeGrid (see get_split_grid),
+    as refine_rgrid and refine_qtree do, without reading or editing the grid layer :
+    it only works on Numpy arrays, and can run in a worker thread.
+    A QuadTreeGrid is modified in place.
+
+    Parameters
+    ----------
+    grid : StructuredGrid or QuadTreeGrid of the grid layer
+    featIds : ids of features to be refined
+    n, m : number of split for selected cells, horizontally and vertically
+    topo_rules : topological rules for the propagation of refinement
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    (deleted_fids, cx, cy, src_fids) : cells to replace, corners and source cells
+    of new cells (see replace_cells), or None if canceled
+
+    Examples
+    --------
+    >>> grid = get_split_grid(grid_layer, 2, 2, topo_rules)      # reads grid_layer
+    >>> changes = split_grid_cells(grid, fids, 2, 2, topo_rules)  # worker thread
+    >>> new_fids = replace_cells(grid_layer, *changes)            # edits grid_layer
+    """
+    if isinstance(grid, StructuredGrid) :
+        rows, cols = grid.row_col(featIds)
+        row_factors = np.ones(grid.nrow, dtype=np.int64)
+        col_factors = np.ones(grid.ncol, dtype=np.int64)
+        row_factors[rows] = n
+        col_factors[cols] = m
+        return( rgrid_split_cells(grid, row_factors, col_factors) )
+    original_fids = grid.fids.copy()
+    if not split_qtree(grid, featIds, n, topo_rules['nmax'], progress_bar) :
+        return(None)
+    return( qtree_changes(grid, original_fids) )
+
+
+# ======================================================================================
+def refine_qtree(featIds, n, grid_layer, qtree = None, nmax = 2, progress_bar = None, labelIter = None) :
+    """
+    Description
+    ----------
+    Refines a nested grid as a quadtree : featIds are split into n*n cells
+    (n = 2 or 4), and neighbors are split until the size ratio between
+    edge neighbors is lower or equal to nmax (2:1 balance for nmax = 2).
+    Refinement is performed on the QuadTreeGrid arrays, and grid_layer is only
+    updated at the end, in one bulk delete and one bulk add.
+    New cells inherit the attributes of the cell they come from.
+
+    Parameters
+    ----------
+    featIds : ids of features from grid_layer to be refined
+    n : number of split for rows and columns of selected cells (2 or 4)
+    grid_layer : nested grid layer to be refined
+    qtree (optional) : QuadTreeGrid of grid_layer, built if not provided
+    nmax : maximum size ratio between neighbors (2 or 4)
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter).
+                   If canceled, grid_layer is not modified.
+    labelIter (optional) : iteration label in dialog
+
+    Returns
+    -------
+    List of IDs of new features
+
+    Examples
+    --------
+    >>> new_fids = refine_qtree(grid_layer.selectedFeatureIds(), 2, grid_layer)
+    """
+    if qtree is None :
+        qtree = get_quadtree_grid(grid_layer)
+
+    original_fids = qtree.fids.copy()
+
+    # Initialize progress bar
+    progress = get_progress_reporter(progress_bar, label = labelIter)
+
+    if not split_qtree(qtree, featIds, n, nmax, progress) :
+        return([])
+
+    return( write_qtree(grid_layer, qtree, original_fids, progress) )
+
+
+# ======================================================================================
+def split_qtree(qtree, featIds, n, nmax = 2, progress_bar = None) :
+    """
+    Description
+    ----------
+    Splits featIds into n*n cells (n = 2 or 4) in the QuadTreeGrid qtree, then
+    neighbors until the size ratio between edge neighbors is lower or equal to nmax.
+    Only qtree is modified (see write_qtree).
+
+    Parameters
+    ----------
+    qtree : QuadTreeGrid
+    featIds : ids of cells to be refined
+    n : number of split for rows and columns of selected cells (2 or 4)
+    nmax : maximum size ratio between neighbors (2 or 4)
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    False if canceled, True otherwise
+
+    Examples
+    --------
+    >>> original_fids = qtree.fids.copy()
+    >>> split_qtree(qtree, fids, 2)
+    >>> new_fids = write_qtree(grid_layer, qtree, original_fids)
+    """
+    levels = int( round( np.log2(n) ) )
+    max_diff = int( round( np.log2(nmax) ) )
+    progress = get_progress_reporter(progress_bar) if progress_bar is not None else None
+
+    # split selected cells, then neighbors violating the balance rule
+    new_cells = qtree.split( qtree.cells_of(featIds), levels )
+    itCount = 0
+    while new_cells.size > 0 :
+        new_cells = qtree.split( qtree.unbalanced(new_cells, max_diff), 1 )
+        itCount += 1
+        if progress is not None :
+            progress.set_text( str(itCount) )
+            if progress.update(0) :
+                return(False)
+    return(True)
+
+
+# ======================================================================================
+def write_qtree(grid_layer, qtree, original_fids, progress_bar = None) :
+    """
+    Description
+    ----------
+    Writes the changes of a refined or coarsened QuadTreeGrid to grid_layer : original
+    cells which have been split or merged are deleted and new cells are added
+    (see replace_cells).
+
+    Parameters
+    ----------
+    grid_layer : nested grid layer
+    qtree : QuadTreeGrid of grid_layer, after refinement or coarsening
+    original_fids : feature ids of qtree cells before refinement
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    List of IDs of new features
+
+    Examples
+    --------
+    >>> original_fids = qtree.fids.copy()
+    >>> new_cells = qtree.split( qtree.cells_of(fids), 1 )
+    >>> new_fids = write_qtree(grid_layer, qtree, original_fids)
+    """
+    deleted_fids, cx, cy, src_fids = qtree_changes(qtree, original_fids)
+    if src_fids.size == 0 :
+        return([])
+    return( replace_cells(grid_layer, deleted_fids, cx, cy, src_fids, progress_bar) )
+
+
+# ======================================================================================
+def qtree_changes(qtree, original_fids) :
+    """
+    Description
+    ----------
+    Returns the changes of a refined or coarsened QuadTreeGrid : ids of original
+    cells which have been split or merged, and corners and source cells of new cells.
+
+    Parameters
+    ----------
+    qtree : QuadTreeGrid, after refinement or coarsening
+    original_fids : feature ids of qtree cells before refinement
+
+    Returns
+    -------
+    (deleted_fids, cx, cy, src_fids) (see replace_cells)
+
+    Examples
+    --------
+    >>> deleted_fids, cx, cy, src_fids = qtree_changes(qtree, original_fids)
+    """
+    deleted_fids = [ int(fid) for fid in np.setdiff1d(original_fids, qtree.fids) ]
+    new_cells = np.flatnonzero(qtree.fids < 0)
+    cx, cy = qtree.corners(new_cells)
+    return( deleted_fids, cx, cy, qtree.src[new_cells] )
+
+
+# ======================================================================================
+def replace_cells(grid_layer, deleted_fids, cx, cy, src_fids, progress_bar = None) :
+    """
+    Description
+    ----------
+    Replaces cells of grid_layer : deleted_fids are deleted and new rectangular cells
+    are added, in one bulk delete and one bulk add. Each new cell inherits the
+    attributes of cell src_fids (read before deletion).
+
+    Parameters
+    ----------
+    grid_layer : grid layer
+    deleted_fids : ids of features to delete
+    cx, cy : arrays of shape (N, 4) with the corner coordinates of new cells,
+             numbered clock-wise from top-left
+    src_fids : array of N feature ids, whose attributes are copied to new cells
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter).
+                If canceled, grid_layer is not modified.
+
+    Returns
+    -------
+    List of IDs of new features (same order as cx, cy)
+
+    Examples
+    --------
+    >>> new_fids = replace_cells(grid_layer, [12], cx, cy, [12]*4)
+    """
+    deleted_fids = [ int(fid) for fid in deleted_fids ]
+    src_fids = np.asarray(src_fids, dtype=np.int64)
+
+    # geometries of new cells, packed in a single WKB buffer
+    wkb = rect_wkb(cx, cy).tobytes()
+    wkb_size = WKB_RECT_DTYPE.itemsize
+
+    # attributes of source cells
+    request = QgsFeatureRequest().setFilterFids( [ int(fid) for fid in np.unique(src_fids) ] )
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    src_attributes = { feat.id() : feat.attributes() for feat in grid_layer.getFeatures(request) }
+
+    # build new features
+    progress = get_progress_reporter(progress_bar, total = src_fids.size)
+    new_features = []
+    for k, src_fid in enumerate(src_fids) :
+        new_feat = QgsFeature()
+        new_feat.setAttributes( src_attributes[src_fid] )
+        new_geom = QgsGeometry()
+        new_geom.fromWkb( wkb[k*wkb_size:(k+1)*wkb_size] )
+        new_feat.setGeometry(new_geom)
+        new_features.append(new_feat)
+        if progress.update(k) :
+            return([])
+
+    # replace cells
+    provider = grid_layer.dataProvider()
+    provider.deleteFeatures(deleted_fids)
+    res, added_features = provider.addFeatures(new_features)
+    new_fids = [ feat.id() for feat in added_features ]
+    invalidate_cell_extents(grid_layer, deleted_fids + new_fids)
+    progress.finish()
+
+    return(new_fids)
+
+
+# ======================================================================================
+def refine_rgrid(featIds, n, m, grid_layer, sgrid = None, progress_bar = None) :
+    """
+    Description
+    ----------
+    Refines a structured (modflow) grid : the rows of featIds are split into n rows
+    and their columns into m columns. Only the cells of refined rows and columns
+    are replaced, in one bulk delete and one bulk add. New cells inherit the attributes
+    of the cell they come from (ROW and COL attributes should then be updated
+    with rgrid_numbering).
+
+    Parameters
+    ----------
+    featIds : ids of features from grid_layer to be refined
+    n : number of split for rows of selected cells
+    m : number of split for columns of selected cells
+    grid_layer : structured grid layer to be refined
+    sgrid (optional) : StructuredGrid of grid_layer, built if not provided
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    List of IDs of new features
+
+    Examples
+    --------
+    >>> new_fids = refine_rgrid(grid_layer.selectedFeatureIds(), 2, 2, grid_layer)
+    """
+    if sgrid is None :
+        sgrid = get_structured_grid(grid_layer)
+
+    # rows and columns to split
+    rows, cols = sgrid.row_col(featIds)
+    row_factors = np.ones(sgrid.nrow, dtype=np.int64)
+    col_factors = np.ones(sgrid.ncol, dtype=np.int64)
+    row_factors[rows] = n
+    col_factors[cols] = m
+
+    return( refine_rgrid_factors(grid_layer, sgrid, row_factors, col_factors, progress_bar) )
+
+
+# ======================================================================================
+def refine_rgrid_factors(grid_layer, sgrid, row_factors, col_factors, progress_bar = None) :
+    """
+    Description
+    ----------
+    Refines a structured (modflow) grid : each row i is split into row_factors[i] rows
+    and each column j into col_factors[j] columns. Only the cells of refined rows and
+    columns are replaced (see refine_rgrid).
+
+    Parameters
+    ----------
+    grid_layer : structured grid layer to be refined
+    sgrid : StructuredGrid of grid_layer
+    row_factors : array of number of split for each row (size nrow, 1 to keep the row)
+    col_factors : array of number of split for each column (size ncol)
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    List of IDs of new features
+
+    Examples
+    --------
+    >>> new_fids = refine_rgrid_factors(grid_layer, sgrid, [1, 2, 4, 2, 1], [1]*10)
+    """
+    deleted_fids, cx, cy, parent_fids = rgrid_split_cells(sgrid, row_factors, col_factors)
+    if parent_fids.size == 0 :
+        return([])
+
+    # replace cells of refined rows and columns
+    return( replace_cells(grid_layer, deleted_fids, cx, cy, parent_fids, progress_bar) )
+
+
+# ======================================================================================
+def rgrid_split_cells(sgrid, row_factors, col_factors) :
+    """
+    Description
+    ----------
+    Computes the cells of a structured grid refined by row and column factors
+    (see refine_rgrid_factors) : replaced cells, and corners and parent cells
+    of new cells.
+
+    Parameters
+    ----------
+    sgrid : StructuredGrid
+    row_factors : array of number of split for each row (size nrow, 1 to keep the row)
+    col_factors : array of number of split for each column (size ncol)
+
+    Returns
+    -------
+    (deleted_fids, cx, cy, parent_fids) (see replace_cells)
+
+    Examples
+    --------
+    >>> deleted_fids, cx, cy, parent_fids = rgrid_split_cells(sgrid, [1, 2, 1], [1]*10)
+    """
+    row_factors = np.asarray(row_factors, dtype=np.int64)
+    col_factors = np.asarray(col_factors, dtype=np.int64)
+    split_rows = np.flatnonzero(row_factors > 1)
+    split_cols = np.flatnonzero(col_factors > 1)
+    if split_rows.size == 0 and split_cols.size == 0 :
+        return( np.array([], dtype=np.int64), np.empty((0, 4)), np.empty((0, 4)), np.array([], dtype=np.int64) )
+
+    # refined grid, and cells of refined rows or columns (row-wise)
+    new_sgrid, parent_row, parent_col = sgrid.refine(split_rows, split_cols,
+            row_factors[split_rows], col_factors[split_cols])
+    is_split_row = row_factors > 1
+    is_split_col = col_factors > 1
+    new_rows, new_cols = np.nonzero( is_split_row[parent_row][:, None] | is_split_col[parent_col][None, :] )
+    parent_fids = sgrid.fids[ parent_row[new_rows], parent_col[new_cols] ]
+    cx, cy = new_sgrid.cell_corners(new_rows, new_cols)
+    return( np.unique(parent_fids), cx, cy, parent_fids )
+
+
+# ======================================================================================
+def prepare_refinement_rules(rules, crs = None):
+    """
+    Description
+    ----------
+    Reads the features of refinement rule layers (points, lines or polygons), in
+    the grid crs, and builds their spatial indexes (see refine_by_rules).
+
+    Parameters
+    ----------
+    rules : list of refinement rules, dictionaries with keys :
+            'layer' : QgsVectorLayer (or QgsVectorLayerFeatureSource) of features to refine around
+            'size' : target cell size at the features
+            'growth' (optional) : growth rate of cell size away from the features (> 1),
+                    the target size at distance d is size + (growth - 1)*d.
+                    If not provided, only the cells intersecting the features are refined.
+    crs (optional) : QgsCoordinateReferenceSystem of the grid
+
+    Returns
+    -------
+    list of (size, growth, spatial index, {fid:geometry}) tuples
+
+    Examples
+    --------
+    >>> rules_data = prepare_refinement_rules([{'layer':wells_layer, 'size':5., 'growth':1.2}], grid_layer.crs())
+    """
+    rules_data = []
+    for rule in rules :
+        if not rule['size'] > 0 :
+            raise ValueError('Target cell size must be positive')
+        request = QgsFeatureRequest().setSubsetOfAttributes([])
+        if crs is not None and crs.isValid() :
+            request.setDestinationCrs( crs, QgsProject.instance().transformContext() )
+        index = QgsSpatialIndex()
+        geometries = {}
+        for feat in rule['layer'].getFeatures(request) :
+            if not feat.hasGeometry() :
+                continue
+            index.insertFeature(feat)
+            geometries[feat.id()] = feat.geometry()
+        growth = rule.get('growth', None)
+        if growth is not None and growth <= 1 :
+            growth = None
+        rules_data.append( ( float(rule['size']), growth, index, geometries ) )
+    return(rules_data)
+
+
+# ======================================================================================
+def get_target_sizes(cx, cy, sizes, rules_data, progress_bar = None):
+    """
+    Description
+    ----------
+    Computes the target size of cells from refinement rules : the minimum over all
+    rules of size + (growth - 1)*d, where d is the distance between the cell and the
+    closest feature of the rule. Only the features which may constrain the cell
+    are considered (spatial index query, within the distance at which the target
+    size exceeds the cell size).
+
+    Parameters
+    ----------
+    cx, cy : arrays of shape (N, 4) with the corner coordinates of the cells
+    sizes : array of cell sizes (largest dimension)
+    rules_data : refinement rules, as returned by prepare_refinement_rules
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    array of target sizes (inf for cells which are not constrained)
+
+    Examples
+    --------
+    >>> targets = get_target_sizes(cx, cy, sizes, rules_data)
+    >>> to_split = sizes > targets
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    targets = np.full(sizes.size, np.inf)
+    wkb = rect_wkb(cx, cy).tobytes()
+    wkb_size = WKB_RECT_DTYPE.itemsize
+    progress = get_progress_reporter(progress_bar, total = sizes.size)
+
+    for k in range(sizes.size) :
+        cell_geom = None
+        for size, growth, index, geometries in rules_data :
+            # the cell already satisfies the rule
+            if sizes[k] <= size*(1 + TOLERANCE) or size >= targets[k] :
+                continue
+            if cell_geom is None :
+                cell_geom = QgsGeometry()
+                cell_geom.fromWkb( wkb[k*wkb_size:(k+1)*wkb_size] )
+            # distance beyond which the rule is satisfied
+            radius = 0. if growth is None else ( min(sizes[k], targets[k]) - size ) / (growth - 1.)
+            bbox = cell_geom.boundingBox().buffered(radius + TOLERANCE)
+            for fid in index.intersects(bbox) :
+                dist = cell_geom.distance( geometries[fid] )
+                if growth is None :
+                    if dist <= TOLERANCE :
+                        targets[k] = min(targets[k], size)
+                else :
+                    targets[k] = min( targets[k], size + (growth - 1.)*dist )
+        if progress.update(k) :
+            break
+
+    return(targets)
+
+
+# ======================================================================================
+def refine_by_rules(grid_layer, rules, topo_rules, progress_bar = None, labelIter = None, max_iter = 20) :
+    """
+    Description
+    ----------
+    Refines grid_layer automatically around the features of rule layers (wells, rivers,
+    boundaries...), so that cell sizes do not exceed the target size of the rules
+    (see prepare_refinement_rules and get_target_sizes). The refinement required by
+    all the cells is computed in a single run :
+    - nested grids (quadtrees) are refined in the QuadTreeGrid arrays, cells being split
+      until they satisfy the rules, then balanced (topo_rules['nmax']). grid_layer is updated once.
+    - structured (modflow) grids : each row and column is split according to the
+      smallest target size of its cells, in one pass.
+    - other grids are refined with refine_by_split (2x2 splits) until all cells
+      satisfy the rules, or max_iter passes are reached.
+
+    Parameters
+    ----------
+    grid_layer : grid layer to be refined
+    rules : list of refinement rules (see prepare_refinement_rules)
+    topo_rules : topological rules for the propagation of refinement
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+    labelIter (optional) : iteration label in dialog
+    max_iter : maximum number of refinement passes
+
+    Returns
+    -------
+    Nothing, just grid_layer is updated
+
+    Examples
+    --------
+    >>> rules = [ {'layer':wells_layer, 'size':5., 'growth':1.2}, {'layer':river_layer, 'size':10.} ]
+    >>> refine_by_rules(grid_layer, rules, {'model':'nested', 'nmax':2})
+    """
+    progress = get_progress_reporter(progress_bar, label = labelIter)
+    rules_data = prepare_refinement_rules(rules, grid_layer.crs())
+
+    # -- Nested grids (quadtrees) and structured (modflow) grids, refined in one run
+    grid = get_rules_grid(grid_layer, topo_rules)
+    if grid is not None :
+        changes = split_grid_cells_by_rules(grid, rules_data, topo_rules, progress)
+        if changes is not None and len(changes[3]) > 0 :
+            replace_cells(grid_layer, *changes, progress_bar = progress)
+        return
+
+    # -- Other grids, refined by successive 2x2 splits
+    for itCount in range(max_iter) :
+        extents = get_cell_extents(grid_layer)
+        cx, cy = extents.corners()
+        dx, dy = extents.sizes()
+        sizes = np.maximum(dx, dy)
+        targets = get_target_sizes(cx, cy, sizes, rules_data, progress)
+        featIds = extents.fids[ sizes > targets*(1 + TOLERANCE) ]
+        if featIds.size == 0 or progress.is_canceled() :
+            return
+        refine_by_split( [ int(fid) for fid in featIds ], 2, 2, topo_rules, grid_layer, progress )
+        progress.set_text( str(itCount + 1) )
+
+
+# ======================================================================================
+def get_rules_grid(grid_layer, topo_rules, cells = None, angle = None) :
+    """
+    Description
+    ----------
+    Returns the array representation of grid_layer used to refine it by rules in
+    a single run (see refine_by_rules) : the QuadTreeGrid of nested grids (nmax = 2 or 4),
+    the StructuredGrid of structured (modflow, nmax = 1) grids, or None for other grids.
+
+    Parameters
+    ----------
+    grid_layer : grid layer to be refined
+    topo_rules : topological rules for the propagation of refinement
+    cells (optional) : CellExtents of the cells (e.g. GridCells), read instead of grid_layer
+    angle (optional) : rotation angle of the grid, the angle stored with grid_layer by default
+
+    Returns
+    -------
+    QuadTreeGrid, StructuredGrid or None
+
+    Examples
+    --------
+    >>> grid = get_rules_grid(grid_layer, {'model':'nested','nmax':2})
+    """
+    if topo_rules['model'] == 'nested' and topo_rules['nmax'] in (2, 4) :
+        try :
+            return( get_quadtree_grid(grid_layer, angle, cells) )
+        except ValueError :
+            pass
+    if topo_rules['nmax'] == 1 :
+        try :
+            return( get_structured_grid(grid_layer, angle, cells) )
+        except ValueError :
+            pass
+    return(None)
+
+
+# ======================================================================================
+def split_grid_cells_by_rules(grid, rules_data, topo_rules, progress_bar = None) :
+    """
+    Description
+    ----------
+    Computes the refinement of a QuadTreeGrid or StructuredGrid (see get_rules_grid)
+    by refinement rules, as refine_by_rules does, without reading or editing the
+    grid layer, so that it can run in a worker thread.
+    - QuadTreeGrid : cells are split until they satisfy the rules, then balanced
+      (topo_rules['nmax']). grid is modified in place.
+    - StructuredGrid : each row and column is split according to the smallest target
+      size of its cells, in one pass.
+
+    Parameters
+    ----------
+    grid : QuadTreeGrid or StructuredGrid of the grid layer
+    rules_data : refinement rules, as returned by prepare_refinement_rules
+    topo_rules : topological rules for the propagation of refinement
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    (deleted_fids, cx, cy, src_fids) : cells to replace, corners and source cells
+    of new cells (see replace_cells), or None if canceled
+
+    Examples
+    --------
+    >>> grid = get_rules_grid(None, topo_rules, cells, angle)                     # worker thread
+    >>> changes = split_grid_cells_by_rules(grid, rules_data, topo_rules)
+    >>> new_fids = replace_cells(grid_layer, *changes)                           # edits grid_layer
+    """
+    progress = get_progress_reporter(progress_bar)
+
+    # -- Nested grids, refined as quadtrees
+    if isinstance(grid, QuadTreeGrid) :
+        qtree = grid
+        max_diff = int( round( np.log2(topo_rules['nmax']) ) )
+        original_fids = qtree.fids.copy()
+        # split cells until they satisfy the rules, only new cells are checked
+        cells = np.arange( len(qtree) )
+        itCount = 0
+        while cells.size > 0 :
+            dx, dy = qtree.cell_size( qtree.level[cells] )
+            targets = get_target_sizes( *qtree.corners(cells), sizes = np.maximum(dx, dy),
+                    rules_data = rules_data, progress_bar = progress )
+            if progress.is_canceled() :
+                return(None)
+            cells = qtree.split( cells[ np.maximum(dx, dy) > targets*(1 + TOLERANCE) ], 1 )
+            itCount += 1
+            progress.set_text( str(itCount) )
+        # balance
+        new_cells = np.flatnonzero(qtree.fids < 0)
+        while new_cells.size > 0 :
+            new_cells = qtree.split( qtree.unbalanced(new_cells, max_diff), 1 )
+        return( qtree_changes(qtree, original_fids) )
+
+    # -- Structured (modflow) grids, refined by rows and columns
+    sgrid = grid
+    cx, cy = sgrid.corners()
+    dy, dx = np.meshgrid(sgrid.delc, sgrid.delr, indexing = 'ij')
+    targets = get_target_sizes( cx, cy, np.maximum(dx, dy).ravel(), rules_data,
+            progress ).reshape(sgrid.nrow, sgrid.ncol)
+    if progress.is_canceled() :
+        return(None)
+    # number of split of each row and column
+    row_factors = np.ceil( sgrid.delc / np.min(targets, axis = 1) * (1 - TOLERANCE) )
+    col_factors = np.ceil( sgrid.delr / np.min(targets, axis = 0) * (1 - TOLERANCE) )
+    return( rgrid_split_cells( sgrid, np.maximum(row_factors, 1), np.maximum(col_factors, 1) ) )
+
+
+# ======================================================================================
+def coarsen_by_merge(featIds, n, m, topo_rules, grid_layer, progress_bar = None, labelIter = None) :
+    """
+    Description
+    ----------
+    Coarsens grid_layer by merging selected cells, the inverse of refine_by_split.
+    Only blocks of cells lying entirely within the selection are merged :
+    - structured (modflow) grids : rows of selected cells are merged by groups of n
+      consecutive rows, and their columns by groups of m consecutive columns
+      (see coarsen_rgrid). The grid remains structured.
+    - nested grids (quadtrees, n = m = 2 or 4) : groups of 2x2 sibling cells are merged
+      into their parent, once (n = 2) or twice (n = 4). Merges which would break the
+      balance rule (topo_rules['nmax']) are cancelled (see coarsen_qtree).
+    - other grids : blocks of n x m cells of equal size are merged, and merges
+      which do not satisfy topo_rules are cancelled (see coarsen_cells).
+    Merged cells inherit the attributes of their top-left cell.
+
+    Parameters
+    ----------
+    featIds : ids of features from grid_layer to be merged
+    n : number of rows merged together
+    m : number of columns merged together
+    topo_rules : topological rules
+    grid_layer : grid layer to be coarsened
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+    labelIter (optional) : iteration label in dialog
+
+    Returns
+    -------
+    List of IDs of new (merged) features
+
+    Examples
+    --------
+    >>> new_fids = coarsen_by_merge(grid_layer.selectedFeatureIds(), 2, 2, {'model':'nested', 'nmax':2}, grid_layer)
+    """
+    grid = get_merge_grid(grid_layer, n, m, topo_rules)
+    if isinstance(grid, StructuredGrid) :
+        return( coarsen_rgrid(featIds, n, m, grid_layer, grid, progress_bar) )
+    if isinstance(grid, QuadTreeGrid) :
+        return( coarsen_qtree(featIds, n, grid_layer, grid, topo_rules['nmax'], progress_bar, labelIter) )
+    return( coarsen_cells(featIds, n, m, topo_rules, grid_layer, grid, progress_bar) )
+
+
+# ======================================================================================
+def get_merge_grid(grid_layer, n, m, topo_rules, cells = None, angle = None) :
+    """
+    Description
+    ----------
+    Returns the array representation of grid_layer used to merge cells (see
+    coarsen_by_merge) : the StructuredGrid of structured (modflow, nmax = 1) grids,
+    the QuadTreeGrid of nested grids merged by 2 or 4, or the CellAdjacency
+    of other grids.
+
+    Parameters
+    ----------
+    grid_layer : grid layer to be coarsened
+    n, m : number of rows and columns merged together
+    topo_rules : topological rules
+    cells (optional) : CellExtents of the cells (e.g. GridCells), read instead of grid_layer
+    angle (optional) : rotation angle of the grid, the angle stored with grid_layer by default
+
+    Returns
+    -------
+    StructuredGrid, QuadTreeGrid or CellAdjacency
+
+    Examples
+    --------
+    >>> grid = get_merge_grid(grid_layer, 2, 2, {'model':'nested','nmax':2})
+    """
+    # -- Structured (modflow) grids, merged by rows and columns
+    if topo_rules['nmax'] == 1 :
+        try :
+            return( get_structured_grid(grid_layer, angle, cells) )
+        except ValueError :
+            pass
+
+    # -- Nested grids, merged as quadtrees
+    if topo_rules['model'] == 'nested' and n == m and n in (2, 4) and \
+            topo_rules['nmax'] in (2, 4) :
+        try :
+            return( get_quadtree_grid(grid_layer, angle, cells) )
+        except ValueError :
+            pass
+
+    # -- Other grids, merged by blocks of cells
+    return( get_cell_adjacency(grid_layer, angle = angle, cells = cells) )
+
+
+# ======================================================================================
+def merge_grid_cells(grid, featIds, n, m, topo_rules, cells, progress_bar = None) :
+    """
+    Description
+    ----------
+    Computes the coarsening of a StructuredGrid, QuadTreeGrid or CellAdjacency
+    (see get_merge_grid), as coarsen_by_merge does, without reading or editing
+    the grid layer : it only works on Numpy arrays, and can run in a worker thread.
+
+    Parameters
+    ----------
+    grid : StructuredGrid, QuadTreeGrid or CellAdjacency of the grid layer
+    featIds : ids of features to be merged
+    n, m : number of rows and columns merged together
+    topo_rules : topological rules
+    cells : CellExtents of the cells of the grid layer (corners of merged cells)
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    (deleted_fids, cx, cy, src_fids) : cells to replace, corners and source cells
+    of new cells (see replace_cells), or None if canceled
+
+    Examples
+    --------
+    >>> grid = get_merge_grid(None, 2, 2, topo_rules, cells, angle)       # worker thread
+    >>> changes = merge_grid_cells(grid, fids, 2, 2, topo_rules, cells)
+    >>> new_fids = replace_cells(grid_layer, *changes)                    # edits grid_layer
+    """
+    if isinstance(grid, StructuredGrid) :
+        return( rgrid_merge_cells(grid, featIds, n, m) )
+    if isinstance(grid, QuadTreeGrid) :
+        original_fids = grid.fids.copy()
+        merged_qtree = merge_qtree(grid, featIds, n, topo_rules['nmax'], progress_bar)
+        if merged_qtree is None :
+            return(None)
+        return( qtree_changes(merged_qtree, original_fids) )
+    return( adjacency_merge_cells(grid, featIds, n, m, topo_rules, cells) )
+
+
+# ======================================================================================
+def coarsen_rgrid(featIds, n, m, grid_layer, sgrid = None, progress_bar = None) :
+    """
+    Description
+    ----------
+    Coarsens a structured (modflow) grid : the rows of featIds are merged by groups
+    of n consecutive rows and their columns by groups of m consecutive columns
+    (see merge_spacing). Whole rows and columns are merged, so that the grid remains
+    structured. Only the cells of merged rows and columns are replaced, in one bulk
+    delete and one bulk add (ROW and COL attributes should then be updated
+    with rgrid_numbering).
+
+    Parameters
+    ----------
+    featIds : ids of features from grid_layer to be merged
+    n : number of rows merged together
+    m : number of columns merged together
+    grid_layer : structured grid layer to be coarsened
+    sgrid (optional) : StructuredGrid of grid_layer, built if not provided
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    List of IDs of new features
+
+    Examples
+    --------
+    >>> new_fids = coarsen_rgrid(grid_layer.selectedFeatureIds(), 2, 2, grid_layer)
+    """
+    if sgrid is None :
+        sgrid = get_structured_grid(grid_layer)
+
+    deleted_fids, cx, cy, src_fids = rgrid_merge_cells(sgrid, featIds, n, m)
+    if src_fids.size == 0 :
+        return([])
+    return( replace_cells(grid_layer, deleted_fids, cx, cy, src_fids, progress_bar) )
+
+
+# ======================================================================================
+def rgrid_merge_cells(sgrid, featIds, n, m) :
+    """
+    Description
+    ----------
+    Computes the cells of a structured grid coarsened by merging the rows and columns
+    of featIds (see coarsen_rgrid) : replaced cells, and corners and source cells
+    (top-left original cells) of new cells.
+
+    Parameters
+    ----------
+    sgrid : StructuredGrid
+    featIds : ids of cells to be merged
+    n : number of rows merged together
+    m : number of columns merged together
+
+    Returns
+    -------
+    (deleted_fids, cx, cy, src_fids) (see replace_cells)
+
+    Examples
+    --------
+    >>> deleted_fids, cx, cy, src_fids = rgrid_merge_cells(sgrid, fids, 2, 2)
+    """
+    rows, cols = sgrid.row_col(featIds)
+    new_sgrid, row_group, col_group = sgrid.coarsen( np.unique(rows), np.unique(cols), n, m )
+    merged_rows = np.bincount(row_group) > 1
+    merged_cols = np.bincount(col_group) > 1
+    if not merged_rows.any() and not merged_cols.any() :
+        return( np.array([], dtype=np.int64), np.empty((0, 4)), np.empty((0, 4)), np.array([], dtype=np.int64) )
+
+    # cells of merged rows or columns, inheriting from their top-left original cell
+    new_rows, new_cols = np.nonzero( merged_rows[:, None] | merged_cols[None, :] )
+    first_row = np.searchsorted( row_group, np.arange(new_sgrid.nrow) )
+    first_col = np.searchsorted( col_group, np.arange(new_sgrid.ncol) )
+    src_fids = sgrid.fids[ first_row[new_rows], first_col[new_cols] ]
+    deleted_fids = sgrid.fids[ merged_rows[row_group][:, None] | merged_cols[col_group][None, :] ]
+
+    cx, cy = new_sgrid.cell_corners(new_rows, new_cols)
+    return( deleted_fids, cx, cy, src_fids )
+
+
+# ======================================================================================
+def coarsen_qtree(featIds, n, grid_layer, qtree = None, nmax = 2, progress_bar = None, labelIter = None) :
+    """
+    Description
+    ----------
+    Coarsens a nested grid as a quadtree : groups of 2x2 sibling cells of featIds
+    are merged into their parent cell, once (n = 2) or twice (n = 4). Merges making
+    a parent cell more than nmax times larger than one of its edge neighbors are
+    cancelled, until all the remaining merges satisfy the balance rule.
+    grid_layer is only updated at the end (see write_qtree).
+
+    Parameters
+    ----------
+    featIds : ids of features from grid_layer to be merged
+    n : number of cells merged along rows and columns (2 or 4)
+    grid_layer : nested grid layer to be coarsened
+    qtree (optional) : QuadTreeGrid of grid_layer, built if not provided
+    nmax : maximum size ratio between neighbors (2 or 4)
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter).
+                   If canceled, grid_layer is not modified.
+    labelIter (optional) : iteration label in dialog
+
+    Returns
+    -------
+    List of IDs of new features
+
+    Examples
+    --------
+    >>> new_fids = coarsen_qtree(grid_layer.selectedFeatureIds(), 2, grid_layer)
+    """
+    if qtree is None :
+        qtree = get_quadtree_grid(grid_layer)
+
+    original_fids = qtree.fids.copy()
+
+    # Initialize progress bar
+    progress = get_progress_reporter(progress_bar, label = labelIter)
+
+    merged_qtree = merge_qtree(qtree, featIds, n, nmax, progress)
+    if merged_qtree is None :
+        return([])
+
+    return( write_qtree(grid_layer, merged_qtree, original_fids, progress) )
+
+
+# ======================================================================================
+def merge_qtree(qtree, featIds, n, nmax = 2, progress_bar = None) :
+    """
+    Description
+    ----------
+    Merges groups of 2x2 sibling cells of featIds into their parent cell, once (n = 2)
+    or twice (n = 4), in a copy of the QuadTreeGrid qtree. Merges making a parent
+    cell more than nmax times larger than one of its edge neighbors are cancelled,
+    until all the remaining merges satisfy the balance rule (see coarsen_qtree).
+
+    Parameters
+    ----------
+    qtree : QuadTreeGrid, not modified
+    featIds : ids of cells to be merged
+    n : number of cells merged along rows and columns (2 or 4)
+    nmax : maximum size ratio between neighbors (2 or 4)
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    merged QuadTreeGrid, or None if canceled
+
+    Examples
+    --------
+    >>> original_fids = qtree.fids.copy()
+    >>> merged_qtree = merge_qtree(qtree, fids, 2)
+    >>> new_fids = write_qtree(grid_layer, merged_qtree, original_fids)
+    """
+    levels = int( round( np.log2(n) ) )
+    max_diff = int( round( np.log2(nmax) ) )
+    progress = get_progress_reporter(progress_bar)
+
+    selected = np.zeros(len(qtree), dtype=bool)
+    selected[ qtree.cells_of(featIds) ] = True
+    itCount = 0
+    for level in range(levels) :
+        groups = qtree.siblings( np.flatnonzero(selected) )
+        # cancel merges breaking the balance rule, until all merges are valid
+        while groups.shape[0] > 0 :
+            merged_qtree = qtree.copy()
+            parents = merged_qtree.merge(groups)
+            invalid = merged_qtree.too_coarse(parents, max_diff) - parents[0]
+            itCount += 1
+            progress.set_text( str(itCount) )
+            if progress.update(0) :
+                return(None)
+            if invalid.size == 0 :
+                break
+            groups = np.delete(groups, invalid, axis = 0)
+        if groups.shape[0] == 0 :
+            break
+        # parents remain selected for the next level
+        keep = np.ones(len(qtree), dtype=bool)
+        keep[groups.ravel()] = False
+        selected = np.concatenate( (selected[keep], np.ones(parents.size, dtype=bool)) )
+        qtree = merged_qtree
+
+    return(qtree)
+
+
+# ======================================================================================
+def coarsen_cells(featIds, n, m, topo_rules, grid_layer, adjacency = None, progress_bar = None) :
     """
     Description
     ----------
-    Checks wheter two QgsPoints are identical for a given tolerance interval.
+    Coarsens any grid of rectangular cells : blocks of n rows x m columns of selected
+    cells of equal size are merged into one cell. Blocks are found from the adjacency
+    graph of the grid, from top-left to bottom-right, without overlap.
+    When topo_rules are set, merges making a cell more than topo_rules['nmax'] times
+    larger than one of its edge neighbors are cancelled, until all the remaining
+    merges are valid. Cells are replaced in one bulk delete and one bulk add.
 
     Parameters
     ----------
-    geomA, geomB : Qgis vector feature geometry.
+    featIds : ids of features from grid_layer to be merged
+    n : number of rows merged together
+    m : number of columns merged together
+    topo_rules : topological rules
+    grid_layer : grid layer to be coarsened
+    adjacency (optional) : CellAdjacency of grid_layer, built if not provided
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter)
 
     Returns
     -------
-    relativeError : float value representative of the tolerance
+    List of IDs of new features
 
     Examples
     --------
-    >>>
+    >>> new_fids = coarsen_cells(grid_layer.selectedFeatureIds(), 2, 2, {'model':None, 'nmax':None}, grid_layer)
     """
+    if adjacency is None :
+        adjacency = get_cell_adjacency(grid_layer)
+
+    deleted_fids, cx, cy, src_fids = adjacency_merge_cells(adjacency, featIds, n, m, topo_rules,
+            get_cell_extents(grid_layer))
+    if src_fids.size == 0 :
+        return([])
+    return( replace_cells(grid_layer, deleted_fids, cx, cy, src_fids, progress_bar) )
 
-    return ( is_equal( geomA.x(), geomB.x() ) and
-            is_equal( geomA.y(), geomB.y() )
-            )
 
 # ======================================================================================
-def refine_by_split(featIds, n, m, topo_rules, grid_layer, progress_bar = None, labelIter = None ) :
+def adjacency_merge_cells(adjacency, featIds, n, m, topo_rules, cells) :
     """
     Description
     ----------
-    Split input_features in grid_layer and check their topology
+    Computes the merge of blocks of n rows x m columns of selected cells of equal
+    size, found from the adjacency graph of the grid (see coarsen_cells) :
+    replaced cells, and corners and source cells (top-left cells) of merged cells.
 
     Parameters
     ----------
-    featIds : ids of features from grid_layer to be refined
-    n : number of split for selected cells in the horizontal direction
-    m : number of split for selected cells in the vertical direction
-    topo_rules : topological rules for the propagation of refinement
-    grid_layer : grid layer to be refined
-    progress_bar : progress bar in dialog
-    labelIter : iteration label in dialog
+    adjacency : CellAdjacency of the grid
+    featIds : ids of cells to be merged
+    n : number of rows merged together
+    m : number of columns merged together
+    topo_rules : topological rules
+    cells : CellExtents of the grid cells (CellExtentCache or GridCells), for cell corners
 
     Returns
     -------
-    Nothing, just grid_layer is updated
+    (deleted_fids, cx, cy, src_fids) (see replace_cells)
 
     Examples
     --------
-    >>>
+    >>> changes = adjacency_merge_cells(adjacency, fids, 2, 2, topo_rules, get_cell_extents(grid_layer))
     """
-    start_time = time.time()
-
-    # --  Procedure for regular structured grids (MODFLOW , n_max = 1)
-    if topo_rules['nmax'] == 1 :
-        # build feature dictionary
-        all_features = {feature.id(): feature for feature in grid_layer.getFeatures()}
-
-        # init fix dictionary
-        rowFixDict = { 'id': [] , 'n':[], 'm':[] }
-        colFixDict = { 'id': [] , 'n':[], 'm':[] }
-
-        # Initialize spatial index
-        grid_layerIndex = QgsSpatialIndex(grid_layer.getFeatures())
-
-        # get bbox of grid layer
-        grid_bbox = grid_layer.extent()
-
-        # iterate over initial feature set
-        # -- cells that have to be split horizontally
-        if n > 1 :
-            for featId in featIds :
-                # only consider featId if current row has not been considered before
-                if featId not in rowFixDict['id'] :
-                    # build bounding box over row
-                    bbox = all_features[featId].geometry().boundingBox()
-                    bbox.setXMinimum( grid_bbox.xMinimum() )
-                    bbox.setXMaximum( grid_bbox.xMaximum()  )
-                    bbox.setYMinimum( bbox.yMinimum() + TOLERANCE )
-                    bbox.setYMaximum( bbox.yMaximum() - TOLERANCE )
-                    # get features in current row
-                    rowFeatIds = grid_layerIndex.intersects( bbox )
-                    # update fix_dict with features in current row
-                    this_fix_dict = { 'id':rowFeatIds , 'n':[n]*len(rowFeatIds), 'm':[1]*len(rowFeatIds) }
-                    rowFixtDict = update_fix_dict(rowFixDict,this_fix_dict)
-
-        # --  cells that have to be split along columns
-        if m > 1 :
-            for featId in featIds :
-                # only consider featId if current row has not been considered before
-                if featId not in colFixDict['id'] :
-                    # build bounding box over column
-                    bbox = all_features[featId].geometry().boundingBox()
-                    bbox.setXMinimum( bbox.xMinimum() + TOLERANCE )
-                    bbox.setXMaximum( bbox.xMaximum() - TOLERANCE )
-                    bbox.setYMinimum( grid_bbox.yMinimum() )
-                    bbox.setYMaximum( grid_bbox.yMaximum() )
-                    # get features in current column
-                    colFeatIds = grid_layerIndex.intersects( bbox )
-                    # update fix_dict with features in current column
-                    this_fix_dict = { 'id':colFeatIds , 'n':[1]*len(colFeatIds), 'm':[m]*len(colFeatIds) }
-                    colFixtDict = update_fix_dict(colFixDict,this_fix_dict)
-
-        fix_dict = rowFixDict.copy()
-        fix_dict = update_fix_dict(fix_dict,colFixDict)
-        newFeatIds = split_cells(fix_dict, grid_layer)
-        #print("OPTIM OVER %s sec" % (time.time() - start_time))
-        return()
-
-    # -- Refinement procedure for nested grids
-
-    # init iteration counter
-    itCount = 0
-
-    # init fix dict
-    fix_dict = { 'id': featIds , 'n':[n]*len(featIds), 'm':[m]*len(featIds) }
-
-    # Continue until input_features is empty
-    while len(fix_dict['id']) > 0:
-
-        # Split input_features
-        newFeatIds = split_cells(fix_dict, grid_layer)
-
-        # Get all the features
-        all_features = {feature.id(): feature for feature in grid_layer.getFeatures()}
-
-        # Initialize spatial index
-        grid_layerIndex = QgsSpatialIndex()
-        # Fill spatial Index
-        for feat in all_features.values():
-            grid_layerIndex.insertFeature(feat)
-
-        # re-initialize the list of features to be fixed
-        fix_dict = { 'id':[] , 'n':[], 'm':[] }
-
-        # Initialize progress bar
-        if progress_bar is not None :
-            progress_bar.setRange(0,100)
-            progress_bar.setValue(0)
-
-        count = 0
-        countMax = len(newFeatIds)
-        countUpdate = countMax * 0.05 # update each 5%
-
-        # Iterate over newFeatures to check topology
-        for newFeatId in newFeatIds:
-            # Get the neighbors of newFeatId that must be fixed
-            this_fix_dict = check_topo( newFeatId, n, m, topo_rules, all_features, grid_layer, grid_layerIndex)
-            # Update fix_dict with this_fix_dict
-            fix_dict = update_fix_dict(fix_dict,this_fix_dict)
-            # update counter
-            count += 1
-           # update progress_bar
-            if int( np.fmod( count, countUpdate ) ) == 0:
-                prog = int( count / countMax * 100 )
-                if progress_bar is not None :
-                    progress_bar.setValue(prog)
-                QCoreApplication.processEvents()
-
-        if progress_bar is not None : 
-            progress_bar.setValue(100)
-
-        # Update iteration counter
-        itCount+=1
-        if labelIter is not None : 
-            labelIter.setText(unicode(itCount))
+    no_change = ( np.array([], dtype=np.int64), np.empty((0, 4)), np.empty((0, 4)), np.array([], dtype=np.int64) )
+    all_fids = adjacency.fids
+    width = adjacency.xmax - adjacency.xmin
+    height = adjacency.ymax - adjacency.ymin
+    selected = np.zeros(all_fids.size, dtype=bool)
+    selected[ adjacency.index( np.unique(featIds) ) ] = True
+
+    # selected neighbors of the same size, sharing a whole edge, at the right and below each cell
+    src, dst = adjacency.index(adjacency.src), adjacency.index(adjacency.dst)
+    edge_size = np.where( (adjacency.direction == ADJ_RIGHT) | (adjacency.direction == ADJ_LEFT),
+            height[src], width[src] )
+    same = selected[src] & selected[dst] & \
+            np.isclose(width[src], width[dst], rtol = TOLERANCE, atol = 0) & \
+            np.isclose(height[src], height[dst], rtol = TOLERANCE, atol = 0) & \
+            np.isclose(adjacency.length, edge_size, rtol = TOLERANCE, atol = 0)
+    next_cell = {}
+    for direction in (ADJ_RIGHT, ADJ_BOTTOM) :
+        next_cell[direction] = np.full(all_fids.size, -1, dtype=np.int64)
+        edges = same & (adjacency.direction == direction)
+        next_cell[direction][ src[edges] ] = dst[edges]
+
+    # blocks of n x m cells, row-wise from their top-left cell
+    anchors = np.flatnonzero(selected)
+    blocks = np.empty( (anchors.size, n*m), dtype=np.int64 )
+    row_start = anchors
+    for i in range(n) :
+        cell = row_start
+        for j in range(m) :
+            blocks[:, i*m + j] = cell
+            cell = np.where( cell >= 0, next_cell[ADJ_RIGHT][np.maximum(cell, 0)], -1 )
+        row_start = np.where( row_start >= 0, next_cell[ADJ_BOTTOM][np.maximum(row_start, 0)], -1 )
+    blocks = blocks[ np.all(blocks >= 0, axis = 1) ]
+
+    # blocks without overlap, from top-left to bottom-right
+    order = np.lexsort( (adjacency.xmin[blocks[:, 0]], -adjacency.ymax[blocks[:, 0]]) )
+    used = np.zeros(all_fids.size, dtype=bool)
+    groups = []
+    for block in blocks[order] :
+        if not used[block].any() :
+            used[block] = True
+            groups.append(block)
+    if len(groups) == 0 :
+        return(no_change)
+    groups = np.array(groups, dtype=np.int64)
+
+    # extents of merged cells
+    group_width = width[groups].sum(axis = 1) / n
+    group_height = height[groups].sum(axis = 1) / m
+
+    # cancel merges breaking topo_rules, until all merges are valid
+    accepted = np.ones(groups.shape[0], dtype=bool)
+    if topo_rules['model'] is not None and topo_rules['nmax'] is not None :
+        group_of = np.full(all_fids.size, -1, dtype=np.int64)
+        group_of[groups.ravel()] = np.repeat( np.arange(groups.shape[0]), n*m )
+        edges = (group_of[src] >= 0) & (group_of[src] != group_of[dst])
+        g_src, g_dst = group_of[src[edges]], group_of[dst[edges]]
+        e_dst, e_direction = dst[edges], adjacency.direction[edges]
+        horizontal = (e_direction == ADJ_RIGHT) | (e_direction == ADJ_LEFT)
+        while True :
+            merged_dst = (g_dst >= 0) & accepted[np.maximum(g_dst, 0)]
+            # sizes compared across the shared edge : heights for horizontal neighbors, widths otherwise
+            src_size = np.where( horizontal, group_height[g_src], group_width[g_src] )
+            dst_size = np.where( horizontal,
+                    np.where( merged_dst, group_height[np.maximum(g_dst, 0)], height[e_dst] ),
+                    np.where( merged_dst, group_width[np.maximum(g_dst, 0)], width[e_dst] ) )
+            invalid = accepted[g_src] & ( src_size > dst_size * topo_rules['nmax'] * (1 + TOLERANCE) )
+            if not invalid.any() :
+                break
+            accepted[ g_src[invalid] ] = False
+    groups = groups[accepted]
+    if groups.shape[0] == 0 :
+        return(no_change)
+
+    # corners of merged cells, from the corners of the block corner cells
+    cx, cy = cells.corners( all_fids[groups.ravel()] )
+    cx, cy = cx.reshape(-1, n*m, 4), cy.reshape(-1, n*m, 4)
+    corner_cells = [ 0, m - 1, n*m - 1, (n - 1)*m ]
+    new_cx = np.column_stack( [ cx[:, cell, k] for k, cell in enumerate(corner_cells) ] )
+    new_cy = np.column_stack( [ cy[:, cell, k] for k, cell in enumerate(corner_cells) ] )
+
+    return( all_fids[groups.ravel()], new_cx, new_cy, all_fids[groups[:, 0]] )
 
 
 # ======================================================================================
-def split_cells(fix_dict, v_layer = QgsVectorLayer()):
+def split_cells(fix_dict, v_layer = QgsVectorLayer(), all_features = None, spatial_index = None):
     """
     Description
     ----------
 
-    Split features in fix_dict into n and m identical parts along rows and columns, respectively
+    Split features in fix_dict into n and m identical parts along rows and columns, respectively.
+    All new cells are computed at once from the corners of the split cells (rotated
+    cells are split in their own frame), and added to v_layer with a single addFeatures.
+    New cells inherit the attributes of the cell they come from.
 
     Parameters
     ----------
-    fix_dict :  { 'id':[] , 'n':[], 'm':[] }
-    n, m  : number of parts to split feature
+    fix_dict :  FixSet, or fix dictionary { 'id':[] , 'n':[], 'm':[] }
+    v_layer : grid layer
+    all_features (optional) : feature cache {fid:feature} of v_layer. If provided,
+                   it is used instead of reading v_layer, and it is updated :
+                   split features are removed and new features are added.
+    spatial_index (optional) : QgsSpatialIndex of v_layer, updated the same way.
+
     Returns
     -------
 
-    List of IDs of new features
+    List of IDs of new features, in the order of fix_dict. The cells of each split
+    feature are ordered as in make_rgrid (from bottom to top, then from left to right).
 
     Examples
     --------
-    >>>
+    >>> new_fids = split_cells(fix_set, grid_layer, all_features, grid_layerIndex)
     """
+    featIds = list(fix_dict['id'])
+    if len(featIds) == 0 :
+        return([])
 
-    # note that n and m parameters are obsolete.
-
-    # Get all the features from v_layer
-    all_features = {feature.id(): feature for (feature) in v_layer.getFeatures()}
-
-    # remove features that must be split from v_layer
-    # this operation must be done before any feature add
-    # since ids() are updated
-    v_layer.dataProvider().deleteFeatures(fix_dict['id'])
-
-    # Initialize the list of new features
-    newFeatIds = []
+    # Get the features to split from v_layer
+    if all_features is None :
+        request = QgsFeatureRequest().setFilterFids(featIds)
+        split_features = {feature.id(): feature for feature in v_layer.getFeatures(request)}
+    else :
+        split_features = { featId : all_features[featId] for featId in featIds }
+    features = [ split_features[featId] for featId in featIds ]
 
-    # Split each element of fix_dict
-    for featId, n, m in zip( fix_dict['id'], fix_dict['n'], fix_dict['m'] ):
-        feat = all_features[featId]
-        newFeatIds.extend( make_rgrid(feat, n, m, v_layer.dataProvider() ) )
+    # corners of split cells
+    # Note : rectangle points are numbered from top-left to bottom-left, clockwise
+    fids, cx, cy = get_cell_corners(v_layer, features)
+
+    # position of new cells in split cells : line (from bottom) and column
+    n = np.asarray(fix_dict['n'], dtype=np.int64)
+    m = np.asarray(fix_dict['m'], dtype=np.int64)
+    counts = n*m
+    parent = np.repeat( np.arange(len(featIds)), counts )
+    k = np.arange(parent.size) - np.repeat( np.cumsum(counts) - counts, counts )
+    line, col = np.divmod( k, m[parent] )
+    row = n[parent] - 1 - line
+
+    # relative coordinates of new cell edges in split cells
+    s0, s1 = col / m[parent], (col + 1.) / m[parent]
+    t0, t1 = row / n[parent], (row + 1.) / n[parent]
+
+    def interpolate(c, s, t):
+        # bilinear interpolation between corners of split cells, exact at corners
+        c = c[parent]
+        top = c[:,0]*(1. - s) + c[:,1]*s
+        bottom = c[:,3]*(1. - s) + c[:,2]*s
+        return( top*(1. - t) + bottom*t )
+
+    new_cx = np.column_stack( [ interpolate(cx, s0, t0), interpolate(cx, s1, t0),
+        interpolate(cx, s1, t1), interpolate(cx, s0, t1) ] )
+    new_cy = np.column_stack( [ interpolate(cy, s0, t0), interpolate(cy, s1, t0),
+        interpolate(cy, s1, t1), interpolate(cy, s0, t1) ] )
+
+    # geometries of new cells, packed in a single WKB buffer
+    wkb = rect_wkb(new_cx, new_cy).tobytes()
+    wkb_size = WKB_RECT_DTYPE.itemsize
+
+    # build new features
+    new_features = []
+    for k, parent_index in enumerate(parent) :
+        new_feat = QgsFeature()
+        new_feat.setAttributes( features[parent_index].attributes() )
+        new_geom = QgsGeometry()
+        new_geom.fromWkb( wkb[k*wkb_size:(k+1)*wkb_size] )
+        new_feat.setGeometry(new_geom)
+        new_features.append(new_feat)
+
+    # replace split features with new features
+    # features are removed before any feature add, since ids() are updated
+    provider = v_layer.dataProvider()
+    provider.deleteFeatures(featIds)
+    res, added_features = provider.addFeatures(new_features)
+    newFeatIds = [ feat.id() for feat in added_features ]
+    invalidate_cell_extents( v_layer, featIds + newFeatIds )
+
+    # update the feature cache and the spatial index
+    for featId, feat in split_features.items() :
+        if spatial_index is not None :
+            spatial_index.deleteFeature(feat)
+        if all_features is not None :
+            del all_features[featId]
+    for feat in added_features :
+        if all_features is not None :
+            all_features[feat.id()] = feat
+        if spatial_index is not None :
+            spatial_index.insertFeature(feat)
 
     # Return new features
     return(newFeatIds)
 
 # --------------------------------------------------------------------------------------------------------------
 # Check the coherence of a boundary between 2 grid elements
-def is_valid_boundary( feat1, feat2, direction, topo_rules ):
+def is_valid_boundary( feat1, feat2, direction, topo_rules, extents = None ):
     """
     Description
 
@@ -534,12 +2148,28 @@ def is_valid_boundary( feat1, feat2, direction, topo_rules ):
         # -- for Nested
         # topo_rules = {'model':'nested', 'nmax':2}
 
-    # get feat1 geometry
-    dx1, dy1 = rect_size(feat1)['dx'], rect_size(feat1)['dy']
+    # get feat1 and feat2 geometry
+    size1, size2 = rect_size(feat1, extents), rect_size(feat2, extents)
+
+    return( is_valid_size_ratio( size1['dx'], size1['dy'], size2['dx'], size2['dy'], direction, topo_rules ) )
+
+
+# --------------------------------------------------------------------------------------------------------------
+def is_valid_size_ratio( dx1, dy1, dx2, dy2, direction, topo_rules ):
+    """
+    Description
+    ----------
+    Checks the size ratio between cell 1 (dx1, dy1) and its neighbor cell 2 (dx2, dy2)
+    in direction (see is_valid_boundary) against topo_rules
 
-    # get feat2 geometry
-    dx2, dy2 = rect_size(feat2)['dx'], rect_size(feat2)['dy']
+    Returns
+    -------
+    True if the boundary satisfies topo_rules
 
+    Examples
+    --------
+    >>> is_valid_size_ratio( 10., 10., 20., 20., 2, {'model':'nested', 'nmax':2} )
+    """
     # Check if the boundary satisfies topo_rules
     # Note: in the logic of this program, we only consider the case
     # when the neighbor is bigger than the given cell (dy2/dy1 >=1)
@@ -563,29 +2193,42 @@ def is_valid_boundary( feat1, feat2, direction, topo_rules ):
 # --------------------------------------------------------------------------------------------------------------
 # Check topology of feat's neighbors and
 # return the neighbors that don't satisfy topo_rules
-def check_topo(featId, n, m, topo_rules, all_features, v_layer, v_layerIndex):
+def check_topo(featId, n, m, topo_rules, all_features, v_layer, v_layerIndex, adjacency = None):
     """
     Description
+    ----------
+    Checks the topology of feature featId with its neighbors
 
     Parameters
     ----------
-    p1 : parameter 1
+    featId : id of the feature to check
+    n, m : number of split along rows and columns (modflow-like grids)
+    topo_rules : topological rules
+    all_features : feature cache {fid:feature} of v_layer
+    v_layer : grid layer
+    v_layerIndex : spatial index of v_layer
+    adjacency (optional) : CellAdjacency of v_layer. If provided, neighbors and
+                cell sizes are read from it instead of comparing geometries.
 
     Returns
     -------
 
-    out1 : output1
+    FixSet of features that do not satisfy topo_rules
 
     Examples
     --------
-    >>>
+    >>> fix_set = check_topo(fid, 2, 2, topo_rules, all_features, grid_layer, grid_layerIndex, adjacency)
     """
 
+    # Neighbors and cell sizes from the adjacency graph
+    if adjacency is not None :
+        return( check_topo_adjacency(featId, n, m, topo_rules, adjacency) )
+
     # Get the feature
     feat = all_features[featId]
 
-    # Initialize list of features to be fixed
-    fix_dict = { 'id':[] , 'n':[], 'm':[] }
+    # Initialize set of features to be fixed
+    fix_dict = FixSet()
 
     # Find neighbors
     neighbors = find_neighbors(feat, all_features, v_layerIndex)
@@ -607,15 +2250,59 @@ def check_topo(featId, n, m, topo_rules, all_features, v_layer, v_layerIndex):
             # check feat, neighbor boundary
             if not is_valid_boundary( feat, neighbor, direction, topo_rules ) :
                 # update fix_dict : add neighbor
-                fix_dict = update_fix_dict( fix_dict, { 'id':[neighbor.id()] , 'n':[N], 'm':[M] } )
+                fix_dict.add( neighbor.id(), N, M )
             # check neighbor, feat boundary
             if not is_valid_boundary( neighbor, feat, direction, topo_rules ) :
                 # update fix_dict : add feat
-                fix_dict = update_fix_dict( fix_dict, { 'id':[feat.id()] , 'n':[N], 'm':[M] } )
+                fix_dict.add( feat.id(), N, M )
 
     # return features that do not satisfy topo_rules
     return fix_dict
 
+# --------------------------------------------------------------------------------------------------------------
+def check_topo_adjacency(featId, n, m, topo_rules, adjacency):
+    """
+    Description
+    ----------
+    Same as check_topo, neighbors and cell sizes being read
+    from the adjacency graph of the grid (see get_cell_adjacency)
+
+    Returns
+    -------
+
+    FixSet of features that do not satisfy topo_rules
+
+    Examples
+    --------
+    >>> fix_set = check_topo_adjacency(fid, 2, 2, topo_rules, adjacency)
+    """
+    fix_dict = FixSet()
+
+    nbr_fids, directions, lengths = adjacency.neighbors(featId)
+    xmin, xmax, ymin, ymax = adjacency.extents( np.append(featId, nbr_fids) )
+    dx, dy = xmax - xmin, ymax - ymin
+
+    for k, (nbr_fid, direction) in enumerate( zip(nbr_fids, directions) ) :
+        # Special case for nested grid
+        if topo_rules['model']=='nested':
+            N = M = 2
+        else :
+            N = n
+            M = m
+            # Set refinement to 1 for orthogonal directions
+            if direction in [2,4] : # horizontally
+                M = 1
+            elif direction in [1,3] : # vertically
+                N = 1
+        # check feat, neighbor boundary
+        if not is_valid_size_ratio( dx[0], dy[0], dx[k+1], dy[k+1], direction, topo_rules ) :
+            fix_dict.add( int(nbr_fid), N, M )
+        # check neighbor, feat boundary
+        if not is_valid_size_ratio( dx[k+1], dy[k+1], dx[0], dy[0], direction, topo_rules ) :
+            fix_dict.add( featId, N, M )
+
+    return(fix_dict)
+
 # --------------------------------------------------------------------------------------------------------------
 def find_neighbors(input_feature, all_features, v_layerIndex):
     """
@@ -650,6 +2337,12 @@ def find_neighbors(input_feature, all_features, v_layerIndex):
     # Note : rectangle points are numbered from top-left to bottom-left, clockwise
     p0, p1, p2, p3 = ftools_utils.extractPoints(input_feature.geometry())[:4]
 
+    # Unit vectors along the edges of input_feature (cell frame),
+    # so that rotated grids are handled
+    top_length = np.hypot( p1.x() - p0.x(), p1.y() - p0.y() )
+    x_axis = { 'x' : (p1.x() - p0.x()) / top_length, 'y' : (p1.y() - p0.y()) / top_length }
+    y_axis = { 'x' : -x_axis['y'], 'y' : x_axis['x'] }
+
     # Iterate over neighbors
     for featNeighbor in featNeighbors:
 
@@ -682,20 +2375,20 @@ def find_neighbors(input_feature, all_features, v_layerIndex):
         elif is_over(p0, q2):
             cell_dir = 8 # feature B is to the top-left corner of A
         elif is_colinear( build_vect(q3, p0), build_vect(p1, q2) ) and \
-                is_colinear(build_vect(q3, p0), {'x':1, 'y':0} ) and \
-                is_colinear(build_vect(p1, q2), {'x':1, 'y':0} ) :
+                is_colinear(build_vect(q3, p0), x_axis ) and \
+                is_colinear(build_vect(p1, q2), x_axis ) :
             cell_dir = 1 # feature B is above A
         elif is_colinear( build_vect(q3, p2), build_vect(p1, q0) ) and \
-                is_colinear(build_vect(q3, p2), {'x':0, 'y':1} ) and \
-                is_colinear(build_vect(p1, q0), {'x':0, 'y':1} ) :
+                is_colinear(build_vect(q3, p2), y_axis ) and \
+                is_colinear(build_vect(p1, q0), y_axis ) :
             cell_dir = 2 # feature B is to the right of A
         elif is_colinear( build_vect(q0, p3), build_vect(p2, q1) ) and \
-                is_colinear(build_vect(q0, p3), {'x':1, 'y':0} ) and \
-                is_colinear(build_vect(p2, q1), {'x':1, 'y':0} ) :
+                is_colinear(build_vect(q0, p3), x_axis ) and \
+                is_colinear(build_vect(p2, q1), x_axis ) :
             cell_dir = 3 # feature B is below A
         elif is_colinear( build_vect(q2, p3), build_vect(p0, q1) ) and \
-                is_colinear(build_vect(q2, p3), {'x':0, 'y':1} ) and \
-                is_colinear(build_vect(p0, q1), {'x':0, 'y':1} ) :
+                is_colinear(build_vect(q2, p3), y_axis ) and \
+                is_colinear(build_vect(p0, q1), y_axis ) :
                     cell_dir = 4 # feature B is to the left of A
         else :
             cell_dir = -1 # feature B is not a neighbor in a valid grid
@@ -753,9 +2446,149 @@ def get_centroid_layer(grid_layer) :
         return(None)
 
 
+# -----------------------------------------------------
+# get structured grid description of a regular (modflow) grid layer
+def get_structured_grid(grid_layer, angle = None, cells = None):
+    """
+    Description
+    ----------
+    Builds the StructuredGrid (origin, delr, delc, fid <-> (row, col) mapping)
+    of a structured grid layer, with a single scan over its features.
+    Rotated grids are supported, cells being matched in the grid frame.
+    Raises ValueError if the layer is not a structured grid.
+
+    Parameters
+    ----------
+    grid_layer : the structured grid layer
+    angle (optional) : rotation angle of the grid (degrees, counter-clockwise).
+                If not provided, the angle stored with the layer is used (see set_grid_angle),
+                or it is estimated from cell edges, modulo 90 degrees.
+    cells (optional) : CellExtents of the cells (e.g. GridCells), read instead of grid_layer
+
+    Returns
+    -------
+    StructuredGrid instance
+
+    Examples
+    --------
+    >>> sgrid = get_structured_grid(grid_layer)
+    >>> row, col = sgrid.row_col(grid_layer.selectedFeatureIds())
+    """
+    if angle is None :
+        angle = get_grid_angle(grid_layer)
+    fids, cx, cy = get_cell_corners(grid_layer, cells = cells)
+    return( StructuredGrid.from_corners( fids, cx, cy, decimals = MAX_DECIMALS, angle = angle) )
+
+
+# ======================================================================================
+def get_quadtree_grid(grid_layer, angle = None, cells = None):
+    """
+    Description
+    ----------
+    Builds the QuadTreeGrid (levels, row and column indexes of cells) of a nested
+    grid layer, with a single scan over its features.
+    Raises ValueError if the layer is not a nested grid.
+
+    Parameters
+    ----------
+    grid_layer : the nested grid layer
+    angle (optional) : rotation angle of the grid (degrees, counter-clockwise).
+                If not provided, the angle stored with the layer is used (see set_grid_angle),
+                or it is estimated from cell edges, modulo 90 degrees.
+    cells (optional) : CellExtents of the cells (e.g. GridCells), read instead of grid_layer
+
+    Returns
+    -------
+    QuadTreeGrid instance
+
+    Examples
+    --------
+    >>> qtree = get_quadtree_grid(grid_layer)
+    """
+    if angle is None :
+        angle = get_grid_angle(grid_layer)
+    fids, cx, cy = get_cell_corners(grid_layer, cells = cells)
+    return( QuadTreeGrid.from_corners( fids, cx, cy, decimals = MAX_DECIMALS, angle = angle) )
+
+
+# ======================================================================================
+def get_cell_corners(grid_layer, features = None, cells = None):
+    """
+    Description
+    ----------
+    Returns the feature ids and the corners of the (rectangular) cells of grid_layer
+
+    Parameters
+    ----------
+    grid_layer : the grid layer
+    features (optional) : iterable of features, read instead of grid_layer
+    cells (optional) : CellExtents of the cells (e.g. GridCells), read instead of grid_layer
+
+    Returns
+    -------
+    (fids, cx, cy) : array of feature ids, and arrays of shape (N, 4) with the
+    corner coordinates of cells, numbered clock-wise from top-left
+
+    Examples
+    --------
+    >>> fids, cx, cy = get_cell_corners(grid_layer)
+    """
+    # read from the cell extent cache of grid_layer
+    if features is None :
+        extents = cells if cells is not None else get_cell_extents(grid_layer)
+        cx, cy = extents.corners()
+        return( extents.fids.copy(), cx.copy(), cy.copy() )
+
+    # fetch cell corners
+    # Note : rectangle points are numbered from top-left to bottom-left, clockwise
+    fids = []
+    corners = []
+    for feat in features :
+        geom = feat.geometry()
+        fids.append( feat.id() )
+        corners.append( [ coord for i in range(4) for coord in (geom.vertexAt(i).x(), geom.vertexAt(i).y()) ] )
+    corners = np.array(corners, dtype=float).reshape(-1, 4, 2)
+
+    return( np.array(fids, dtype=np.int64), corners[:,:,0], corners[:,:,1] )
+
+
+# ======================================================================================
+def get_cell_adjacency(grid_layer, features = None, angle = None, cells = None):
+    """
+    Description
+    ----------
+    Builds the adjacency graph of the cells of a grid layer (structured, nested
+    or refined), in a single scan over its features : neighbor ids, direction
+    (see find_neighbors) and length of shared edges, as CSR arrays.
+
+    Parameters
+    ----------
+    grid_layer : the grid layer
+    features (optional) : iterable of features, read instead of grid_layer
+    angle (optional) : rotation angle of the grid (degrees, counter-clockwise).
+                If not provided, the angle stored with the layer is used (see set_grid_angle),
+                or it is estimated from cell edges, modulo 90 degrees.
+    cells (optional) : CellExtents of the cells (e.g. GridCells), read instead of grid_layer
+
+    Returns
+    -------
+    CellAdjacency instance
+
+    Examples
+    --------
+    >>> adjacency = get_cell_adjacency(grid_layer)
+    >>> nbr_fids, direction, length = adjacency.neighbors(fid)
+    >>> fids, indptr, indices, direction, length = adjacency.csr()
+    """
+    if angle is None :
+        angle = get_grid_angle(grid_layer)
+    fids, cx, cy = get_cell_corners(grid_layer, features, cells)
+    return( CellAdjacency.from_corners(fids, cx, cy, decimals = MAX_DECIMALS, angle = angle) )
+
+
 # -----------------------------------------------------
 # get nrow and ncol or a regular (modflow) grid layer
-def get_rgrid_nrow_ncol(grid_layer):
+def get_rgrid_nrow_ncol(grid_layer, sgrid = None):
     """
     Description
     ----------
@@ -764,6 +2597,7 @@ def get_rgrid_nrow_ncol(grid_layer):
     Parameters
     ----------
     grid_layer : the structured grid layer
+    sgrid (optional) : StructuredGrid of grid_layer, built if not provided
 
     Returns
     -------
@@ -775,48 +2609,14 @@ def get_rgrid_nrow_ncol(grid_layer):
     >>> nrow, ncol = get_rgrid_nrow_ncol(layer)
     """
 
-    # TODO : check if the grid is actually regular
-
-    # Init variables
-    all_features = {feat.id():feat for feat in grid_layer.getFeatures()}
-    allCentroids = [feat.geometry().centroid().asPoint() \
-                        for feat in all_features.values()]
-    centroids_ids = list(all_features.keys())
-    centroids_x = [centroid.x() for centroid in allCentroids]
-    centroids_y = [centroid.y() for centroid in allCentroids]
-    centroids = np.array( [centroids_ids , centroids_x, centroids_y] )
-    centroids = centroids.T
-
-    # get ncol :
-    # sort by decreasing y and increasing x
-    idx_row = np.lexsort([centroids[:,1],-centroids[:,2]])
-    yy = centroids[idx_row,2]
-    # iterate along first row and count number of items with same y
-    i=0
-    #return yy
-    while is_equal(yy[i],yy[i+1]):
-        i+=1
-        if i >= (yy.size - 1):
-            break # for one-row grids
-    ncol = i+1
-
-    # get nrow :
-    # sort by increasing x and decreasing y
-    idx_col = np.lexsort([-centroids[:,2],centroids[:,1]])
-    xx=centroids[idx_col,1]
-    # iterate over first col and count number of items with same x
-    i=0
-    while is_equal(xx[i],xx[i+1]) :
-        i+=1
-        if i >= (xx.size-1):
-            break # for one-column grids
-    nrow = i+1
+    if sgrid is None :
+        sgrid = get_structured_grid(grid_layer)
 
     # return nrow, ncol
-    return(nrow, ncol)
+    return(sgrid.nrow, sgrid.ncol)
 
 # ======================================================================================
-def get_rgrid_delr_delc(grid_layer):
+def get_rgrid_delr_delc(grid_layer, sgrid = None):
     """
     Description
     ----------
@@ -826,6 +2626,7 @@ def get_rgrid_delr_delc(grid_layer):
     Parameters
     ----------
     grid_layer: the (modflow-like) structured grid layer
+    sgrid (optional) : StructuredGrid of grid_layer, built if not provided
 
     Returns
     -------
@@ -838,52 +2639,12 @@ def get_rgrid_delr_delc(grid_layer):
     >>> delr, delc = get_rgrid_delr_delc(grid_layer)
     """
 
-
-    # TODO : check if the grid is actually regular
-
-    # Load layer
-    #allAttrs = grid_layer.pendingAllAttributesList()
-    #grid_layer.select(allAttrs)
-    #grid_layer.dataProvider().select(allAttrs)
-
-    # Init variables
-    all_features = {feat.id():feat for feat in grid_layer.getFeatures()}
-    allCentroids = [feat.geometry().centroid().asPoint() \
-                        for feat in all_features.values()]
-    centroids_ids = list(all_features.keys())
-    centroids_x = [centroid.x() for centroid in allCentroids]
-    centroids_y = [centroid.y() for centroid in allCentroids]
-    centroids = np.array( [centroids_ids , centroids_x, centroids_y] )
-    centroids = centroids.T
-
-    # get nrow, ncol
-    nrow, ncol =  get_rgrid_nrow_ncol(grid_layer)
-
-    # init list
-    delr = []
-    delc = []
-
-    # sort by decreasing y and increasing x
-    idx_row = np.lexsort([centroids[:,1],-centroids[:,2]])
-    # iterate along first row
-    for featId in centroids[idx_row,0][:ncol]:
-        # Extract the four corners of feat
-        # Note : rectangle points are numbered from top-left to bottom-left, clockwise
-        p0, p1, p2, p3 = ftools_utils.extractPoints(all_features[featId].geometry())[:4]
-        delr.append( p1.x() - p0.x() )
-
-    # sort by increasing x and decreasing y
-    idx_col = np.lexsort([-centroids[:,2],centroids[:,1]])
-    # iterate along first col
-    for featId in centroids[idx_col,0][:nrow]:
-        # Extract the four corners of feat
-        # Note : rectangle points are numbered from top-left to bottom-left, clockwise
-        p0, p1, p2, p3 = ftools_utils.extractPoints(all_features[featId].geometry())[:4]
-        delc.append( p0.y() - p3.y() )
+    if sgrid is None :
+        sgrid = get_structured_grid(grid_layer)
 
     # round
-    delr = [round(val, MAX_DECIMALS) for val in delr]
-    delc = [round(val, MAX_DECIMALS) for val in delc]
+    delr = [round(val, MAX_DECIMALS) for val in sgrid.delr]
+    delc = [round(val, MAX_DECIMALS) for val in sgrid.delc]
 
     # If all values are identical, return scalar
     if delr.count(delr[0]) == len(delr):
@@ -895,40 +2656,36 @@ def get_rgrid_delr_delc(grid_layer):
     return(delr, delc)
 
 # ======================================================================================
-def rgrid_numbering(grid_layer):
+def rgrid_numbering(grid_layer, sgrid = None, progress_bar = None):
     """
     Description
     ----------
-    Adds attributes NROW, NCOL to a regular (modflow) grid layer
+    Adds attributes ROW, COL, CX, CY to a regular (modflow) grid layer
 
     Parameters
     ----------
-    p1 : parameter 1
+    grid_layer : the structured grid layer
+    sgrid (optional) : StructuredGrid of grid_layer, built if not provided
+    progress_bar (optional) : progress bar in dialog (or ProgressReporter).
+                  Attributes are written by blocks of BAND_SIZE cells, if canceled
+                  the remaining blocks are not written.
 
     Returns
     -------
 
-    out1 : output1
+    True if attributes have been successfully written
 
     Examples
     --------
-    >>>
+    >>> res = rgrid_numbering(grid_layer)
     """
 
-    # TODO : check if the grid is actually regular
-
     caps = grid_layer.dataProvider().capabilities()
 
     # Init variables
     res = 1
-    all_features = {feat.id():feat for feat in grid_layer.getFeatures()}
-    allCentroids = [feat.geometry().centroid().asPoint() \
-                        for feat in all_features.values()]
-    centroids_ids = list(all_features.keys())
-    centroids_x = np.around(np.array([centroid.x() for centroid in allCentroids]), MAX_DECIMALS)
-    centroids_y = np.around(np.array([centroid.y() for centroid in allCentroids]), MAX_DECIMALS)
-    centroids = np.array( [centroids_ids , centroids_x, centroids_y] )
-    centroids = centroids.T
+    if sgrid is None :
+        sgrid = get_structured_grid(grid_layer)
 
     # Fetch field name index of ROW and COL
     # If columns don't exist, add them
@@ -961,35 +2718,33 @@ def rgrid_numbering(grid_layer):
     # update fields
     grid_layer.updateFields()
 
-    # get nrow, ncol
-    nrow, ncol =  get_rgrid_nrow_ncol(grid_layer)
-
-    # Iterate over grid row-wise and column wise
-    # sort by decreasing y and increasing x
-    idx = np.lexsort( [centroids_x,-1*centroids_y] )
-    centroids = centroids[idx,:]
-    row = 0 # 0-based
-    col = 0 # 0-based
+    # Row and column indexes (0-based) and centroids of all cells,
+    # row-wise and column wise
+    rows, cols = np.indices( (sgrid.nrow, sgrid.ncol) )
+    centroids_x, centroids_y = sgrid.centroids()
+    centroids_x = np.around(centroids_x, MAX_DECIMALS)
+    centroids_y = np.around(centroids_y, MAX_DECIMALS)
 
     # start editing
     grid_layer.startEditing()
 
-    attrValues = {}
-
-    for i in range(centroids.shape[0]):
-        if col > ncol - 1:
-            col = 0
-            row = row + 1
-        featId = centroids[i, 0]
-        cx = centroids[i, 1]
-        cy = centroids[i, 2]
-        attr = { row_field_idx : int(row), col_field_idx : int(col),\
-                cx_field_idx : float(cx), cy_field_idx : float(cy)}
-        attrValues[featId] = attr
-        col+=1
-
-    # write attributes to shapefile
-    res = grid_layer.dataProvider().changeAttributeValues(attrValues)
+    fids = sgrid.fids.ravel()
+    rows, cols = rows.ravel(), cols.ravel()
+    centroids_x, centroids_y = centroids_x.ravel(), centroids_y.ravel()
+
+    # write attributes to shapefile, by blocks
+    progress = get_progress_reporter(progress_bar, total = fids.size)
+    for start in range(0, fids.size, BAND_SIZE) :
+        block = slice(start, start + BAND_SIZE)
+        attrValues = { int(featId) : { row_field_idx : int(row), col_field_idx : int(col),
+                    cx_field_idx : float(cx), cy_field_idx : float(cy) } \
+                    for featId, row, col, cx, cy in zip( fids[block], rows[block], cols[block],
+                        centroids_x[block], centroids_y[block] ) }
+        res = grid_layer.dataProvider().changeAttributeValues(attrValues)
+        if progress.update(start + BAND_SIZE) :
+            res = False
+            break
+    progress.finish()
 
     # commit
     grid_layer.commitChanges()
@@ -999,7 +2754,7 @@ def rgrid_numbering(grid_layer):
 
 
 # ======================================================================================
-def get_overlapping_features_areas(feat, spatialIndex, grid_layerFeatures) :
+def get_overlapping_features_areas(feat, spatialIndex, grid_layerFeatures, extents = None, feat_bbox = None) :
     """
     Description
 
@@ -1008,6 +2763,10 @@ def get_overlapping_features_areas(feat, spatialIndex, grid_layerFeatures) :
     feat : QgsFeature (cell of a Qgridder mesh)
     spatialIndex : QgsSpatialIndex of the (overlying / underlying) grid vector layer
     grid_layerFeatures : dictionary of the features of the (overlying / underlying) grid vector layer
+    extents (optional) : CellExtentCache of the (overlying / underlying) grid vector layer,
+                areas are read from it if provided
+    feat_bbox (optional) : (xmin, xmax, ymin, ymax) bounding box of feat,
+                computed from its geometry if not provided
 
 
     Returns
@@ -1019,17 +2778,26 @@ def get_overlapping_features_areas(feat, spatialIndex, grid_layerFeatures) :
     >>>
     """
     # get bbox of feat
-    featBbox = feat.geometry().boundingBox()
+    if feat_bbox is None :
+        featBbox = feat.geometry().boundingBox()
+        feat_bbox = (featBbox.xMinimum(), featBbox.xMaximum(), featBbox.yMinimum(), featBbox.yMaximum())
+    xmin, xmax, ymin, ymax = feat_bbox
     # shrink bbox of TOLERANCE
     # doing so, we do not select neighbor cells
-    shrinkedBbox = QgsRectangle(featBbox.xMinimum()+TOLERANCE,
-            featBbox.yMinimum()+TOLERANCE,
-            featBbox.xMaximum()-TOLERANCE,
-            featBbox.yMaximum()-TOLERANCE
+    shrinkedBbox = QgsRectangle(xmin+TOLERANCE,
+            ymin+TOLERANCE,
+            xmax-TOLERANCE,
+            ymax-TOLERANCE
             )
     # fetch overlapping cells (list of features)
     overlapping_feat_ids = spatialIndex.intersects( shrinkedBbox )
 
+    # areas from the cell extent cache
+    if extents is not None :
+        if len(overlapping_feat_ids) == 0 :
+            return([])
+        return( extents.areas(overlapping_feat_ids).tolist() )
+
     # init output list
     overlapping_cells_areas = []
 
@@ -1072,84 +2840,191 @@ def get_spatial_indexes(all_layers) :
 
 
 # ======================================================================================
-def correct_pseudo3D_grid(all_layers, topo_rules, nproc=1) :
+def refine_layers_by_split(layer_fix_ids, topo_rules, all_layers, nproc = 1, progress_bar = None) :
+    """
+    Description
+    ----------
+    Splits cells of several layers in 2x2 (see refine_by_split). Grid layers are
+    only read and edited in the calling thread : layers are read into StructuredGrid
+    or QuadTreeGrid arrays (see get_split_grid), the split geometry of up to nproc
+    layers is computed concurrently in worker threads, on these arrays only
+    (see split_grid_cells), then changes are applied layer after layer.
+    Layers refined by the geometric procedure are split in the calling thread.
+    Layers may also be GridCells (cells edited in memory, see tasks.py), which
+    must then be structured or nested grids (see get_split_grid).
+
+    Parameters
+    ----------
+    layer_fix_ids : dictionary {layer number : ids of cells to split in 2x2}
+    topo_rules : dictionary describing the rules : {'model':'modflow','nmax':1}
+    all_layers : list of Qgis grid layers (or GridCells)
+    nproc : maximum number of worker threads
+    progress_bar : progress bar in dialog (or ProgressReporter)
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> refine_layers_by_split({0:[12, 13], 2:[5]}, {'model':'nested','nmax':2}, all_layers, nproc = 2)
+    """
+    progress = get_progress_reporter(progress_bar)
+
+    # array representation of layers, read in the calling thread
+    grids = collections.OrderedDict()
+    for layer_num in layer_fix_ids :
+        layer = all_layers[layer_num]
+        if isinstance(layer, GridCells) :
+            grid = get_split_grid(None, 2, 2, topo_rules, cells = layer, angle = layer.angle)
+        else :
+            grid = get_split_grid(layer, 2, 2, topo_rules)
+        if grid is not None :
+            grids[layer_num] = grid
+
+    # split geometry, computed on arrays only
+    def compute(layer_num) :
+        return( split_grid_cells(grids[layer_num], layer_fix_ids[layer_num], 2, 2, topo_rules) )
+    if nproc > 1 and len(grids) > 1 :
+        with concurrent.futures.ThreadPoolExecutor( max_workers = min(nproc, len(grids)) ) as executor :
+            changes = dict( zip( grids.keys(), executor.map(compute, grids.keys()) ) )
+    else :
+        changes = { layer_num : compute(layer_num) for layer_num in grids }
+
+    # apply changes, layer after layer
+    for layer_num, fix_ids in layer_fix_ids.items() :
+        if progress.is_canceled() :
+            return
+        if layer_num in changes :
+            deleted_fids, cx, cy, src_fids = changes[layer_num]
+            if len(src_fids) == 0 :
+                continue
+            if isinstance(all_layers[layer_num], GridCells) :
+                all_layers[layer_num].replace(deleted_fids, cx, cy, src_fids)
+            else :
+                replace_cells(all_layers[layer_num], deleted_fids, cx, cy, src_fids, progress)
+        else :
+            refine_by_split(fix_ids, 2, 2, topo_rules, all_layers[layer_num], progress)
+
+
+# ======================================================================================
+def correct_pseudo3D_grid(all_layers, topo_rules, nproc=1, progress_bar = None) :
     """
     Description
     ----------
     Given a list of grids (all_layers, from top to bottom), checks and
-    refines grid so as to satisfy topo_rules
+    refines grid so as to satisfy topo_rules.
+    Cell arrays of each layer are kept across passes, and only rebuilt for refined
+    layers. After the first pass, only the cells which may have changed state are
+    checked again : new cells, and cells of other layers overlapping refined cells.
+    Each pass checks and splits even layers, then odd layers : layers of a phase
+    are not adjacent, and are split concurrently (see refine_layers_by_split).
     Parameters
     ----------
-    all_layers : list of Qgis grid layers (from top to bottom)
+    all_layers : list of Qgis grid layers (from top to bottom), or of GridCells
+                 (cells edited in memory, see refine_layers_by_split)
     topo_rules : dictionary describing the rules : {'model':'modflow','nmax':1, 'pmax':4}
-    nproc : number of processus to launch in parallel
+    nproc : number of processus to launch in parallel. With nproc > 1, cells are
+            checked by worker processes on cell arrays exported to shared memory
+            (see check3D_features_mp), or copied to workers with Python < 3.8,
+            and up to nproc layers are split concurrently
+    progress_bar : progress bar in dialog (or ProgressReporter). If canceled,
+                   the correction stops after the current layer.
     Returns
     -------
+    VerticalConnectivity of the corrected stack (shared areas between cells of
+    successive layers, see vertical.py), or None if canceled
     Examples
     --------
     >>>
     """
 
     nLayers = len(all_layers)
-    nfix = 1
-    while nfix > 0 :
-        nfix = 0
-        # iterate over each layers of the pseudo-3D mesh
-        for layer_num in range(nLayers) :
-            # build list of dictionaries of all features for each layer
-            all_layers_all_features = []
-            for grid_layer in all_layers :
-                all_layers_all_features.append ( {feat.id():feat for feat in grid_layer.getFeatures() } )
-            # update spatial indexes
-            spatial_indexes = get_spatial_indexes(all_layers)
-            # iterate over each cells of layer layer_num
-            if nproc <= 1 :
-                fix_dict = check3D_features(all_layers_all_features[layer_num].values(),
-                        layer_num, all_layers_all_features, spatial_indexes, topo_rules
-                        )
-            else :
-                # Split all_features into nproc elements
-                all_features_chunks = chunks(all_features, nproc)
-                # Define an output queue
-                output = mp.Queue()
-                # build processes
-                processes = []
-                for i in range(nproc) :
-                    processes.append(mp.Process(target=check3D_features_mp,
-                                        args=(all_features_chunks[i],
-                                        layer_num, all_layers,
-                                        spatial_indexes,
-                                        topo_rules,
-                                        queue)
-                                        )
-                                    )
-                # Run processes
-                for p in processes:
-                    p.start()
-
-                # Exit the completed processes
-                for p in processes:
-                    p.join()
-
-                # Get process results from the output queue
-                fix_dicts = [output.get() for p in processes]
-
-                # Build single FixDict
-                fix_dict = { 'id':[NULL] , 'n':[NULL], 'm':[NULL] }
-                for fix_dict_partial in fix_dicts :
-                    update_fix_dict( fix_dict_main, fix_dict_partial )
-
-
-            # split cells
-            if len(fix_dict['id']) > 0 :
-                refine_by_split(fix_dict['id'], 2, 2,
-                        topo_rules, all_layers[layer_num],
-                        )
-            nfix += len(fix_dict['id'])
-
-
-
-def check3D_features(features, layer_num, all_layers_all_features, spatial_indexes, topo_rules)  :
+    progress = get_progress_reporter(progress_bar)
+    # cell extents and areas of each layer (refined cells are re-read only)
+    all_layers_extents = [ grid_layer if isinstance(grid_layer, GridCells) else get_cell_extents(grid_layer)
+            for grid_layer in all_layers ]
+    # parallel check : pool of worker processes, and cell arrays exported to shared memory
+    pool = get_process_pool(nproc) if nproc > 1 else None
+    # cell arrays of each layer, kept across passes and rebuilt only when the layer is refined
+    all_arrays = [None]*nLayers
+    # cells to check in each layer : all cells at first, then only cells which
+    # may have changed state : new cells, and cells overlapping refined regions
+    dirty_fids = [ extents.fids.copy() for extents in all_layers_extents ]
+    def update_arrays() :
+        # rebuilds the cell arrays of refined layers
+        for l in range(nLayers) :
+            if all_arrays[l] is None :
+                if pool is None or not HAS_SHARED_MEMORY :
+                    all_arrays[l] = LayerCellArrays.from_extents(all_layers_extents[l])
+                else :
+                    all_arrays[l] = SharedLayerArrays.from_extents(all_layers_extents[l])
+
+    try :
+        while any( [ fids.size > 0 for fids in dirty_fids ] ) :
+            # even layers, then odd layers : layers of a phase are not adjacent,
+            # so that they are checked on the same cell arrays and split concurrently
+            for phase in (0, 1) :
+                phase_layers = [ l for l in range(phase, nLayers, 2) if dirty_fids[l].size > 0 ]
+                if len(phase_layers) == 0 :
+                    continue
+                update_arrays()
+
+                # check dirty cells of the layers of the phase
+                layer_fix_ids = collections.OrderedDict()
+                for layer_num in phase_layers :
+                    positions = all_arrays[layer_num].index(dirty_fids[layer_num])
+                    dirty_fids[layer_num] = np.array([], dtype=np.int64)
+                    if pool is None :
+                        fix_fids = check3D_cells( [ arrays.arrays for arrays in all_arrays ], layer_num, positions,
+                                topo_rules['pmax'], TOLERANCE )
+                        fix_dict = FixSet( [ int(fid) for fid in fix_fids ], 2, 2 )
+                    else :
+                        fix_dict = check3D_features_mp(all_arrays, layer_num, positions, topo_rules, pool, nproc, progress)
+                    if progress.is_canceled() :
+                        return
+                    if len(fix_dict) > 0 :
+                        layer_fix_ids[layer_num] = fix_dict.ids
+                if len(layer_fix_ids) == 0 :
+                    continue
+
+                # split cells
+                refine_layers_by_split(layer_fix_ids, topo_rules, all_layers, nproc, progress)
+                if progress.is_canceled() :
+                    return
+
+                # deleted and new cells of refined layers
+                regions = {}
+                for layer_num in layer_fix_ids :
+                    old_arrays = all_arrays[layer_num]
+                    new_fids = all_layers_extents[layer_num].fids
+                    deleted_pos = old_arrays.index( np.setdiff1d(old_arrays.fids, new_fids) )
+                    dirty_fids[layer_num] = np.union1d( dirty_fids[layer_num], np.setdiff1d(new_fids, old_arrays.fids) )
+                    regions[layer_num] = [ old_arrays.cells[deleted_pos, col] for col in (CELL_XMIN, CELL_XMAX, CELL_YMIN, CELL_YMAX) ]
+                    old_arrays.close()
+                    all_arrays[layer_num] = None
+                update_arrays()
+                # cells of other layers overlapping the refined regions
+                for layer_num, region in regions.items() :
+                    for l in range(nLayers) :
+                        if l != layer_num :
+                            overlapping_fids = all_arrays[l].fids[ all_arrays[l].overlapping(*region, tolerance = TOLERANCE) ]
+                            dirty_fids[l] = np.union1d(dirty_fids[l], overlapping_fids)
+
+        # vertical connections of the consistent stack
+        update_arrays()
+        return( VerticalConnectivity.from_arrays( [ arrays.arrays for arrays in all_arrays ], TOLERANCE ) )
+    finally :
+        if pool is not None :
+            pool.terminate()
+        for arrays in all_arrays :
+            if arrays is not None :
+                arrays.close()
+
+
+
+def check3D_features(features, layer_num, all_layers_all_features, spatial_indexes, topo_rules, progress_bar = None,
+        all_layers_extents = None)  :
     """
     Description
     ----------
@@ -1168,6 +3043,9 @@ def check3D_features(features, layer_num, all_layers_all_features, spatial_index
     all_layers : list of Qgis grid layers (from top to bottom)
     spatial_indexes : list of spatial indexes of all_layers
     topo_rules : dictionary describing the rules : {'model':'modflow','nmax':1, 'pmax':4}
+    progress_bar : progress bar in dialog (or ProgressReporter), optional
+    all_layers_extents : list of CellExtentCache of all_layers (optional). If provided,
+                   cell bounding boxes and areas are read from them.
     Returns
     -------
     Result is in fix_dict
@@ -1175,29 +3053,45 @@ def check3D_features(features, layer_num, all_layers_all_features, spatial_index
     --------
     >>> fix_dict = check3D_features(features, layer_num, all_layers, spatial_indexes, topo_rules)
     """
-    # initialize fix_dict, dictionary of features to fix
-    fix_dict = { 'id':[] , 'n':[], 'm':[] }
+    # initialize fix_dict, set of features to fix
+    fix_dict = FixSet()
     nLayers = len(all_layers_all_features)
+    features = list(features)
+    progress = get_progress_reporter(progress_bar, total = len(features))
+    if all_layers_extents is None :
+        all_layers_extents = [None]*nLayers
+        feat_bboxes = [None]*len(features)
+    else :
+        # bounding boxes and areas of features, from the cache
+        fids = [ feat.id() for feat in features ]
+        feat_areas = all_layers_extents[layer_num].areas(fids) if len(fids) > 0 else []
+        feat_bboxes = list( zip( *all_layers_extents[layer_num].extents(fids) ) ) if len(fids) > 0 else []
     # iterate over features
-    for feat in features :
+    for count, feat in enumerate(features) :
+        if progress.update(count) :
+            break
         # count overlapping cells in the overlying layer \
         # note that layer layer_num is not necessarily overlain by layer_num + 1 \
         # and underlain by layer_num - 1.
         # compute feature area
-        feat_area = feat.geometry().area()
+        if all_layers_extents[layer_num] is not None :
+            feat_area = feat_areas[count]
+        else :
+            feat_area = feat.geometry().area()
         # go to layer JUST BELOW layer numLayer...
         l = layer_num + 1
         # check DOWNWARD for overlapping cells
         while l < nLayers :
             # count number of features in spatial_indexes[l] overlapping feature "feat"
             overlapping_cells_areas = get_overlapping_features_areas(feat,spatial_indexes[l],
-                                            all_layers_all_features[l]
+                                            all_layers_all_features[l], all_layers_extents[l],
+                                            feat_bboxes[count]
                                         )
             p = len(overlapping_cells_areas)
             if p > 0 :
                 neighbors_tot_areas = np.sum( overlapping_cells_areas )
                 if p > topo_rules['pmax'] or neighbors_tot_areas < feat_area - TOLERANCE :
-                    fix_dict = update_fix_dict( fix_dict, { 'id':[feat.id()] , 'n':[2], 'm':[2] } )
+                    fix_dict.add( feat.id(), 2, 2 )
                 break # exit this while loop as features have been found below
             # go to layer below
             l = l + 1
@@ -1206,35 +3100,59 @@ def check3D_features(features, layer_num, all_layers_all_features, spatial_index
         # check UPWARD for overlapping cells
         while l >= 0 :
             overlapping_cells_areas = get_overlapping_features_areas(feat,spatial_indexes[l],
-                                            all_layers_all_features[l]
+                                            all_layers_all_features[l], all_layers_extents[l],
+                                            feat_bboxes[count]
                                         )
             p = len(overlapping_cells_areas)
             if p > 0 :
                 neighbors_tot_areas = np.sum( overlapping_cells_areas )
                 if p > topo_rules['pmax'] or neighbors_tot_areas < feat_area - TOLERANCE :
-                    fix_dict = update_fix_dict( fix_dict, { 'id':[feat.id()] , 'n':[2], 'm':[2] } )
+                    fix_dict.add( feat.id(), 2, 2 )
                 break # exit this while loop as features have been found above
             # go to layer above
             l = l - 1
     return(fix_dict)
 
 
-def check3D_features_mp(features, layer_num, all_layers, spatial_indexes, topo_rules, queue)  :
+def check3D_features_mp(all_shared, layer_num, positions, topo_rules, pool, nproc, progress_bar = None)  :
         """
         Description
         ----------
-        Equivalent to check3D_features with parallel computing (under development)
+        Equivalent to check3D_features with parallel computing : the cells positions of
+        layer layer_num are split into chunks, checked by the worker processes of pool
+        on the shared cell arrays of all layers (see check3D_chunk). Results are
+        merged in the order of the chunks, so that the FixSet does not depend
+        on the scheduling of workers.
 
         Parameters
         ----------
+        all_shared : list of SharedLayerArrays (or LayerCellArrays) of all layers (from top to bottom)
+        layer_num : number of layer in the layer stack
+        positions : positions of the cells to check in the arrays of layer layer_num
+        topo_rules : dictionary describing the rules : {'model':'modflow','nmax':1, 'pmax':4}
+        pool : multiprocessing.Pool (see get_process_pool)
+        nproc : number of processes
+        progress_bar : progress bar in dialog (or ProgressReporter), optional
 
         Returns
         -------
-        list of n list
+        FixSet of cells of layer layer_num to split
 
         """
-        fix_dict = check3D_features(features, layer_num, all_layers, spatial_indexes, topo_rules)
-        queue.put(fix_dict)
+        descriptors = [ shared.descriptor for shared in all_shared ]
+        positions = np.asarray(positions, dtype=np.int64)
+        # several chunks per process, for load balancing
+        n_chunks = min( 4*nproc, max(positions.size, 1) )
+        results = [ pool.apply_async(check3D_chunk, (descriptors, layer_num, chunk,
+            topo_rules['pmax'], TOLERANCE)) for chunk in np.array_split(positions, n_chunks) ]
+        progress = get_progress_reporter(progress_bar, total = len(results))
+        fix_fids = []
+        for count, result in enumerate(results) :
+            fix_fids.append( result.get() )
+            if progress.update(count) :
+                break
+        fix_fids = np.concatenate(fix_fids) if len(fix_fids) > 0 else np.array([], dtype=np.int64)
+        return( FixSet( [ int(fid) for fid in fix_fids ], 2, 2 ) )
 
 
 def chunks(seq, n) :
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qgridder_utils_extents.py
+                                 Qgridder - A QGIS plugin
+
+ This file provides a per-layer cache of cell corners, extents and areas
+ as Numpy arrays, so that geometries are decoded once per layer rather than
+ each time the size or the area of a cell is needed.
+ The cache is updated when features are added, deleted or modified.
+ Cells can also be edited in memory (GridCells), e.g. in worker threads.
+
+ Qgridder Builds 2D regular and unstructured grids and comes together with
+ pre- and post-processing capabilities for spatially distributed modeling.
+
+                              -------------------
+        begin                : 2013-04-08
+        copyright            : (C) 2013 by Pryet
+        email                : alexandre.pryet@ensegid.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from qgis.core import *
+
+import numpy as np
+import weakref
+
+# ======================================================================================
+
+# Global variables
+
+# CellExtentCache instances, by layer id
+_CELL_EXTENT_CACHES = {}
+
+# ======================================================================================
+def read_cells(features):
+    """
+    Description
+    ----------
+    Reads the corners (the 4 first vertices, clock-wise from top-left),
+    bounding boxes and areas of cell features.
+
+    Parameters
+    ----------
+    features : iterable of features (e.g. from a layer or a QgsVectorLayerFeatureSource)
+
+    Returns
+    -------
+    (fids, cx, cy, bbox, area) : arrays of feature ids, of corner coordinates (N, 4),
+    of bounding boxes (N, 4), columns xmin, xmax, ymin, ymax, and of areas
+
+    Examples
+    --------
+    >>> fids, cx, cy, bbox, area = read_cells( source.getFeatures() )
+    """
+    fids, corners, bbox, area = [], [], [], []
+    for feat in features :
+        geom = feat.geometry()
+        rect = geom.boundingBox()
+        fids.append( feat.id() )
+        corners.append( [ coord for i in range(4) for coord in (geom.vertexAt(i).x(), geom.vertexAt(i).y()) ] )
+        bbox.append( (rect.xMinimum(), rect.xMaximum(), rect.yMinimum(), rect.yMaximum()) )
+        area.append( geom.area() )
+    corners = np.array(corners, dtype=float).reshape(-1, 4, 2)
+    return( np.array(fids, dtype=np.int64), corners[:,:,0], corners[:,:,1],
+        np.array(bbox, dtype=float).reshape(-1, 4), np.array(area, dtype=float) )
+
+
+# ======================================================================================
+class CellExtents(object):
+    """
+    Description
+    -----------
+    Feature ids (sorted), corners (the 4 first vertices, clock-wise from top-left),
+    bounding boxes and areas of the cells of a grid, as Numpy arrays.
+    Base class of CellExtentCache (cells of a layer) and GridCells (cells edited in memory).
+
+    Examples
+    --------
+    >>> extents = CellExtents( *read_cells( source.getFeatures() ) )
+    >>> xmin, xmax, ymin, ymax = extents.extents(fids)
+    """
+
+    def __init__(self, fids, cx, cy, bbox, area):
+        self._set_arrays(fids, cx, cy, bbox, area)
+
+    def _set_arrays(self, fids, cx, cy, bbox, area):
+        order = np.argsort(fids)
+        self._fids = fids[order]
+        self._cx, self._cy = cx[order], cy[order]
+        self._bbox = bbox[order]
+        self._area = area[order]
+
+    def refresh(self):
+        """ updates the arrays (see CellExtentCache) """
+        return(self)
+
+    @property
+    def fids(self):
+        """ sorted array of feature ids """
+        return( self.refresh()._fids )
+
+    def index(self, fids):
+        """
+        Description
+        ----------
+        Returns the position of fids in the cache arrays.
+        Raises KeyError if a fid is not in the layer.
+        """
+        self.refresh()
+        fids = np.atleast_1d( np.asarray(fids, dtype=np.int64) )
+        pos = np.clip( np.searchsorted(self._fids, fids), 0, max(self._fids.size - 1, 0) )
+        if self._fids.size == 0 or np.any( self._fids[pos] != fids ) :
+            raise KeyError('Feature ids not found in layer : %s' % fids)
+        return(pos)
+
+    def corners(self, fids = None):
+        """ (cx, cy) arrays of shape (N, 4) of cell corners (all cells by default, ordered as self.fids) """
+        pos = slice(None) if fids is None else self.index(fids)
+        self.refresh()
+        return( self._cx[pos], self._cy[pos] )
+
+    def extents(self, fids = None):
+        """ (xmin, xmax, ymin, ymax) arrays of cell bounding boxes """
+        pos = slice(None) if fids is None else self.index(fids)
+        self.refresh()
+        return( tuple( self._bbox[pos].T ) )
+
+    def areas(self, fids = None):
+        """ array of cell areas """
+        pos = slice(None) if fids is None else self.index(fids)
+        self.refresh()
+        return( self._area[pos] )
+
+    def sizes(self, fids = None):
+        """ (dx, dy) arrays of cell dimensions along their own edges (rotated cells) """
+        cx, cy = self.corners(fids)
+        dx = np.hypot( cx[:,1] - cx[:,0], cy[:,1] - cy[:,0] )
+        dy = np.hypot( cx[:,3] - cx[:,0], cy[:,3] - cy[:,0] )
+        return(dx, dy)
+
+
+# ======================================================================================
+class CellExtentCache(CellExtents):
+    """
+    Description
+    -----------
+    Cache of the cells of a grid layer (see CellExtents).
+
+    Features added, deleted or modified through the layer (edit buffer) are
+    tracked with the layer signals, and re-read at the next access.
+    Changes made directly through the data provider are not notified by the
+    layer : invalidate() must then be called (see invalidate_cell_extents).
+
+    Examples
+    --------
+    >>> extents = get_cell_extents(grid_layer)
+    >>> xmin, xmax, ymin, ymax = extents.extents(fids)
+    >>> areas = extents.areas(fids)
+    """
+
+    def __init__(self, layer):
+        # weak reference, so that the cache does not keep layers alive
+        self.set_layer(layer)
+        self._valid = False
+        self._dirty = set()
+        # incremented each time the whole cache is invalidated
+        self.generation = 0
+        super(CellExtentCache, self).__init__( np.array([], dtype=np.int64), np.empty((0, 4)), np.empty((0, 4)),
+            np.empty((0, 4)), np.array([]) )
+        layer.featureAdded.connect(self._feature_changed)
+        layer.featureDeleted.connect(self._feature_changed)
+        layer.geometryChanged.connect(self._geometry_changed)
+        layer.dataProvider().dataChanged.connect(self.invalidate)
+
+    @property
+    def layer(self):
+        return( self._layer() )
+
+    def set_layer(self, layer):
+        """ references a new Python wrapper of the layer (signals are connected to the layer itself) """
+        self._layer = weakref.ref(layer)
+
+    def _feature_changed(self, fid):
+        self._dirty.add(fid)
+
+    def _geometry_changed(self, fid, geom):
+        self._dirty.add(fid)
+
+    def invalidate(self, fids = None):
+        """ marks fids (all features by default) to be re-read at the next access """
+        if fids is None :
+            self._valid = False
+            self._dirty = set()
+            self.generation += 1
+        else :
+            self._dirty.update( [ int(fid) for fid in fids ] )
+
+    def _read(self, request):
+        # reads corners, bounding boxes and areas of features
+        request.setSubsetOfAttributes([])
+        return( read_cells( self.layer.getFeatures(request) ) )
+
+    def refresh(self):
+        """ reads all features, or only modified features """
+        if not self._valid :
+            self._set_arrays( *self._read( QgsFeatureRequest() ) )
+            self._valid = True
+            self._dirty = set()
+        elif len(self._dirty) > 0 :
+            dirty = np.array( sorted(self._dirty), dtype=np.int64 )
+            self._dirty = set()
+            keep = ~np.isin(self._fids, dirty)
+            new = self._read( QgsFeatureRequest().setFilterFids( dirty.tolist() ) )
+            old = ( self._fids[keep], self._cx[keep], self._cy[keep], self._bbox[keep], self._area[keep] )
+            self._set_arrays( *[ np.concatenate( (old_values, new_values) ) for old_values, new_values in zip(old, new) ] )
+        return(self)
+
+    def snapshot(self):
+        """
+        Description
+        ----------
+        Returns the arrays (fids, cx, cy, bbox, area) of the cache if it is up to date,
+        without reading the layer, or None. Arrays are never modified in place by
+        the cache, so that they can be read from a worker thread.
+        """
+        if not self._valid or len(self._dirty) > 0 :
+            return(None)
+        return( self._fids, self._cx, self._cy, self._bbox, self._area )
+
+    def seed(self, arrays, generation):
+        """
+        Description
+        ----------
+        Fills an empty cache with the arrays (fids, cx, cy, bbox, area) of all cells,
+        read elsewhere (e.g. by read_cells in a worker thread) after self.generation
+        was generation. Features modified since then are still re-read at the next
+        access. Arrays are ignored if the whole cache has been invalidated since then.
+        """
+        if not self._valid and generation == self.generation :
+            self._set_arrays(*arrays)
+            self._valid = True
+
+
+# ======================================================================================
+class GridCells(CellExtents):
+    """
+    Description
+    -----------
+    Cells of a grid layer edited in memory, e.g. in a worker thread, and applied
+    to the layer afterwards (see GridLayerCopy in tasks.py).
+    Cells are replaced as replace_cells does with a layer : new cells get
+    provisional ids, greater than the ids of the original cells, so that feature
+    ids remain sorted. Each new cell keeps the id of the original cell it comes from.
+
+    Attributes
+    ----------
+    angle : rotation angle of the grid (degrees, counter-clockwise)
+
+    Examples
+    --------
+    >>> cells = GridCells( *read_cells( source.getFeatures() ), angle = 0. )
+    >>> new_ids = cells.replace(deleted_fids, cx, cy, src_fids)
+    >>> deleted_fids, cx, cy, src_fids, new_ids = cells.changes()
+    """
+
+    def __init__(self, fids, cx, cy, bbox, area, angle = 0.):
+        super(GridCells, self).__init__(fids, cx, cy, bbox, area)
+        self.angle = angle
+        self.original_fids = self._fids
+        self._next_id = int(self._fids[-1]) + 1 if self._fids.size > 0 else 0
+        # original cell of each new cell, by provisional id
+        self._src = {}
+
+    def replace(self, deleted_fids, cx, cy, src_fids):
+        """
+        Description
+        ----------
+        Deletes cells deleted_fids and adds new rectangular cells (see replace_cells).
+
+        Parameters
+        ----------
+        deleted_fids : ids of cells to delete
+        cx, cy : arrays of shape (N, 4) with the corner coordinates of new cells
+        src_fids : array of N cell ids (original or provisional) the new cells come from
+
+        Returns
+        -------
+        array of provisional ids of new cells (same order as cx, cy)
+        """
+        cx = np.asarray(cx, dtype=float).reshape(-1, 4)
+        cy = np.asarray(cy, dtype=float).reshape(-1, 4)
+        new_ids = np.arange(self._next_id, self._next_id + cx.shape[0], dtype=np.int64)
+        self._next_id += cx.shape[0]
+        for new_id, src_fid in zip( new_ids.tolist(), np.asarray(src_fids, dtype=np.int64).tolist() ) :
+            self._src[new_id] = self._src.get(src_fid, src_fid)
+        keep = ~np.isin( self._fids, np.asarray(deleted_fids, dtype=np.int64) )
+        # bounding boxes and areas of rectangles
+        bbox = np.column_stack( (cx.min(axis = 1), cx.max(axis = 1), cy.min(axis = 1), cy.max(axis = 1)) )
+        area = np.hypot( cx[:,1] - cx[:,0], cy[:,1] - cy[:,0] ) * np.hypot( cx[:,3] - cx[:,0], cy[:,3] - cy[:,0] )
+        # new ids are the largest ids, cells remain sorted
+        self._fids = np.concatenate( (self._fids[keep], new_ids) )
+        self._cx = np.concatenate( (self._cx[keep], cx) )
+        self._cy = np.concatenate( (self._cy[keep], cy) )
+        self._bbox = np.concatenate( (self._bbox[keep], bbox) )
+        self._area = np.concatenate( (self._area[keep], area) )
+        return(new_ids)
+
+    def changes(self):
+        """
+        Description
+        ----------
+        Returns the changes to apply to the layer : ids of deleted original cells,
+        corners and original source cells of new cells (see replace_cells), and
+        provisional ids of new cells.
+
+        Returns
+        -------
+        (deleted_fids, cx, cy, src_fids, new_ids)
+        """
+        deleted_fids = np.setdiff1d(self.original_fids, self._fids)
+        new = self._fids > self.original_fids[-1] if self.original_fids.size > 0 else np.ones(self._fids.size, dtype=bool)
+        new_ids = self._fids[new]
+        src_fids = np.array( [ self._src[new_id] for new_id in new_ids.tolist() ], dtype=np.int64 )
+        return( deleted_fids, self._cx[new], self._cy[new], src_fids, new_ids )
+
+
+# ======================================================================================
+def get_cell_extents(layer):
+    """
+    Description
+    ----------
+    Returns the CellExtentCache of layer, created at the first call
+    and kept until the layer is deleted.
+
+    Parameters
+    ----------
+    layer : grid layer (QgsVectorLayer)
+
+    Returns
+    -------
+    CellExtentCache
+
+    Examples
+    --------
+    >>> areas = get_cell_extents(grid_layer).areas(fids)
+    """
+    layer_id = layer.id()
+    cache = _CELL_EXTENT_CACHES.get(layer_id)
+    if cache is None :
+        # signals are connected once per layer, the cache is dropped with the layer
+        cache = CellExtentCache(layer)
+        _CELL_EXTENT_CACHES[layer_id] = cache
+        layer.willBeDeleted.connect( lambda : _CELL_EXTENT_CACHES.pop(layer_id, None) )
+    elif cache.layer is not layer :
+        # PyQGIS may return a new Python wrapper of the same layer
+        cache.set_layer(layer)
+    return(cache)
+
+
+# ======================================================================================
+def invalidate_cell_extents(layer, fids = None):
+    """
+    Description
+    ----------
+    Notifies the cache of layer (if any) that features fids (all features
+    by default) have been added, deleted or modified through the data provider.
+
+    Parameters
+    ----------
+    layer : grid layer (QgsVectorLayer)
+    fids (optional) : ids of added, deleted or modified features
+
+    Examples
+    --------
+    >>> grid_layer.dataProvider().deleteFeatures(fids)
+    >>> invalidate_cell_extents(grid_layer, fids)
+    """
+    cache = _CELL_EXTENT_CACHES.get( layer.id() )
+    if cache is not None :
+        cache.invalidate(fids)
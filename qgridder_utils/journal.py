@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qgridder_utils_journal.py
+                                 Qgridder - A QGIS plugin
+
+ This file provides the undo / redo journal of grid edits.
+ Each step records the removed cells (ids, WKB geometries and attributes)
+ and the ids of added cells, so that undo and redo only read, delete and
+ add the changed cells, instead of copying the whole grid.
+
+ Qgridder Builds 2D regular and unstructured grids and comes together with
+ pre- and post-processing capabilities for spatially distributed modeling.
+
+                              -------------------
+        begin                : 2013-04-08
+        copyright            : (C) 2013 by Pryet
+        email                : alexandre.pryet@ensegid.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import *
+
+import numpy as np
+import os
+import pickle
+import tempfile
+
+from .extents import invalidate_cell_extents
+
+# ======================================================================================
+def read_journal_features(layer, fids):
+    """
+    Description
+    ----------
+    Reads the geometries (WKB) and attributes of features fids of layer,
+    in the order of fids.
+
+    Parameters
+    ----------
+    layer : grid layer (QgsVectorLayer)
+    fids : feature ids
+
+    Returns
+    -------
+    (fids, wkb, attributes) : array of feature ids, lists of WKB bytes and attribute lists
+
+    Examples
+    --------
+    >>> fids, wkb, attributes = read_journal_features(grid_layer, [2, 5])
+    """
+    fids = [ int(fid) for fid in fids ]
+    features = {}
+    if len(fids) > 0 :
+        for feat in layer.getFeatures( QgsFeatureRequest().setFilterFids(fids) ) :
+            # NULL values (QVariant) are stored as None, so that entries can be pickled
+            features[feat.id()] = ( bytes( feat.geometry().asWkb() ),
+                    [ None if isinstance(value, QVariant) else value for value in feat.attributes() ] )
+    fids = [ fid for fid in fids if fid in features ]
+    return( np.array(fids, dtype=np.int64), [ features[fid][0] for fid in fids ],
+            [ features[fid][1] for fid in fids ] )
+
+
+# ======================================================================================
+class JournalEntry(object):
+    """
+    Description
+    -----------
+    One step of a GridJournal : cells removed from the layer (ids, WKB geometries,
+    attributes) and ids of the cells added to the layer.
+    Removed cells may be spilled to disk (spill) and read back (load).
+    """
+
+    def __init__(self, removed_fids, wkb, attributes, added_fids, generation = 0):
+        self.removed_fids = np.asarray(removed_fids, dtype=np.int64)
+        self.wkb = wkb
+        self.attributes = attributes
+        self.added_fids = np.asarray(added_fids, dtype=np.int64)
+        # index of the first fid remapping not yet applied to this entry
+        self.generation = generation
+        # path of the spill file, if removed cells are on disk
+        self.path = None
+        self.nbytes = sum( [ len(wkb_geom) for wkb_geom in wkb ] ) + \
+                8 * ( self.removed_fids.size * ( len(attributes[0]) if len(attributes) > 0 else 0 ) +
+                        self.removed_fids.size + self.added_fids.size )
+
+    @property
+    def in_memory(self):
+        return( self.path is None )
+
+    def spill(self, spill_dir = None):
+        """ writes removed cells to a temporary file and frees memory """
+        if self.path is not None :
+            return
+        fd, self.path = tempfile.mkstemp(prefix = 'qgridder_journal_', suffix = '.pkl', dir = spill_dir)
+        with os.fdopen(fd, 'wb') as spill_file :
+            pickle.dump( (self.wkb, self.attributes), spill_file, protocol = pickle.HIGHEST_PROTOCOL )
+        self.wkb, self.attributes = None, None
+
+    def load(self):
+        """ reads removed cells back from the spill file, which is deleted """
+        if self.path is None :
+            return
+        with open(self.path, 'rb') as spill_file :
+            self.wkb, self.attributes = pickle.load(spill_file)
+        self.discard()
+
+    def discard(self):
+        """ deletes the spill file, if any """
+        if self.path is not None :
+            if os.path.exists(self.path) :
+                os.remove(self.path)
+            self.path = None
+
+    def features(self, fields):
+        """ removed cells as QgsFeatures """
+        self.load()
+        features = []
+        for wkb_geom, attributes in zip(self.wkb, self.attributes) :
+            geom = QgsGeometry()
+            geom.fromWkb(wkb_geom)
+            feat = QgsFeature(fields)
+            feat.setGeometry(geom)
+            feat.setAttributes(attributes)
+            features.append(feat)
+        return(features)
+
+
+# ======================================================================================
+class GridJournal(object):
+    """
+    Description
+    -----------
+    Undo / redo journal of grid layer edits, with one undo and one redo stack per layer.
+    Each step stores the removed cells and the ids of the added cells, so that
+    memory use and undo / redo cost are proportional to the number of changed cells.
+
+    At most max_steps steps are kept per layer. When in-memory steps exceed
+    max_memory bytes, the oldest are spilled to temporary files (spill = True)
+    or dropped (spill = False).
+
+    Undo re-adds removed cells with new feature ids : these fid remappings are
+    applied to the other steps of the layer when they are undone or redone.
+    The journal assumes that the layer is only edited through the journal
+    between steps.
+
+    Examples
+    --------
+    >>> journal = GridJournal(max_steps = 20)
+    >>> removed = read_journal_features(grid_layer, deleted_fids)  # before deletion
+    >>> journal.record(grid_layer, removed, new_fids)
+    >>> journal.undo(grid_layer)
+    >>> journal.redo(grid_layer)
+    """
+
+    def __init__(self, max_steps = 5, max_memory = 256*1024**2, spill = True, spill_dir = None):
+        self.max_steps = max_steps
+        self.max_memory = max_memory
+        self.spill = spill
+        self.spill_dir = spill_dir
+        # undo and redo stacks, by layer id
+        self._undo = {}
+        self._redo = {}
+        # fid remappings (old fids, new fids), by layer id
+        self._remaps = {}
+        # ids of layers whose deletion clears their steps
+        self._watched = set()
+
+    def can_undo(self, layer):
+        return( len( self._undo.get(layer.id(), []) ) > 0 )
+
+    def can_redo(self, layer):
+        return( len( self._redo.get(layer.id(), []) ) > 0 )
+
+    def record(self, layer, removed, added_fids):
+        """
+        Description
+        ----------
+        Records an edit of layer. The redo stack of layer is cleared.
+
+        Parameters
+        ----------
+        layer : grid layer (QgsVectorLayer)
+        removed : (fids, wkb, attributes) of removed cells (see read_journal_features)
+        added_fids : ids of added cells
+        """
+        layer_id = layer.id()
+        if layer_id not in self._watched :
+            self._watched.add(layer_id)
+            layer.willBeDeleted.connect( lambda : self._clear_layer(layer_id) )
+        self._clear_stack( self._redo.pop(layer_id, []) )
+        entry = JournalEntry( *removed, added_fids = added_fids,
+                generation = len( self._remaps.get(layer_id, []) ) )
+        self._undo.setdefault(layer_id, []).append(entry)
+        self._trim(layer_id)
+
+    def undo(self, layer):
+        """ undoes the last step of layer, returns False if there is none """
+        return( self._apply(layer, self._undo, self._redo) )
+
+    def redo(self, layer):
+        """ redoes the last undone step of layer, returns False if there is none """
+        return( self._apply(layer, self._redo, self._undo) )
+
+    def clear(self, layer = None):
+        """ clears the steps of layer (all layers by default) """
+        layer_ids = list( set( self._undo ) | set( self._redo ) ) if layer is None else [ layer.id() ]
+        for layer_id in layer_ids :
+            self._clear_layer(layer_id)
+
+    def _clear_layer(self, layer_id):
+        self._clear_stack( self._undo.pop(layer_id, []) )
+        self._clear_stack( self._redo.pop(layer_id, []) )
+        self._remaps.pop(layer_id, None)
+
+    def __del__(self):
+        self.clear()
+
+    def _clear_stack(self, stack):
+        for entry in stack :
+            entry.discard()
+
+    def _resolve(self, layer_id, entry):
+        # applies pending fid remappings to entry
+        remaps = self._remaps.get(layer_id, [])
+        for old_fids, new_fids in remaps[entry.generation:] :
+            for attr in ('removed_fids', 'added_fids') :
+                fids = getattr(entry, attr)
+                pos = np.clip( np.searchsorted(old_fids, fids), 0, max(old_fids.size - 1, 0) )
+                found = old_fids[pos] == fids
+                setattr( entry, attr, np.where(found, new_fids[pos], fids) )
+        entry.generation = len(remaps)
+
+    def _apply(self, layer, from_stacks, to_stacks):
+        layer_id = layer.id()
+        stack = from_stacks.get(layer_id, [])
+        if len(stack) == 0 :
+            return(False)
+        entry = stack.pop()
+        self._resolve(layer_id, entry)
+        provider = layer.dataProvider()
+
+        # current state of cells to remove, for the inverse step
+        inverse_removed = read_journal_features(layer, entry.added_fids)
+        res = True
+        if entry.added_fids.size > 0 :
+            res = provider.deleteFeatures( entry.added_fids.tolist() )
+
+        # restore removed cells, which get new fids
+        new_fids = []
+        features = entry.features( layer.fields() )
+        if len(features) > 0 :
+            added, features = provider.addFeatures(features)
+            new_fids = [ feat.id() for feat in features ]
+            res = res and added
+        if len(new_fids) > 0 :
+            order = np.argsort(entry.removed_fids)
+            self._remaps.setdefault(layer_id, []).append( ( entry.removed_fids[order],
+                np.array(new_fids, dtype=np.int64)[order] ) )
+        entry.discard()
+
+        to_stacks.setdefault(layer_id, []).append( JournalEntry( *inverse_removed, added_fids = new_fids,
+            generation = len( self._remaps.get(layer_id, []) ) ) )
+        self._trim(layer_id)
+
+        invalidate_cell_extents( layer, entry.added_fids.tolist() + new_fids )
+        layer.triggerRepaint()
+        return(res)
+
+    def _trim(self, layer_id):
+        # bounds the number of steps of the layer
+        undo_stack = self._undo.get(layer_id, [])
+        redo_stack = self._redo.get(layer_id, [])
+        while len(undo_stack) > self.max_steps :
+            undo_stack.pop(0).discard()
+        while len(redo_stack) > self.max_steps :
+            redo_stack.pop(0).discard()
+
+        # bounds the memory of all layers, oldest undo steps first
+        entries = [ entry for stack in self._undo.values() for entry in stack if entry.in_memory ] + \
+                [ entry for stack in self._redo.values() for entry in stack if entry.in_memory ]
+        memory = sum( [ entry.nbytes for entry in entries ] )
+        for stacks in (self._undo, self._redo) :
+            for stack in stacks.values() :
+                # keep the last step of each stack in memory
+                for entry in list( stack[:-1] ) :
+                    if memory <= self.max_memory :
+                        break
+                    if not entry.in_memory :
+                        continue
+                    memory -= entry.nbytes
+                    if self.spill :
+                        entry.spill(self.spill_dir)
+                    else :
+                        stack.remove(entry)
+
+        # drop fid remappings applied to all steps of the layer
+        remaps = self._remaps.get(layer_id, [])
+        entries = undo_stack + redo_stack
+        first = min( [ entry.generation for entry in entries ] ) if len(entries) > 0 else len(remaps)
+        if first > 0 :
+            del remaps[:first]
+            for entry in entries :
+                entry.generation -= first
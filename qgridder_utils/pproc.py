@@ -185,7 +185,7 @@ def get_param_list(grid_layer, all_features,  layer = '', field_name = ''):
 
 # -----------------------------------------------------
 # return modflow-like list from selected features and field_name
-def get_param_array(grid_layer, field_name = 'ID'):
+def get_param_array(grid_layer, field_name = 'ID', sgrid = None):
     """
     Description
 
@@ -193,6 +193,7 @@ def get_param_array(grid_layer, field_name = 'ID'):
     ----------
     grid_layer :  QgsVectorLayer, the (regular) grid
     String field_name : name of the attribute to get from grid_layer
+    sgrid (optional) : StructuredGrid of grid_layer, built if not provided
 
     Returns
     -------
@@ -203,23 +204,20 @@ def get_param_array(grid_layer, field_name = 'ID'):
     >>> get_param_array(grid_layer, field_name = field_name)
     """
 
-    # Get nrow, ncol
-    nrow, ncol =  get_rgrid_nrow_ncol(grid_layer)
+    if sgrid is None :
+        sgrid = get_structured_grid(grid_layer)
 
     # Get field_name attribute index
     attr_field_idx = grid_layer.fields().indexFromName(field_name)
 
-    # init lists
-    rows = [feat['ROW'] for feat in grid_layer.getFeatures()]
-    cols = [feat['COL'] for feat in grid_layer.getFeatures()]
-    field_values = [feat[field_name] for feat in grid_layer.getFeatures()]
+    # fetch field values, geometries are not required
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes([attr_field_idx])
+    field_values = { feat.id():feat[attr_field_idx] for feat in grid_layer.getFeatures(request) }
 
-    rowColVal = np.array ([ [feat['ROW'], feat['COL'], feat[field_name] ] for feat in grid_layer.getFeatures()] )
-
-    idx = np.lexsort( [rowColVal[:,1], rowColVal[:,0]] )
-
-    val = rowColVal[idx,2]
-    val.shape = (nrow, ncol) 
+    # sort values row-wise and column-wise
+    val = np.array( [ field_values[featId] for featId in sgrid.fids.ravel() ] )
+    val.shape = (sgrid.nrow, sgrid.ncol)
 
     # Avoid issue with Qvariant None in the output array for real fields
     if grid_layer.fields().field(attr_field_idx).typeName() == 'Real':
@@ -267,7 +265,7 @@ def get_ptset_xy(v_layer, id_field_name = 'ID'):
 
 
 # -----------------------------------------------------
-def get_ptset_centroids(v_layer, grid_layer, id_field_name = 'ID',nNeighbors = 3):
+def get_ptset_centroids(v_layer, grid_layer, id_field_name = 'ID',nNeighbors = 3, progress_bar = None):
     """
     Description
     ----------
@@ -283,6 +281,7 @@ def get_ptset_centroids(v_layer, grid_layer, id_field_name = 'ID',nNeighbors = 3
     id_field_name : Column in v_layer containing points ID
                   which will be used in the output dictionary
     nNeighbors : number of neighboring grid cells to fetch
+    progress_bar (optional) : progress bar (or ProgressReporter)
 
     Returns
     -------
@@ -317,8 +316,11 @@ def get_ptset_centroids(v_layer, grid_layer, id_field_name = 'ID',nNeighbors = 3
     cProvider.addAttributes( grid_layer.dataProvider().fields().toList() )
 
     # fill layer with centroids
+    progress = get_progress_reporter(progress_bar, total = grid_layer.featureCount())
     feat_centroids = []
-    for cell in grid_layer.getFeatures():
+    for count, cell in enumerate(grid_layer.getFeatures()):
+        if progress.update(count) :
+            return(False)
         feat = QgsFeature()
         geom = cell.geometry().centroid()
         feat.setAttributes( cell.attributes() )
@@ -359,6 +361,8 @@ def get_ptset_centroids(v_layer, grid_layer, id_field_name = 'ID',nNeighbors = 3
             neighborsData.append( (row, col, dist) )
         PtsetCentroids[selectedPoint[id_field_name]] = neighborsData
 
+    progress.finish()
+
     return(PtsetCentroids)
 
 
@@ -480,7 +484,7 @@ def get_dist_pline_centroid(centroid, pline, pline_feat_dic, pline_point_layer_i
     return(norm_dist_centroid_origin)
 
 
-def get_pline_centroids(pline_layer, grid_layer, id_field_name = 'ID', get_ndist = False) :
+def get_pline_centroids(pline_layer, grid_layer, id_field_name = 'ID', get_ndist = False, progress_bar = None) :
     """
     Description
     -----------
@@ -499,6 +503,8 @@ def get_pline_centroids(pline_layer, grid_layer, id_field_name = 'ID', get_ndist
     grid_layer : grid layer (vector)
     id_field_name : field name in polyline layer with unique feature id
     get_ndist : whether to add or not the normalized distance
+    progress_bar (optional) : progress bar (or ProgressReporter). If canceled,
+                  polylines processed so far are returned.
 
     Returns
     -------
@@ -521,9 +527,11 @@ def get_pline_centroids(pline_layer, grid_layer, id_field_name = 'ID', get_ndist
     if len(selected_feat_ids) == 0:
         print("Empty selection, all features considered")
         plines = pline_layer.getFeatures()
+        nplines = pline_layer.featureCount()
     else :
         print("Only selected features will be considered")
         plines = pline_layer.selectedFeatures()
+        nplines = len(selected_feat_ids)
 
 
     print('QGRIDDER _UTILS.... Get spatial index')
@@ -535,7 +543,10 @@ def get_pline_centroids(pline_layer, grid_layer, id_field_name = 'ID', get_ndist
     grid_feat_dic = { feat.id():feat for feat in grid_layer.getFeatures()}
 
     # Iterate over plines in pline_layer
-    for pline in plines:
+    progress = get_progress_reporter(progress_bar, total = nplines)
+    for count, pline in enumerate(plines):
+        if progress.update(count) :
+            break
 
         # list of grid cells intersected by pline
         intersected_cells_list = []
@@ -566,11 +577,13 @@ def get_pline_centroids(pline_layer, grid_layer, id_field_name = 'ID', get_ndist
         # add pline entry into output dictionary
         pline_cells_dic[ pline[id_field_name] ] =  intersected_cells_list
 
+    progress.finish()
+
     return(pline_cells_dic)
 
 
 # -----------------------------------------------------
-def get_polygon_centroids(polygon_layer, grid_layer, pline_layer = None, id_field_name = 'ID') :
+def get_polygon_centroids(polygon_layer, grid_layer, pline_layer = None, id_field_name = 'ID', progress_bar = None) :
     """
     Description
     -----------
@@ -590,6 +603,8 @@ def get_polygon_centroids(polygon_layer, grid_layer, pline_layer = None, id_fiel
     grid_layer : grid layer (vector)
     pline_layer (optional) : polyline layer (vector)
     id_field_name (optional) : field name in polyline layer with unique feature id
+    progress_bar (optional) : progress bar (or ProgressReporter). If canceled,
+                  polygons processed so far are returned.
 
     Returns
     -------
@@ -613,9 +628,11 @@ def get_polygon_centroids(polygon_layer, grid_layer, pline_layer = None, id_fiel
     if len(selected_feat_ids) == 0:
         print("Empty selection, all features considered")
         polygons = polygon_layer.getFeatures()
+        npolygons = polygon_layer.featureCount()
     else :
         print("Only selected features will be considered")
         polygons = polygon_layer.selectedFeatures()
+        npolygons = len(selected_feat_ids)
 
     # create and fill spatial Index
     grid_layer_index = get_spatial_indexes([grid_layer])[0]
@@ -628,7 +645,10 @@ def get_polygon_centroids(polygon_layer, grid_layer, pline_layer = None, id_fiel
         pline_dic = { feat[id_field_name]:feat for feat in pline_layer.getFeatures() }
 
     # Iterate over polygons in polygon_layer
-    for polygon in polygons :
+    progress = get_progress_reporter(progress_bar, total = npolygons)
+    for count, polygon in enumerate(polygons) :
+        if progress.update(count) :
+            break
 
         # list of grid cells intersected by polygon
         intersected_cells_list = []
@@ -658,6 +678,8 @@ def get_polygon_centroids(polygon_layer, grid_layer, pline_layer = None, id_fiel
         # add polygon entry into output dictionary
         polygon_cells_dic[ polygon[id_field_name] ] =  intersected_cells_list
 
+    progress.finish()
+
     return(polygon_cells_dic)
 
 
@@ -705,28 +727,30 @@ def get_feat_param(v_layer, id_field_name = 'ID', field_name = 'PARAM',):
 
 # -----------------------------------------------------
 # From 2D array, fills shape file attribute table
-def data_to_grid(data, grid_layer, field_name = 'PARAM', fieldType = QVariant.Double ):
+def data_to_grid(data, grid_layer, field_name = 'PARAM', fieldType = QVariant.Double, sgrid = None ):
     """
     Description
+    ----------
+    Writes a 2D array (nrow, ncol) to the attribute table of a structured grid layer
 
     Parameters
     ----------
-    p1 : parameter 1
+    data : 2D array of values, from top left to bottom right
+    grid_layer : the structured grid layer
+    field_name : name of the attribute to write
+    fieldType : type of the attribute, if it has to be created
+    sgrid (optional) : StructuredGrid of grid_layer, built if not provided
 
     Returns
     -------
 
-    out1 : output1
+    True if values have been successfully written
 
     Examples
     --------
-    >>>
+    >>> data_to_grid(hk, grid_layer, field_name = 'HK')
     """
     # Note : to date, only fieldType Double is applicable
-    # TODO check that data has same number of elements of grid_layer
-    # Select all features along with their attributes
-    #allAttrs = grid_layer.pendingAllAttributesList()
-    #grid_layer.select(allAttrs)
     # load dic of current layer attributes
     field_name_map = grid_layer.dataProvider().fieldNameMap()
 
@@ -735,28 +759,21 @@ def data_to_grid(data, grid_layer, field_name = 'PARAM', fieldType = QVariant.Do
         grid_layer.dataProvider().addAttributes(  [QgsField( field_name, fieldType)] )
         grid_layer.updateFields()
 
+    if sgrid is None :
+        sgrid = get_structured_grid(grid_layer)
+
     # reshape array to a 1D vector
     # elements are sorted from top left to bottom right
     data = np.reshape(data, -1)
 
-    # Init variables
-    all_features = {feat.id():feat for feat in grid_layer.getFeatures()}
-    all_centroids = [feat.geometry().centroid().asPoint() \
-                        for feat in all_features.values()]
-    centroids_ids = list(all_features.keys())
-    centroids_x = np.around(np.array([centroid.x() for centroid in all_centroids]), MAX_DECIMALS)
-    centroids_y = np.around(np.array([centroid.y() for centroid in all_centroids]), MAX_DECIMALS)
-    centroids = np.array( [centroids_ids , centroids_x, centroids_y] )
-    centroids = centroids.T
-
-    # sort by decreasing y and increasing x (from top left to bottom right)
-    # for regular grids, this corresponds to row-wise and column wise
-    idx = np.lexsort( [centroids_x,-1*centroids_y] )
-    centroids = centroids[idx,:]
+    if data.size != sgrid.fids.size :
+        print("Data size does not match the number of grid cells")
+        return(False)
 
     # populate change attribute map
+    # fids are sorted row-wise and column wise, as data
     field_idx = grid_layer.fields().indexFromName(field_name)
-    attr_map = { centroids[i,0] : { field_idx : float(data[i]) } for i in range( centroids.shape[0] ) }
+    attr_map = { int(featId) : { field_idx : float(value) } for featId, value in zip(sgrid.fids.ravel(), data) }
 
     # write attributes
     grid_layer.startEditing()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qgridder_utils_progress.py
+                                 Qgridder - A QGIS plugin
+
+ This file provides a throttled progress reporter for long loops.
+
+ Qgridder Builds 2D regular and unstructured grids and comes together with
+ pre- and post-processing capabilities for spatially distributed modeling.
+
+                              -------------------
+        begin                : 2013-04-08
+        copyright            : (C) 2013 by Pryet
+        email                : alexandre.pryet@ensegid.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication, QThread
+
+import time
+
+# ======================================================================================
+
+# Global constants
+
+PROGRESS_INTERVAL = 0.2  # minimum time (s) between two updates of the progress display
+
+# ======================================================================================
+class ProgressReporter(object):
+    """
+    Description
+    -----------
+    Reports the progress of a loop to a progress bar (QProgressBar),
+    a progress dialog (QProgressDialog) or a QgsFeedback object.
+    The display is updated (and events are processed) at most every
+    PROGRESS_INTERVAL seconds, whatever the number of iterations.
+
+    update() returns True when the operation has been canceled
+    (QProgressDialog "Cancel" button, QgsFeedback.cancel() or cancel()),
+    the loop is then expected to stop.
+
+    Examples
+    --------
+    >>> progress = ProgressReporter(progress_bar, total = len(feat_ids))
+    >>> for count, featId in enumerate(feat_ids) :
+    >>>     if progress.update(count) :
+    >>>         break
+    >>> progress.finish()
+    """
+
+    def __init__(self, progress_bar = None, total = 100, label = None, interval = PROGRESS_INTERVAL):
+        self.progress_bar = progress_bar
+        self.label = label
+        self.interval = interval
+        self._canceled = False
+        self.start(total)
+
+    def start(self, total, text = None):
+        """ (re)initializes the reporter for a loop of total iterations """
+        self.total = max(total, 1)
+        self._last_time = time.time()
+        self._set_value(0)
+        if text is not None :
+            self.set_text(text)
+        return(self)
+
+    def update(self, count):
+        """ reports count iterations done, returns True if canceled """
+        now = time.time()
+        if now - self._last_time >= self.interval :
+            self._last_time = now
+            self._set_value( int( 100. * count / self.total ) )
+            self._process_events()
+        return( self.is_canceled() )
+
+    def set_text(self, text):
+        """ updates the label (e.g. iteration number) """
+        if self.label is not None :
+            self.label.setText(text)
+        elif hasattr(self.progress_bar, 'setLabelText') :
+            self.progress_bar.setLabelText(text)
+
+    def finish(self):
+        """ sets the progress display to 100% """
+        self._set_value(100)
+        self._process_events()
+
+    def cancel(self):
+        self._canceled = True
+
+    def is_canceled(self):
+        if self._canceled :
+            return(True)
+        if hasattr(self.progress_bar, 'wasCanceled') :
+            self._canceled = self.progress_bar.wasCanceled()
+        elif hasattr(self.progress_bar, 'isCanceled') :
+            self._canceled = self.progress_bar.isCanceled()
+        return(self._canceled)
+
+    def _set_value(self, value):
+        if self.progress_bar is None :
+            return
+        if hasattr(self.progress_bar, 'setProgress') :
+            # QgsFeedback, percentage
+            self.progress_bar.setProgress(value)
+        else :
+            # QProgressBar or QProgressDialog, set to range 0-100
+            if self.progress_bar.maximum() != 100 :
+                self.progress_bar.setRange(0, 100)
+            self.progress_bar.setValue(value)
+
+    def _process_events(self):
+        # keep the GUI responsive, only from the main thread
+        app = QCoreApplication.instance()
+        if app is not None and QThread.currentThread() == app.thread() :
+            QCoreApplication.processEvents()
+
+# ======================================================================================
+def get_progress_reporter(progress_bar = None, total = 100, label = None):
+    """
+    Description
+    ----------
+    Returns a ProgressReporter for progress_bar. If progress_bar is already
+    a ProgressReporter (e.g. passed down by a calling function), it is
+    re-initialized and returned, so that cancellation is shared.
+
+    Parameters
+    ----------
+    progress_bar : QProgressBar, QProgressDialog, QgsFeedback, ProgressReporter or None
+    total : number of iterations of the loop
+    label : label to display iteration information (optional)
+
+    Returns
+    -------
+    ProgressReporter
+
+    Examples
+    --------
+    >>> progress = get_progress_reporter(progress_bar, total = n)
+    """
+    if isinstance(progress_bar, ProgressReporter) :
+        if label is not None :
+            progress_bar.label = label
+        return( progress_bar.start(total) )
+    return( ProgressReporter(progress_bar, total, label) )
+
@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qgridder_utils_qtree.py
+                                 Qgridder - A QGIS plugin
+
+ This file provides an array-based quadtree for nested grids.
+ Cells are stored as arrays of level, row and column indexes, and
+ neighbors are found with Morton keys, so that refinement and 2:1
+ balance propagation do not require any geometry comparison.
+ It only relies on Numpy.
+
+ Qgridder Builds 2D regular and unstructured grids and comes together with
+ pre- and post-processing capabilities for spatially distributed modeling.
+
+                              -------------------
+        begin                : 2013-04-08
+        copyright            : (C) 2013 by Pryet
+        email                : alexandre.pryet@ensegid.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import numpy as np
+
+from .rgrid import rotate, estimate_angle
+
+# ======================================================================================
+
+# Global constants
+
+# Row and column indexes at the finest level are interleaved into 64 bits keys
+MORTON_BITS = 31
+
+# ======================================================================================
+def _spread_bits(v):
+    # inserts a 0 bit between each bit of v (32 bits -> 64 bits)
+    v = np.asarray(v, dtype=np.uint64) & np.uint64(0xFFFFFFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return(v)
+
+
+# ======================================================================================
+def morton_key(row, col):
+    """
+    Description
+    ----------
+    Computes the Morton (Z-order) keys of cells from their row and column indexes,
+    by interleaving their bits. A quadtree cell of level L covers a contiguous range
+    of 4**(max_level - L) keys at the finest level max_level.
+
+    Parameters
+    ----------
+    row, col : arrays of positive row and column indexes (< 2**32)
+
+    Returns
+    -------
+    array of keys (uint64)
+
+    Examples
+    --------
+    >>> keys = morton_key(row << (max_level - level), col << (max_level - level))
+    """
+    return( (_spread_bits(row) << np.uint64(1)) | _spread_bits(col) )
+
+
+# ======================================================================================
+class QuadTreeGrid(object):
+    """
+    Description
+    -----------
+    Array-backed nested grid (quadtree) built over a regular grid of nrow*ncol
+    base cells of size dx*dy. A cell of level L has size dx/2**L, dy/2**L, and
+    is located by its row (from top) and column (from left) indexes at level L.
+    As for StructuredGrid, rotated grids are described in the grid frame,
+    rotated by angle around the top-left corner (xoff, yoff).
+
+    Cells coming from the original layer keep their feature id in fids,
+    new cells have fid -1. src gives for each cell the feature id of the original
+    cell it comes from, so that attributes can be inherited.
+
+    Attributes
+    ----------
+    xoff, yoff : coordinates of the top-left corner of the grid
+    dx, dy : size of base cells (level 0)
+    nrow, ncol : number of base cells along rows and columns
+    angle : rotation angle of the grid around (xoff, yoff), in degrees (counter-clockwise)
+    level, row, col : arrays of cell levels and indexes
+    fids, src : arrays of feature ids of cells and of their original cells
+
+    Examples
+    --------
+    >>> qtree = QuadTreeGrid.from_corners(fids, cx, cy)
+    >>> new_cells = qtree.split( qtree.cells_of(fids), 1 )
+    >>> coarse_cells = qtree.unbalanced(new_cells, 1)
+    >>> parents = qtree.merge( qtree.siblings( qtree.cells_of(fids) ) )
+    """
+
+    def __init__(self, xoff, yoff, dx, dy, nrow, ncol, level, row, col, fids = None, angle = 0.):
+        self.xoff = float(xoff)
+        self.yoff = float(yoff)
+        self.dx = float(dx)
+        self.dy = float(dy)
+        self.nrow = int(nrow)
+        self.ncol = int(ncol)
+        self.angle = float(angle)
+        self.level = np.asarray(level, dtype=np.int64)
+        self.row = np.asarray(row, dtype=np.int64)
+        self.col = np.asarray(col, dtype=np.int64)
+        if fids is None :
+            fids = np.full(self.level.size, -1, dtype=np.int64)
+        self.fids = np.asarray(fids, dtype=np.int64)
+        self.src = self.fids.copy()
+        self._keys = None
+
+    def __len__(self):
+        return(self.level.size)
+
+    @property
+    def max_level(self):
+        """ finest level of the tree """
+        return( int(self.level.max()) if len(self) > 0 else 0 )
+
+    def cell_size(self, level):
+        """ cell size (dx, dy) at level """
+        scale = 2.**np.asarray(level)
+        return( self.dx / scale, self.dy / scale )
+
+    @classmethod
+    def from_corners(cls, fids, cx, cy, decimals = 6, angle = None):
+        """
+        Description
+        ----------
+        Builds the quadtree, possibly rotated, from the corners of its cells.
+        The coarsest cells are considered as base cells. Raises ValueError if
+        cells do not form a nested grid : cell sizes must be the base size divided
+        by a power of 2, cells must be aligned on their level and tile the grid extent.
+
+        Parameters
+        ----------
+        fids : array of feature ids
+        cx, cy : arrays of shape (N, 4) with the corner coordinates of the cells,
+                 numbered clock-wise from top-left
+        decimals : number of decimals considered to compare coordinates
+        angle (optional) : rotation angle of the grid, estimated from the cells
+                 if not provided (see estimate_angle)
+
+        Returns
+        -------
+        QuadTreeGrid instance
+
+        Examples
+        --------
+        >>> qtree = QuadTreeGrid.from_corners(fids, cx, cy)
+        """
+        fids = np.asarray(fids, dtype=np.int64)
+        cx = np.asarray(cx, dtype=float).reshape(-1, 4)
+        cy = np.asarray(cy, dtype=float).reshape(-1, 4)
+        if cx.shape[0] == 0 :
+            raise ValueError('Empty grid')
+        if angle is None :
+            angle = estimate_angle(cx, cy)
+
+        # cell extents in the grid frame, rotated around the first corner
+        origin = (cx[0,0], cy[0,0])
+        lx, ly = rotate(cx, cy, -angle, origin)
+        xmin, xmax = np.around(lx.min(axis=1), decimals), np.around(lx.max(axis=1), decimals)
+        ymin, ymax = np.around(ly.min(axis=1), decimals), np.around(ly.max(axis=1), decimals)
+        width, height = xmax - xmin, ymax - ymin
+        if np.any(width <= 0) or np.any(height <= 0) :
+            raise ValueError('Degenerated cells')
+
+        # levels from cell sizes
+        # (tolerances are relative to cell sizes, to absorb rounding errors)
+        tol = 1e-3
+        dx, dy = width.max(), height.max()
+        level = np.around( np.log2(dx / width) ).astype(np.int64)
+        if np.any( np.around( np.log2(dy / height) ).astype(np.int64) != level ) or \
+                np.any( np.abs(width * 2.**level / dx - 1.) > tol ) or \
+                np.any( np.abs(height * 2.**level / dy - 1.) > tol ) :
+            raise ValueError('Cell sizes do not match a nested grid')
+
+        # cell indexes at their level, from the top-left corner of the grid
+        x0, y0 = xmin.min(), ymax.max()
+        col = (xmin - x0) * 2.**level / dx
+        row = (y0 - ymax) * 2.**level / dy
+        ncol = (xmax.max() - x0) / dx
+        nrow = (y0 - ymin.min()) / dy
+        if np.any( np.abs(col - np.around(col)) > tol ) or np.any( np.abs(row - np.around(row)) > tol ) or \
+                abs(ncol - round(ncol)) > tol or abs(nrow - round(nrow)) > tol :
+            raise ValueError('Cells are not aligned on a nested grid')
+        col, row = np.around(col).astype(np.int64), np.around(row).astype(np.int64)
+
+        # top-left corner in map coordinates
+        xoff, yoff = rotate(x0, y0, angle, origin)
+        qtree = cls(float(xoff), float(yoff), dx, dy, int(round(nrow)), int(round(ncol)),
+                level, row, col, fids, angle)
+
+        # cells must not overlap, and must cover the grid extent
+        keys, span = qtree.keys()
+        order = np.argsort(keys)
+        if np.any( keys[order][:-1] + span[order][:-1] > keys[order][1:] ) or \
+                not np.isclose( (0.25**level).sum(), qtree.nrow * qtree.ncol ) :
+            raise ValueError('Cells do not tile a nested grid')
+
+        return(qtree)
+
+    def keys(self, max_level = None):
+        """
+        Description
+        ----------
+        Returns the Morton keys of cells at level max_level (finest level by default),
+        and the number of keys covered by each cell
+        """
+        if max_level is None :
+            max_level = self.max_level
+        shift = max_level - self.level
+        keys = morton_key( self.row << shift, self.col << shift )
+        span = np.uint64(1) << (2*shift).astype(np.uint64)
+        return(keys, span)
+
+    def _sorted_keys(self):
+        # sorted Morton keys of cells, cached until cells are modified
+        if self._keys is None :
+            max_level = self.max_level
+            keys, span = self.keys(max_level)
+            order = np.argsort(keys)
+            self._keys = (max_level, keys[order], order)
+        return(self._keys)
+
+    def find_cells(self, level, row, col):
+        """
+        Description
+        ----------
+        Returns the indexes of the cells containing the cells (level, row, col)
+        (or contained by them, for levels finer than the tree). -1 is
+        returned for cells outside the grid extent.
+
+        Parameters
+        ----------
+        level, row, col : arrays of levels and indexes
+
+        Returns
+        -------
+        array of cell indexes
+
+        Examples
+        --------
+        >>> neighbors = qtree.find_cells(qtree.level, qtree.row - 1, qtree.col)
+        """
+        level = np.atleast_1d( np.asarray(level, dtype=np.int64) )
+        row = np.atleast_1d( np.asarray(row, dtype=np.int64) )
+        col = np.atleast_1d( np.asarray(col, dtype=np.int64) )
+        max_level, sorted_keys, order = self._sorted_keys()
+        inside = (row >= 0) & (col >= 0) & (row < self.nrow << level) & (col < self.ncol << level)
+        # top-left fine cell of each cell, the containing cell has the largest key lower or equal
+        shift = np.maximum(max_level - level, 0)
+        fine_row = np.where( inside, row << shift, 0 ) >> np.maximum(level - max_level, 0)
+        fine_col = np.where( inside, col << shift, 0 ) >> np.maximum(level - max_level, 0)
+        pos = np.searchsorted( sorted_keys, morton_key(fine_row, fine_col), 'right' ) - 1
+        return( np.where( inside & (pos >= 0), order[np.maximum(pos, 0)], -1 ) )
+
+    def cells_of(self, fids):
+        """
+        Description
+        ----------
+        Returns the indexes of the cells of feature ids fids.
+        Raises KeyError if a fid is not in the grid.
+        """
+        fids = np.atleast_1d( np.asarray(fids, dtype=np.int64) )
+        order = np.argsort(self.fids)
+        pos = np.clip( np.searchsorted(self.fids[order], fids), 0, max(len(self) - 1, 0) )
+        if len(self) == 0 or np.any( self.fids[order][pos] != fids ) :
+            raise KeyError('Feature ids not found in grid : %s' % fids)
+        return( order[pos] )
+
+    def split(self, cells, levels = 1):
+        """
+        Description
+        ----------
+        Splits cells into 4**levels cells (2**levels along rows and columns).
+        Cell indexes are modified : split cells are removed and new cells are
+        appended at the end of the arrays.
+
+        Parameters
+        ----------
+        cells : indexes of the cells to split
+        levels : number of refinement levels
+
+        Returns
+        -------
+        array of indexes of new cells
+
+        Examples
+        --------
+        >>> new_cells = qtree.split( qtree.cells_of(fids), 1 )
+        """
+        cells = np.unique( np.asarray(cells, dtype=np.int64) )
+        if cells.size == 0 or levels < 1 :
+            return( np.array([], dtype=np.int64) )
+        k = 2**levels
+        new_level = self.level[cells] + levels
+        if ( max(self.nrow, self.ncol) << int(new_level.max()) ) >= 2**MORTON_BITS :
+            raise ValueError('Maximum refinement level reached')
+
+        # k*k children per cell, row-wise
+        di, dj = np.divmod( np.arange(k*k), k )
+        new_row = ( self.row[cells][:, None]*k + di[None, :] ).ravel()
+        new_col = ( self.col[cells][:, None]*k + dj[None, :] ).ravel()
+        new_src = np.repeat( self.src[cells], k*k )
+
+        keep = np.ones(len(self), dtype=bool)
+        keep[cells] = False
+        n_kept = int(keep.sum())
+        self.level = np.concatenate( (self.level[keep], np.repeat(new_level, k*k)) )
+        self.row = np.concatenate( (self.row[keep], new_row) )
+        self.col = np.concatenate( (self.col[keep], new_col) )
+        self.fids = np.concatenate( (self.fids[keep], np.full(new_row.size, -1, dtype=np.int64)) )
+        self.src = np.concatenate( (self.src[keep], new_src) )
+        self._keys = None
+
+        return( np.arange(n_kept, len(self)) )
+
+    def siblings(self, cells):
+        """
+        Description
+        ----------
+        Returns the groups of 4 sibling cells (cells of the same level sharing
+        the same parent) whose cells all belong to cells
+
+        Parameters
+        ----------
+        cells : indexes of cells
+
+        Returns
+        -------
+        array of shape (K, 4) of cell indexes, children of each parent
+        being ordered row-wise, from top-left
+
+        Examples
+        --------
+        >>> groups = qtree.siblings( qtree.cells_of(fids) )
+        """
+        cells = np.unique( np.asarray(cells, dtype=np.int64) )
+        cells = cells[ self.level[cells] > 0 ]
+        if cells.size == 0 :
+            return( np.empty((0, 4), dtype=np.int64) )
+
+        # parents of cells, as (level, row, col) of their top-left child
+        parents = np.unique( np.column_stack( (self.level[cells], self.row[cells] >> 1,
+            self.col[cells] >> 1) ), axis=0 )
+        level, prow, pcol = parents.T
+        di, dj = np.divmod( np.arange(4), 2 )
+        child_level = np.repeat(level, 4)
+        child_row = ( (prow << 1)[:, None] + di[None, :] ).ravel()
+        child_col = ( (pcol << 1)[:, None] + dj[None, :] ).ravel()
+        groups = self.find_cells(child_level, child_row, child_col)
+
+        # children must be leaves of the same level, and belong to cells
+        valid = (groups >= 0) & np.isin(groups, cells)
+        valid &= self.level[np.maximum(groups, 0)] == child_level
+        groups = groups.reshape(-1, 4)
+        return( groups[ valid.reshape(-1, 4).all(axis=1) ] )
+
+    def merge(self, groups):
+        """
+        Description
+        ----------
+        Merges groups of 4 sibling cells (see siblings) into their parent cell.
+        Cell indexes are modified : merged cells are removed and parent cells are
+        appended at the end of the arrays. Parent cells come from the original
+        cell of their top-left child (src).
+
+        Parameters
+        ----------
+        groups : array of shape (K, 4) of sibling cell indexes
+
+        Returns
+        -------
+        array of indexes of parent cells
+
+        Examples
+        --------
+        >>> parents = qtree.merge( qtree.siblings( qtree.cells_of(fids) ) )
+        """
+        groups = np.asarray(groups, dtype=np.int64).reshape(-1, 4)
+        if groups.shape[0] == 0 :
+            return( np.array([], dtype=np.int64) )
+        first = groups[:, 0]
+
+        keep = np.ones(len(self), dtype=bool)
+        keep[groups.ravel()] = False
+        n_kept = int(keep.sum())
+        self.level = np.concatenate( (self.level[keep], self.level[first] - 1) )
+        self.row = np.concatenate( (self.row[keep], self.row[first] >> 1) )
+        self.col = np.concatenate( (self.col[keep], self.col[first] >> 1) )
+        self.fids = np.concatenate( (self.fids[keep], np.full(first.size, -1, dtype=np.int64)) )
+        self.src = np.concatenate( (self.src[keep], self.src[first]) )
+        self._keys = None
+
+        return( np.arange(n_kept, len(self)) )
+
+    def copy(self):
+        """ returns a copy of the tree """
+        qtree = QuadTreeGrid(self.xoff, self.yoff, self.dx, self.dy, self.nrow, self.ncol,
+                self.level.copy(), self.row.copy(), self.col.copy(), self.fids.copy(), self.angle)
+        qtree.src = self.src.copy()
+        return(qtree)
+
+    def unbalanced(self, cells, max_diff = 1):
+        """
+        Description
+        ----------
+        Returns the indexes of the cells to split so that cells satisfy the balance
+        rule with their edge neighbors (e.g. max_diff = 1 for a 2:1 ratio) :
+        neighbors more than max_diff levels coarser than cells, and cells
+        more than max_diff levels coarser than one of their neighbors.
+        Diagonal neighbors are not considered.
+
+        Parameters
+        ----------
+        cells : indexes of cells to check
+        max_diff : maximum level difference between neighbors
+
+        Returns
+        -------
+        array of cell indexes, to be split
+
+        Examples
+        --------
+        >>> coarse_cells = qtree.unbalanced(new_cells, 1)
+        """
+        owners, neighbors, diff = self._edge_neighbors(cells, max_diff)
+        return( np.union1d( neighbors[diff > max_diff], owners[diff < -max_diff] ) )
+
+    def too_coarse(self, cells, max_diff = 1):
+        """
+        Description
+        ----------
+        Returns the indexes of cells more than max_diff levels coarser than
+        one of their edge neighbors (see unbalanced)
+
+        Examples
+        --------
+        >>> coarse_cells = qtree.too_coarse(merged_cells, 1)
+        """
+        owners, neighbors, diff = self._edge_neighbors(cells, max_diff)
+        return( np.unique( owners[diff < -max_diff] ) )
+
+    def _edge_neighbors(self, cells, max_diff):
+        # pairs (cell, edge neighbor) and level differences, neighbors being
+        # sampled at level + max_diff + 1 (see unbalanced)
+        cells = np.asarray(cells, dtype=np.int64)
+        if cells.size == 0 :
+            empty = np.array([], dtype=np.int64)
+            return(empty, empty, empty)
+
+        # positions along the 4 edges (top, right, bottom, left), outside the cells,
+        # at level + max_diff + 1, so that any neighbor finer than allowed is found
+        k = 2**(max_diff + 1)
+        t = np.arange(k)
+        level = np.repeat( self.level[cells], 4*k ) + max_diff + 1
+        row = self.row[cells][:, None]*k
+        col = self.col[cells][:, None]*k
+        edge_row = np.concatenate( (row - 1 + 0*t, row + t, row + k + 0*t, row + t), axis=1 ).ravel()
+        edge_col = np.concatenate( (col + t, col + k + 0*t, col + t, col - 1 + 0*t), axis=1 ).ravel()
+        neighbors = self.find_cells(level, edge_row, edge_col)
+        owners = np.repeat(cells, 4*k)
+        valid = neighbors >= 0
+        neighbors, owners = neighbors[valid], owners[valid]
+
+        return( owners, neighbors, self.level[owners] - self.level[neighbors] )
+
+    def corners(self, cells = None):
+        """
+        Description
+        ----------
+        Returns the corners (map coordinates) of cells (all cells by default)
+        as two arrays of shape (N, 4), numbered clock-wise from top-left
+        """
+        if cells is None :
+            cells = np.arange(len(self))
+        dx, dy = self.cell_size(self.level[cells])
+        x_left = self.xoff + self.col[cells]*dx
+        y_top = self.yoff - self.row[cells]*dy
+        cx = np.column_stack([ x_left, x_left + dx, x_left + dx, x_left ])
+        cy = np.column_stack([ y_top, y_top, y_top - dy, y_top - dy ])
+        return( rotate(cx, cy, self.angle, (self.xoff, self.yoff)) )
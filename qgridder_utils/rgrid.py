@@ -0,0 +1,781 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qgridder_utils_rgrid.py
+                                 Qgridder - A QGIS plugin
+
+ This file gathers array-based functions for structured (regular) grids.
+ They only rely on Numpy, so that they can be used without Qgis
+ (e.g. in worker processes).
+
+ Qgridder Builds 2D regular and unstructured grids and comes together with
+ pre- and post-processing capabilities for spatially distributed modeling.
+
+                              -------------------
+        begin                : 2013-04-08
+        copyright            : (C) 2013 by Pryet
+        email                : alexandre.pryet@ensegid.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import numpy as np
+
+# ======================================================================================
+
+# Global constants
+
+# WKB record of a single-ring polygon with 5 points (little endian)
+WKB_POLYGON = 3
+WKB_RECT_DTYPE = np.dtype([ ('byteorder', 'u1'), ('wkbtype', '<u4'), ('nrings', '<u4'),
+    ('npoints', '<u4'), ('coords', '<f8', (10,)) ])
+
+# ======================================================================================
+def rotate(x, y, angle = 0., origin = (0., 0.)):
+    """
+    Description
+    ----------
+    Rotates points (x, y) by angle degrees, counter-clockwise, around origin.
+    Use -angle for the inverse transform (world to grid frame).
+
+    Parameters
+    ----------
+    x, y : arrays of coordinates
+    angle : rotation angle, in degrees (counter-clockwise)
+    origin : (x, y) coordinates of the center of rotation
+
+    Returns
+    -------
+    (x, y) arrays of rotated coordinates
+
+    Examples
+    --------
+    >>> x, y = rotate(x_grid, y_grid, 30., (xoff, yoff))
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if angle == 0 :
+        return(x, y)
+    theta = np.radians(angle)
+    cos, sin = np.cos(theta), np.sin(theta)
+    dx, dy = x - origin[0], y - origin[1]
+    return( origin[0] + cos*dx - sin*dy, origin[1] + sin*dx + cos*dy )
+
+
+# ======================================================================================
+def estimate_angle(cx, cy, decimals = 9):
+    """
+    Description
+    ----------
+    Estimates the rotation angle of a structured grid from the corners of its cells,
+    as the mean orientation of the top edge of cells (corner 0 to corner 1),
+    modulo 90 degrees. The angle is in ]-45, 45] degrees, and is exactly 0 for
+    axis-aligned grids. Rows and columns of grids rotated by more than 45 degrees
+    are swapped or reversed : their angle has to be provided (see set_grid_angle).
+
+    Parameters
+    ----------
+    cx, cy : arrays of shape (N, 4) with the corner coordinates of the cells,
+             numbered clock-wise from top-left
+    decimals : number of decimals of the angle, in degrees
+
+    Returns
+    -------
+    angle in degrees (counter-clockwise)
+
+    Examples
+    --------
+    >>> angle = estimate_angle(cx, cy)
+    """
+    cx = np.asarray(cx, dtype=float)
+    cy = np.asarray(cy, dtype=float)
+    theta = np.arctan2( cy[:,1] - cy[:,0], cx[:,1] - cx[:,0] )
+    # circular mean of 4*theta : orientation modulo 90 degrees
+    angle = np.degrees( np.arctan2( np.sin(4*theta).mean(), np.cos(4*theta).mean() ) / 4. )
+    angle = np.around(angle, decimals) + 0.
+    if angle == -45. :
+        angle = 45.
+    return( float(angle) )
+
+
+# ======================================================================================
+def rgrid_corners(x, y, angle = 0., origin = (0., 0.)):
+    """
+    Description
+    ----------
+    Computes the corner coordinates of all the cells of a regular grid
+    defined by the coordinates of its column (x) and row (y) edges.
+    Cells are ordered as in make_rgrid : from bottom to top, and from left to right.
+    Corners are numbered clock-wise (top-left, top-right, bottom-right, bottom-left)
+    For rotated grids, x and y are given in the grid frame, and all corners
+    are rotated at once by angle around origin.
+
+    Parameters
+    ----------
+    x : array of increasing x coordinates of column edges (size m+1)
+    y : array of increasing y coordinates of row edges (size n+1)
+    angle : rotation angle of the grid, in degrees (counter-clockwise)
+    origin : (x, y) coordinates of the center of rotation
+
+    Returns
+    -------
+    (cx, cy) : arrays of shape (n*m, 4) with the x and y coordinates of cell corners
+
+    Examples
+    --------
+    >>> cx, cy = rgrid_corners(np.linspace(0, 10, 11), np.linspace(0, 5, 6))
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # edge coordinates for each cell, row-wise (i for lines, j for columns)
+    x_left, y_bottom = np.meshgrid(x[:-1], y[:-1])
+    x_right, y_top = np.meshgrid(x[1:], y[1:])
+    x_left, x_right = x_left.ravel(), x_right.ravel()
+    y_bottom, y_top = y_bottom.ravel(), y_top.ravel()
+
+    cx = np.column_stack([x_left, x_right, x_right, x_left])
+    cy = np.column_stack([y_top, y_top, y_bottom, y_bottom])
+
+    return( rotate(cx, cy, angle, origin) )
+
+
+# ======================================================================================
+def rect_wkb(cx, cy):
+    """
+    Description
+    ----------
+    Packs rectangular cells into one contiguous buffer of WKB polygons.
+    Each record can be loaded with QgsGeometry.fromWkb()
+
+    Parameters
+    ----------
+    cx, cy : arrays of shape (N, 4) with the corner coordinates of the cells,
+             numbered clock-wise from top-left
+
+    Returns
+    -------
+    Structured array of N WKB records (dtype WKB_RECT_DTYPE).
+    Records are WKB_RECT_DTYPE.itemsize bytes long in records.tobytes()
+
+    Examples
+    --------
+    >>> wkb = rect_wkb(cx, cy).tobytes()
+    """
+    cx = np.asarray(cx, dtype=float)
+    cy = np.asarray(cy, dtype=float)
+
+    records = np.empty(cx.shape[0], dtype=WKB_RECT_DTYPE)
+    records['byteorder'] = 1 # little endian
+    records['wkbtype'] = WKB_POLYGON
+    records['nrings'] = 1
+    records['npoints'] = 5
+
+    # interleave x and y, and close the ring
+    coords = records['coords']
+    coords[:, 0:8:2] = cx
+    coords[:, 1:8:2] = cy
+    coords[:, 8] = cx[:, 0]
+    coords[:, 9] = cy[:, 0]
+
+    return(records)
+
+
+# ======================================================================================
+def rgrid_wkb(x, y, angle = 0., origin = (0., 0.)):
+    """
+    Description
+    ----------
+    Returns the WKB buffer of the cells of a regular grid (or of a band of it)
+    defined by the coordinates of its column (x) and row (y) edges.
+    Cells are ordered as in rgrid_corners().
+    This is pure arithmetic, suitable for worker processes.
+
+    Parameters
+    ----------
+    x : array of increasing x coordinates of column edges
+    y : array of increasing y coordinates of row edges
+    angle, origin : rotation of the grid (see rgrid_corners)
+
+    Returns
+    -------
+    bytes, with records of WKB_RECT_DTYPE.itemsize bytes
+
+    Examples
+    --------
+    >>> wkb = rgrid_wkb(x, y[10:21])
+    """
+    return( rect_wkb( *rgrid_corners(x, y, angle, origin) ).tobytes() )
+
+
+# ======================================================================================
+def graded_edges(xmin, xmax, res_min, res_max, controls = [], growth = 1.2):
+    """
+    Description
+    ----------
+    Computes the edges of a 1D discretization between xmin and xmax, with
+    cells of size res_min over control intervals, growing smoothly by a factor
+    growth from one cell to the next away from them, up to res_max.
+    The size of the cell at distance d from controls is min(res_max, res_min + (growth-1)*d)
+
+    Parameters
+    ----------
+    xmin, xmax : extent of the discretization
+    res_min, res_max : minimum and maximum cell sizes
+    controls : list of (start, end) control intervals (start = end for points)
+    growth : growth rate of cell size away from controls (>= 1)
+
+    Returns
+    -------
+    Array of increasing edge coordinates, from xmin to xmax
+
+    Examples
+    --------
+    >>> x = graded_edges(0., 1000., 5., 50., controls = [(480., 520.)], growth = 1.2)
+    >>> delr = np.diff(x)
+    """
+    controls = np.asarray(controls, dtype=float).reshape(-1, 2)
+
+    def cell_size(x):
+        if controls.shape[0] == 0 :
+            return(res_max)
+        dist = np.maximum( 0., np.maximum(controls[:,0] - x, x - controls[:,1]) ).min()
+        return( min(res_max, res_min + (growth - 1.)*dist) )
+
+    edges = [float(xmin)]
+    while edges[-1] < xmax - 1e-6*res_min :
+        x = edges[-1]
+        h = cell_size(x)
+        # do not overshoot finer areas ahead of x
+        for i in range(3) :
+            h = min(h, cell_size(x + h))
+        edges.append(x + h)
+
+    # stretch edges to fit xmax exactly
+    edges = np.array(edges)
+    edges = xmin + (edges - xmin) * (xmax - xmin) / (edges[-1] - xmin)
+
+    return(edges)
+
+
+# ======================================================================================
+def encode_spacing(values):
+    """
+    Description
+    ----------
+    Run-length encodes an array of cell dimensions, e.g. [10, 10, 10, 5] -> '3*10.0,5.0'
+
+    Parameters
+    ----------
+    values : array of floats
+
+    Returns
+    -------
+    string
+
+    Examples
+    --------
+    >>> encode_spacing(sgrid.delr)
+    """
+    values = np.atleast_1d( np.asarray(values, dtype=float) )
+    # start index of each run of identical values
+    starts = np.flatnonzero( np.concatenate( ([True], values[1:] != values[:-1]) ) )
+    counts = np.diff( np.append(starts, values.size) )
+    return( ','.join( [ repr(float(values[i])) if count == 1 else '%d*%r' % (count, float(values[i])) \
+            for i, count in zip(starts, counts) ] ) )
+
+
+# ======================================================================================
+def decode_spacing(text):
+    """
+    Description
+    ----------
+    Decodes cell dimensions encoded with encode_spacing()
+
+    Parameters
+    ----------
+    text : string
+
+    Returns
+    -------
+    array of floats
+
+    Examples
+    --------
+    >>> delr = decode_spacing('3*10.0,5.0')
+    """
+    values = []
+    for item in text.split(',') :
+        if '*' in item :
+            count, value = item.split('*')
+            values.extend( [float(value)]*int(count) )
+        else :
+            values.append( float(item) )
+    return( np.array(values) )
+
+
+# ======================================================================================
+def split_spacing(delta, selected, k):
+    """
+    Description
+    ----------
+    Splits selected intervals of a 1D discretization into k equal parts
+
+    Parameters
+    ----------
+    delta : array of interval sizes (e.g. delr or delc)
+    selected : indexes of the intervals to split
+    k : number of parts (or array of number of parts for each selected interval)
+
+    Returns
+    -------
+    (new_delta, parent) : array of new interval sizes, and index of
+    the original interval of each new interval
+
+    Examples
+    --------
+    >>> delr, parent_col = split_spacing([10., 10., 10.], [1], 2)
+    >>> # delr = [10., 5., 5., 10.], parent_col = [0, 1, 1, 2]
+    """
+    delta = np.atleast_1d( np.asarray(delta, dtype=float) )
+    counts = np.ones(delta.size, dtype=np.int64)
+    counts[ np.asarray(selected, dtype=np.int64) ] = k
+    parent = np.repeat( np.arange(delta.size), counts )
+    return( (delta / counts)[parent], parent )
+
+
+# ======================================================================================
+def merge_spacing(delta, selected, k):
+    """
+    Description
+    ----------
+    Merges selected intervals of a 1D discretization by groups of k consecutive
+    intervals. Each run of consecutive selected intervals is merged from its start,
+    the remaining intervals of a run (less than k) are kept.
+    This is the inverse of split_spacing.
+
+    Parameters
+    ----------
+    delta : array of interval sizes (e.g. delr or delc)
+    selected : indexes of the intervals to merge
+    k : number of intervals merged together
+
+    Returns
+    -------
+    (new_delta, group) : array of new interval sizes, and index of
+    the new interval containing each original interval
+
+    Examples
+    --------
+    >>> delr, group_col = merge_spacing([10., 5., 5., 10.], [1, 2], 2)
+    >>> # delr = [10., 10., 10.], group_col = [0, 1, 1, 2]
+    """
+    delta = np.atleast_1d( np.asarray(delta, dtype=float) )
+    is_selected = np.zeros(delta.size, dtype=bool)
+    is_selected[ np.asarray(selected, dtype=np.int64) ] = True
+
+    k = max(int(k), 1)
+    if k == 1 or not is_selected.any() :
+        return( delta.copy(), np.arange(delta.size) )
+
+    # runs of consecutive selected intervals, and position of intervals in their run
+    is_first = is_selected & ~np.r_[False, is_selected[:-1]]
+    run = np.cumsum(is_first) - 1
+    first = np.flatnonzero(is_first)
+    run_length = np.bincount( run[is_selected], minlength = first.size )
+    rank = np.arange(delta.size) - first[np.maximum(run, 0)]
+    # intervals of complete groups of k are merged
+    merged = is_selected & ( (rank // k + 1) * k <= run_length[np.maximum(run, 0)] )
+
+    # new interval starts : unmerged intervals, and first intervals of groups
+    starts = ~merged | (rank % k == 0)
+    group = np.cumsum(starts) - 1
+    return( np.bincount(group, weights = delta), group )
+
+
+# ======================================================================================
+class StructuredGrid(object):
+    """
+    Description
+    -----------
+    Array-backed description of a structured (modflow-like) grid.
+    Rows are numbered from top to bottom and columns from left to right (0-based).
+    Rotated grids are described in the grid frame, which is rotated by
+    angle around the top-left corner of the grid.
+
+    Attributes
+    ----------
+    xoff, yoff : coordinates of the top-left corner of the grid
+    delr : array of column widths (size ncol)
+    delc : array of row heights, from top to bottom (size nrow)
+    fids : array of shape (nrow, ncol) with the feature id of each cell (or None)
+    angle : rotation angle of the grid around (xoff, yoff), in degrees (counter-clockwise)
+
+    Examples
+    --------
+    >>> sgrid = StructuredGrid(0., 100., [10.]*10, [10.]*10)
+    >>> row, col = sgrid.row_col([12, 45])
+    """
+
+    def __init__(self, xoff, yoff, delr, delc, fids = None, angle = 0.):
+        self.xoff = float(xoff)
+        self.yoff = float(yoff)
+        self.angle = float(angle)
+        self.delr = np.atleast_1d( np.asarray(delr, dtype=float) )
+        self.delc = np.atleast_1d( np.asarray(delc, dtype=float) )
+        self._fid_lookup = None
+        if fids is not None :
+            fids = np.asarray(fids, dtype=np.int64).reshape(self.nrow, self.ncol)
+        self.fids = fids
+
+    @property
+    def nrow(self):
+        return(self.delc.size)
+
+    @property
+    def ncol(self):
+        return(self.delr.size)
+
+    @property
+    def xedges(self):
+        """ x coordinates of column edges in the grid frame, from left to right (size ncol+1) """
+        return( self.xoff + np.concatenate( ([0.], np.cumsum(self.delr)) ) )
+
+    @property
+    def yedges(self):
+        """ y coordinates of row edges in the grid frame, from top to bottom (size nrow+1) """
+        return( self.yoff - np.concatenate( ([0.], np.cumsum(self.delc)) ) )
+
+    def to_world(self, x, y):
+        """ converts coordinates from the grid frame to map coordinates """
+        return( rotate(x, y, self.angle, (self.xoff, self.yoff)) )
+
+    def to_local(self, x, y):
+        """ converts map coordinates to the grid frame """
+        return( rotate(x, y, -self.angle, (self.xoff, self.yoff)) )
+
+    @classmethod
+    def from_rgrid(cls, xmin, ymin, xmax, ymax, n, m, fids = None, angle = 0., origin = None):
+        """
+        Description
+        ----------
+        Builds the structured grid corresponding to make_rgrid parameters
+
+        Parameters
+        ----------
+        xmin, ymin, xmax, ymax : grid extents, in the grid frame
+        n, m : number of rows and columns
+        fids (optional) : feature ids, as returned by make_rgrid
+                          (ordered from bottom to top, then from left to right)
+        angle, origin (optional) : rotation angle and center of rotation, as in make_rgrid
+                          (origin defaults to (xmin, ymin))
+
+        Returns
+        -------
+        StructuredGrid instance
+
+        Examples
+        --------
+        >>> sgrid = StructuredGrid.from_rgrid(0, 0, 100, 50, 5, 10, fids)
+        """
+        delr = np.full( m, (xmax - xmin) / float(m) )
+        delc = np.full( n, (ymax - ymin) / float(n) )
+        if fids is not None :
+            # make_rgrid starts with the bottom line
+            fids = np.asarray(fids, dtype=np.int64).reshape(n, m)[::-1, :]
+        if origin is None :
+            origin = (xmin, ymin)
+        xoff, yoff = rotate(xmin, ymax, angle, origin)
+        return( cls(float(xoff), float(yoff), delr, delc, fids, angle) )
+
+    @classmethod
+    def from_extents(cls, fids, xmin, xmax, ymin, ymax, decimals = 6):
+        """
+        Description
+        ----------
+        Builds the structured grid from the extents of its cells.
+        Raises ValueError if cells do not form a structured grid.
+
+        Parameters
+        ----------
+        fids : array of feature ids
+        xmin, xmax, ymin, ymax : arrays of cell extents
+        decimals : number of decimals considered to compare coordinates
+
+        Returns
+        -------
+        StructuredGrid instance
+
+        Examples
+        --------
+        >>> sgrid = StructuredGrid.from_extents(fids, xmin, xmax, ymin, ymax)
+        """
+        fids = np.asarray(fids, dtype=np.int64)
+        xmin, xmax = np.around(xmin, decimals), np.around(xmax, decimals)
+        ymin, ymax = np.around(ymin, decimals), np.around(ymax, decimals)
+
+        if fids.size == 0 :
+            raise ValueError('Empty grid')
+
+        # column edges (left to right) and row edges (top to bottom)
+        xedges = np.unique( np.concatenate( (xmin, xmax) ) )
+        yedges = np.unique( np.concatenate( (ymin, ymax) ) )[::-1]
+        ncol, nrow = xedges.size - 1, yedges.size - 1
+
+        # cell position
+        col = np.searchsorted(xedges, xmin)
+        row = np.searchsorted(-yedges, -ymax)
+
+        # each cell must span exactly one row and one column,
+        # and each (row, col) must be filled exactly once
+        flat = row*ncol + col
+        if nrow*ncol != fids.size or np.unique(flat).size != fids.size or \
+                np.any( xedges[np.minimum(col + 1, ncol)] != xmax ) or \
+                np.any( yedges[np.minimum(row + 1, nrow)] != ymin ) :
+            raise ValueError('Cells do not form a structured grid')
+
+        grid_fids = np.empty(nrow*ncol, dtype=np.int64)
+        grid_fids[flat] = fids
+
+        return( cls(xedges[0], yedges[0], np.diff(xedges), -np.diff(yedges), grid_fids) )
+
+    @classmethod
+    def from_corners(cls, fids, cx, cy, decimals = 6, angle = None):
+        """
+        Description
+        ----------
+        Builds the structured grid, possibly rotated, from the corners of its cells.
+        Corners are converted to the grid frame, where cells are matched as
+        in from_extents(). Raises ValueError if cells do not form a structured grid.
+
+        Parameters
+        ----------
+        fids : array of feature ids
+        cx, cy : arrays of shape (N, 4) with the corner coordinates of the cells,
+                 numbered clock-wise from top-left
+        decimals : number of decimals considered to compare coordinates
+        angle (optional) : rotation angle of the grid, estimated from the cells
+                 if not provided (see estimate_angle)
+
+        Returns
+        -------
+        StructuredGrid instance
+
+        Examples
+        --------
+        >>> sgrid = StructuredGrid.from_corners(fids, cx, cy)
+        """
+        cx = np.asarray(cx, dtype=float).reshape(-1, 4)
+        cy = np.asarray(cy, dtype=float).reshape(-1, 4)
+        if cx.shape[0] == 0 :
+            raise ValueError('Empty grid')
+        if angle is None :
+            angle = estimate_angle(cx, cy)
+
+        # cell extents in the grid frame, rotated around the first corner
+        origin = (cx[0,0], cy[0,0])
+        lx, ly = rotate(cx, cy, -angle, origin)
+        sgrid = cls.from_extents(fids, lx.min(axis=1), lx.max(axis=1),
+                ly.min(axis=1), ly.max(axis=1), decimals)
+
+        # top-left corner in map coordinates
+        xoff, yoff = rotate(sgrid.xoff, sgrid.yoff, angle, origin)
+        return( cls(float(xoff), float(yoff), sgrid.delr, sgrid.delc, sgrid.fids, angle) )
+
+    def to_uri(self):
+        """
+        Description
+        ----------
+        Returns a compact string description of the grid geometry
+        (fids are not included), e.g. 'xoff=0.0&yoff=100.0&delr=10*10.0&delc=10*10.0'
+        The rotation angle is added for rotated grids.
+        """
+        uri = 'xoff=%r&yoff=%r&delr=%s&delc=%s' % (self.xoff, self.yoff,
+            encode_spacing(self.delr), encode_spacing(self.delc))
+        if self.angle != 0 :
+            uri += '&angle=%r' % self.angle
+        return(uri)
+
+    @classmethod
+    def from_uri(cls, uri):
+        """
+        Description
+        ----------
+        Builds the structured grid from a string written by to_uri().
+        Unknown keys are ignored.
+        """
+        params = dict( [ item.split('=', 1) for item in uri.split('&') if '=' in item ] )
+        return( cls( float(params['xoff']), float(params['yoff']),
+            decode_spacing(params['delr']), decode_spacing(params['delc']),
+            angle = float(params.get('angle', 0.)) ) )
+
+    def _lookup(self):
+        # Build fid -> flat cell index lookup.
+        # A dense table is used when fids are compact (the usual case).
+        if self._fid_lookup is None :
+            flat_fids = self.fids.ravel()
+            if flat_fids.min() >= 0 and flat_fids.max() < 4*flat_fids.size + 16 :
+                table = np.full(flat_fids.max() + 1, -1, dtype=np.int64)
+                table[flat_fids] = np.arange(flat_fids.size)
+                self._fid_lookup = ('dense', table)
+            else :
+                order = np.argsort(flat_fids)
+                self._fid_lookup = ('sorted', (flat_fids[order], order))
+        return(self._fid_lookup)
+
+    def row_col(self, fids):
+        """
+        Description
+        ----------
+        Returns the (row, col) indexes of fids.
+        Raises KeyError if a fid is not in the grid.
+
+        Parameters
+        ----------
+        fids : feature id or list of feature ids
+
+        Returns
+        -------
+        (row, col) arrays
+
+        Examples
+        --------
+        >>> row, col = sgrid.row_col(grid_layer.selectedFeatureIds())
+        """
+        fids = np.atleast_1d( np.asarray(fids, dtype=np.int64) )
+        kind, lookup = self._lookup()
+        if kind == 'dense' :
+            valid = (fids >= 0) & (fids < lookup.size)
+            idx = np.where( valid, lookup[np.clip(fids, 0, lookup.size - 1)], -1 )
+        else :
+            sorted_fids, order = lookup
+            pos = np.clip( np.searchsorted(sorted_fids, fids), 0, sorted_fids.size - 1 )
+            idx = np.where( sorted_fids[pos] == fids, order[pos], -1 )
+        if np.any(idx < 0) :
+            raise KeyError('Feature ids not found in grid : %s' % fids[idx < 0])
+        return( np.divmod(idx, self.ncol) )
+
+    def refine(self, rows, cols, n, m):
+        """
+        Description
+        ----------
+        Returns the grid obtained by splitting rows into n rows and
+        columns into m columns (fids of the new grid are not set).
+
+        Parameters
+        ----------
+        rows, cols : indexes of rows and columns to split
+        n, m : number of parts for rows and columns (or arrays, for each row and column)
+
+        Returns
+        -------
+        (sgrid, parent_row, parent_col) : refined StructuredGrid, and for each of its
+        rows (columns), the index of the original row (column)
+
+        Examples
+        --------
+        >>> new_sgrid, parent_row, parent_col = sgrid.refine([2, 3], [], 2, 1)
+        """
+        delc, parent_row = split_spacing(self.delc, rows, n)
+        delr, parent_col = split_spacing(self.delr, cols, m)
+        return( StructuredGrid(self.xoff, self.yoff, delr, delc, angle = self.angle), parent_row, parent_col )
+
+    def coarsen(self, rows, cols, n, m):
+        """
+        Description
+        ----------
+        Returns the grid obtained by merging rows by groups of n consecutive rows and
+        columns by groups of m consecutive columns (see merge_spacing).
+        Fids of the new grid are not set.
+
+        Parameters
+        ----------
+        rows, cols : indexes of rows and columns to merge
+        n, m : number of rows and columns merged together
+
+        Returns
+        -------
+        (sgrid, row_group, col_group) : coarsened StructuredGrid, and for each of the
+        original rows (columns), the index of the new row (column) containing it
+
+        Examples
+        --------
+        >>> new_sgrid, row_group, col_group = sgrid.coarsen([2, 3], [], 2, 1)
+        """
+        delc, row_group = merge_spacing(self.delc, rows, n)
+        delr, col_group = merge_spacing(self.delr, cols, m)
+        return( StructuredGrid(self.xoff, self.yoff, delr, delc, angle = self.angle), row_group, col_group )
+
+    def cell_corners(self, rows, cols):
+        """
+        Description
+        ----------
+        Returns the corners (map coordinates) of cells (rows, cols)
+        as two arrays of shape (N, 4), numbered clock-wise from top-left
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        xedges, yedges = self.xedges, self.yedges
+        cx = np.column_stack([ xedges[cols], xedges[cols+1], xedges[cols+1], xedges[cols] ])
+        cy = np.column_stack([ yedges[rows], yedges[rows], yedges[rows+1], yedges[rows+1] ])
+        return( self.to_world(cx, cy) )
+
+    def centroids(self):
+        """
+        Description
+        ----------
+        Returns cell centroids (map coordinates) as two arrays of shape (nrow, ncol)
+        """
+        xedges, yedges = self.xedges, self.yedges
+        cx = 0.5*(xedges[:-1] + xedges[1:])
+        cy = 0.5*(yedges[:-1] + yedges[1:])
+        return( self.to_world( *np.meshgrid(cx, cy) ) )
+
+    def corners(self):
+        """
+        Description
+        ----------
+        Returns cell corners (map coordinates) as two arrays of shape (nrow*ncol, 4),
+        cells being ordered row-wise, from top to bottom.
+        Corners are numbered clock-wise from top-left (in the grid frame).
+        """
+        cx, cy = rgrid_corners(self.xedges, self.yedges[::-1], self.angle, (self.xoff, self.yoff))
+        # rgrid_corners starts with the bottom line
+        cx = cx.reshape(self.nrow, self.ncol, 4)[::-1].reshape(-1, 4)
+        cy = cy.reshape(self.nrow, self.ncol, 4)[::-1].reshape(-1, 4)
+        return(cx, cy)
+
+    def extent(self):
+        """
+        Description
+        ----------
+        Returns the extent of the grid in map coordinates, as (xmin, xmax, ymin, ymax)
+        """
+        xedges, yedges = self.xedges, self.yedges
+        x, y = self.to_world( xedges[[0, -1, -1, 0]], yedges[[0, 0, -1, -1]] )
+        return( x.min(), x.max(), y.min(), y.max() )
+
+    def cell_range(self, xmin, xmax, ymin, ymax):
+        """
+        Description
+        ----------
+        Returns the ranges of rows and columns intersecting a rectangle
+        (map coordinates), as (row_start, row_end, col_start, col_end).
+        For rotated grids, the rectangle is converted into the grid frame first.
+        """
+        x, y = self.to_local( np.array([xmin, xmax, xmax, xmin]), np.array([ymax, ymax, ymin, ymin]) )
+        xedges, yedges = self.xedges, self.yedges
+        col_start = max( 0, np.searchsorted(xedges, x.min(), 'right') - 1 )
+        col_end = min( self.ncol, np.searchsorted(xedges, x.max(), 'left') )
+        row_start = max( 0, np.searchsorted(-yedges, -y.max(), 'right') - 1 )
+        row_end = min( self.nrow, np.searchsorted(-yedges, -y.min(), 'left') )
+        return( int(row_start), int(row_end), int(col_start), int(col_end) )
+
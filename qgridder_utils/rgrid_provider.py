@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qgridder_utils_rgrid_provider.py
+                                 Qgridder - A QGIS plugin
+
+ This file provides a virtual vector data provider for structured grids.
+ Cell polygons are generated on the fly from the grid origin, delr and delc,
+ only for the features which are requested (e.g. at the current canvas extent).
+
+ Qgridder Builds 2D regular and unstructured grids and comes together with
+ pre- and post-processing capabilities for spatially distributed modeling.
+
+                              -------------------
+        begin                : 2013-04-08
+        copyright            : (C) 2013 by Pryet
+        email                : alexandre.pryet@ensegid.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import *
+
+from urllib.parse import quote, unquote
+
+from .rgrid import *
+
+# ======================================================================================
+
+# Global constants
+
+RGRID_PROVIDER_KEY = 'qgridder_rgrid'
+# Python data providers with read flags can be registered from Qgis 3.16
+RGRID_PROVIDER_MIN_VERSION = 31600
+
+# Feature ids follow the order of make_rgrid (from bottom to top, then from left to right),
+# so that exporting a virtual grid gives the same ids as a grid written by make_rgrid.
+
+# ======================================================================================
+class RGridFeatureIterator(QgsAbstractFeatureIterator):
+    """
+    Description
+    -----------
+    Iterates over the cells of a virtual structured grid.
+    Only cells matching the request (fid, fids or filter rectangle) are generated.
+    """
+
+    def __init__(self, source, request):
+        super(RGridFeatureIterator, self).__init__(request)
+        self._request = request if request is not None else QgsFeatureRequest()
+        self._source = source
+        self._expression = None
+
+        # transform to destination crs
+        self._transform = QgsCoordinateTransform()
+        if self._request.destinationCrs().isValid() and \
+                self._request.destinationCrs() != self._source.crs :
+            self._transform = QgsCoordinateTransform(self._source.crs,
+                    self._request.destinationCrs(), self._request.transformContext())
+        try :
+            self._filter_rect = self.filterRectToSourceCrs(self._transform)
+        except QgsCsException :
+            self._filter_rect = None
+            self._cells = iter([])
+            return
+
+        # expression filter
+        if self._request.filterType() == QgsFeatureRequest.FilterExpression :
+            self._expression = self._request.filterExpression()
+            self._expression_context = QgsExpressionContext()
+            self._expression_context.appendScope( QgsExpressionContextUtils.globalScope() )
+            self._expression_context.setFields( self._source.fields )
+            self._expression.prepare( self._expression_context )
+
+        self._cells = self._iter_cells()
+
+    def _iter_cells(self):
+        # yields (row, col, wkb) of requested cells
+        source = self._source
+        nrow, ncol = source.sgrid.nrow, source.sgrid.ncol
+        with_geometry = not (self._request.flags() & QgsFeatureRequest.NoGeometry)
+        wkb_size = WKB_RECT_DTYPE.itemsize
+
+        # requests by feature ids
+        filter_type = self._request.filterType()
+        if filter_type in (QgsFeatureRequest.FilterFid, QgsFeatureRequest.FilterFids) :
+            if filter_type == QgsFeatureRequest.FilterFid :
+                fids = [ self._request.filterFid() ]
+            else :
+                fids = sorted( self._request.filterFids() )
+            for fid in fids :
+                if 0 <= fid < nrow*ncol :
+                    row, col = source.row_col(fid)
+                    wkb = source.row_wkb(row, col, col + 1) if with_geometry else None
+                    yield( row, col, wkb )
+            return
+
+        # requests by rectangle : restrict rows and columns
+        row_start, row_end, col_start, col_end = 0, nrow, 0, ncol
+        if self._filter_rect is not None and not self._filter_rect.isNull() :
+            row_start, row_end, col_start, col_end = source.rect_rows_cols(self._filter_rect)
+
+        for row in range(row_start, row_end) :
+            if with_geometry :
+                wkb = source.row_wkb(row, col_start, col_end)
+            for k, col in enumerate( range(col_start, col_end) ) :
+                yield( row, col, wkb[k*wkb_size:(k+1)*wkb_size] if with_geometry else None )
+
+    def fetchFeature(self, f):
+        for row, col, wkb in self._cells :
+            self._source.fill_feature(f, row, col, wkb)
+            if self._expression is not None :
+                self._expression_context.setFeature(f)
+                if not self._expression.evaluate(self._expression_context) :
+                    continue
+            self.geometryToDestinationCrs(f, self._transform)
+            return(True)
+        f.setValid(False)
+        return(False)
+
+    def __iter__(self):
+        self.rewind()
+        return(self)
+
+    def __next__(self):
+        f = QgsFeature()
+        if not self.nextFeature(f):
+            raise StopIteration
+        return(f)
+
+    def rewind(self):
+        self._cells = self._iter_cells()
+        return(True)
+
+    def close(self):
+        self._cells = iter([])
+        return(True)
+
+
+# ======================================================================================
+class RGridFeatureSource(QgsAbstractFeatureSource):
+    """
+    Description
+    -----------
+    Thread-safe snapshot of a virtual structured grid
+    """
+
+    def __init__(self, provider):
+        super(RGridFeatureSource, self).__init__()
+        self.sgrid = provider.sgrid
+        self.fields = provider.fields()
+        self.crs = provider.crs()
+        self.xedges = self.sgrid.xedges
+        self.yedges = self.sgrid.yedges
+
+    def getFeatures(self, request):
+        return( QgsFeatureIterator( RGridFeatureIterator(self, request) ) )
+
+    def row_col(self, fid):
+        # fids start with the bottom line
+        line, col = divmod(fid, self.sgrid.ncol)
+        return( self.sgrid.nrow - 1 - line, col )
+
+    def fid(self, row, col):
+        return( (self.sgrid.nrow - 1 - row)*self.sgrid.ncol + col )
+
+    def rect_rows_cols(self, rect):
+        # row and column ranges intersecting rect (in the grid frame for rotated grids)
+        return( self.sgrid.cell_range( rect.xMinimum(), rect.xMaximum(), rect.yMinimum(), rect.yMaximum() ) )
+
+    def row_wkb(self, row, col_start, col_end):
+        # WKB buffer of cells col_start to col_end-1 of row
+        return( rgrid_wkb( self.xedges[col_start:col_end+1], self.yedges[[row+1, row]],
+            self.sgrid.angle, (self.sgrid.xoff, self.sgrid.yoff) ) )
+
+    def fill_feature(self, f, row, col, wkb):
+        f.setFields(self.fields, True)
+        f.setId( self.fid(row, col) )
+        f.setAttributes( [0, int(row), int(col)] )
+        if wkb is not None :
+            geom = QgsGeometry()
+            geom.fromWkb(wkb)
+            f.setGeometry(geom)
+        else :
+            f.clearGeometry()
+        f.setValid(True)
+
+
+# ======================================================================================
+class RGridProvider(QgsVectorDataProvider):
+    """
+    Description
+    -----------
+    Virtual vector data provider of a structured grid.
+    The uri is built with get_virtual_rgrid_uri()
+    """
+
+    @classmethod
+    def providerKey(cls):
+        return(RGRID_PROVIDER_KEY)
+
+    @classmethod
+    def description(cls):
+        return('Qgridder virtual structured grid')
+
+    @classmethod
+    def createProvider(cls, uri, providerOptions, flags = None):
+        return( RGridProvider(uri, providerOptions, flags) )
+
+    def __init__(self, uri = '', providerOptions = None, flags = None):
+        # options and flags are not used (default values are not built at import,
+        # so that this module can be imported with older Qgis versions)
+        super(RGridProvider, self).__init__(uri)
+        self._uri = uri
+        self._is_valid = True
+        try :
+            self.sgrid = StructuredGrid.from_uri(uri)
+        except (KeyError, ValueError) :
+            self.sgrid = StructuredGrid(0., 0., [], [])
+            self._is_valid = False
+
+        params = dict( [ item.split('=', 1) for item in uri.split('&') if '=' in item ] )
+        crs_def = unquote( params.get('crs', '') )
+        self._crs = QgsCoordinateReferenceSystem.fromWkt(crs_def)
+        if not self._crs.isValid() :
+            # uri with an authority identifier (e.g. EPSG:2154)
+            self._crs = QgsCoordinateReferenceSystem(crs_def)
+
+        self._fields = QgsFields()
+        self._fields.append( QgsField('ID', QVariant.Int) )
+        self._fields.append( QgsField('ROW', QVariant.Int) )
+        self._fields.append( QgsField('COL', QVariant.Int) )
+
+    def featureSource(self):
+        return( RGridFeatureSource(self) )
+
+    def dataSourceUri(self, expandAuthConfig = True):
+        return(self._uri)
+
+    def storageType(self):
+        return('Generated on the fly')
+
+    def getFeatures(self, request = QgsFeatureRequest()):
+        return( QgsFeatureIterator( RGridFeatureIterator( RGridFeatureSource(self), request ) ) )
+
+    def wkbType(self):
+        return(QgsWkbTypes.Polygon)
+
+    def featureCount(self):
+        return(self.sgrid.nrow * self.sgrid.ncol)
+
+    def fields(self):
+        return(self._fields)
+
+    def capabilities(self):
+        return(QgsVectorDataProvider.SelectAtId)
+
+    def name(self):
+        return(self.providerKey())
+
+    def extent(self):
+        if self.featureCount() == 0 :
+            return( QgsRectangle() )
+        xmin, xmax, ymin, ymax = self.sgrid.extent()
+        return( QgsRectangle(xmin, ymin, xmax, ymax) )
+
+    def updateExtents(self):
+        pass
+
+    def isValid(self):
+        return(self._is_valid)
+
+    def crs(self):
+        return(self._crs)
+
+    def supportsSubsetString(self):
+        return(False)
+
+
+# ======================================================================================
+def register_rgrid_provider():
+    """
+    Description
+    ----------
+    Registers the virtual structured grid provider (once).
+    Python data providers can not be registered with Qgis versions
+    older than 3.16 : virtual grids are then not available.
+
+    Returns
+    -------
+    True if the provider is registered
+
+    Examples
+    --------
+    >>> register_rgrid_provider()
+    """
+    if Qgis.QGIS_VERSION_INT < RGRID_PROVIDER_MIN_VERSION :
+        return(False)
+    registry = QgsProviderRegistry.instance()
+    if RGRID_PROVIDER_KEY in registry.providerList() :
+        return(True)
+    try :
+        metadata = QgsProviderMetadata( RGridProvider.providerKey(), RGridProvider.description(),
+                RGridProvider.createProvider )
+        return( registry.registerProvider(metadata) )
+    except (NameError, TypeError, AttributeError) :
+        return(False)
+
+
+# ======================================================================================
+def get_virtual_rgrid_uri(sgrid, crs = None):
+    """
+    Description
+    ----------
+    Returns the uri of the virtual layer of a structured grid.
+    The crs is saved as WKT, so that custom crs are kept.
+
+    Parameters
+    ----------
+    sgrid : StructuredGrid
+    crs : QgsCoordinateReferenceSystem of the grid
+
+    Returns
+    -------
+    uri (string)
+
+    Examples
+    --------
+    >>> grid_layer = QgsVectorLayer(get_virtual_rgrid_uri(sgrid, crs), 'grid', RGRID_PROVIDER_KEY)
+    """
+    uri = sgrid.to_uri()
+    if crs is not None and crs.isValid() :
+        uri += '&crs=' + quote( crs.toWkt(), safe = '' )
+    return(uri)
+
+
+# ======================================================================================
+def make_virtual_rgrid_layer(sgrid, crs = None, layer_name = 'grid'):
+    """
+    Description
+    ----------
+    Returns a vector layer of the structured grid sgrid, whose cells are
+    generated on the fly. Use "Save Features As" (or QgsVectorFileWriter)
+    to write the grid to a file. The layer is not valid if the provider
+    can not be registered (see register_rgrid_provider).
+
+    Parameters
+    ----------
+    sgrid : StructuredGrid
+    crs : QgsCoordinateReferenceSystem of the grid
+    layer_name : name of the output layer
+
+    Returns
+    -------
+    QgsVectorLayer
+
+    Examples
+    --------
+    >>> sgrid = StructuredGrid(0., 1000., [10.]*100, [10.]*100)
+    >>> QgsProject.instance().addMapLayer( make_virtual_rgrid_layer(sgrid, crs) )
+    """
+    register_rgrid_provider()
+    return( QgsVectorLayer( get_virtual_rgrid_uri(sgrid, crs), layer_name, RGRID_PROVIDER_KEY ) )
+
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qgridder_utils_tasks.py
+                                 Qgridder - A QGIS plugin
+
+ This file gathers background tasks (QgsTask) for long grid operations :
+ grid build, refinement, coarsening and pseudo-3D grid check.
+ Cells of grid layers are read and edited in memory (Numpy arrays) on worker
+ threads, and changes are committed to the original layers on the main thread,
+ once the task is completed.
+
+ Qgridder Builds 2D regular and unstructured grids and comes together with
+ pre- and post-processing capabilities for spatially distributed modeling.
+
+                              -------------------
+        begin                : 2013-04-08
+        copyright            : (C) 2013 by Pryet
+        email                : alexandre.pryet@ensegid.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from qgis.core import *
+
+try :
+    from qgis.PyQt import sip
+except ImportError :
+    import sip
+
+import os
+import numpy as np
+
+from .base import *
+from .journal import *
+
+# ======================================================================================
+class GridLayerCopy(object):
+    """
+    Description
+    -----------
+    Working copy of a grid layer, created in the main thread, edited in a worker
+    thread, and whose changes are committed to the original layer from the main
+    thread (commit).
+    Cells are copied as arrays (GridCells, see extents.py) : they are taken from
+    the cell extent cache of the layer if it is up to date, or read from a feature
+    source in the worker thread (read_cells). Structured and nested grids are
+    edited on these arrays, and only the replaced cells are written to the layer.
+    Other grids, refined by the geometric procedure, are copied to a memory layer
+    (materialize, diff).
+
+    Examples
+    --------
+    >>> grid_copy = GridLayerCopy(grid_layer)       # main thread
+    >>> cells = grid_copy.read_cells()               # worker thread
+    >>> grid = get_split_grid(None, 2, 2, topo_rules, cells, cells.angle)
+    >>> cells.replace( *split_grid_cells(grid, fids, 2, 2, topo_rules) )
+    >>> grid_copy.commit()                           # main thread
+    """
+
+    def __init__(self, grid_layer):
+        self.layer = grid_layer
+        self.layer_id = grid_layer.id()
+        # thread-safe snapshot of grid_layer features
+        self.source = QgsVectorLayerFeatureSource(grid_layer)
+        self.fields = grid_layer.fields()
+        self.crs = grid_layer.crs()
+        self.angle = get_grid_angle(grid_layer)
+        # cell arrays of the cache, if up to date, otherwise read by read_cells
+        extents = get_cell_extents(grid_layer)
+        self.cache_arrays = extents.snapshot()
+        self.cache_generation = extents.generation
+        self.read_arrays = None
+        self.cells = None
+        self.copy = None
+        self.copy_fids = {}
+        self.src_fids = {}
+        self.deleted_fids = []
+        self.new_features = []
+        # feature ids of the copy -> feature ids of the original layer, once committed
+        self.fid_map = {}
+
+    def read_cells(self):
+        """ returns the cells of the layer, as GridCells edited in memory """
+        arrays = self.cache_arrays
+        if arrays is None :
+            request = QgsFeatureRequest().setSubsetOfAttributes([])
+            arrays = read_cells( self.source.getFeatures(request) )
+            # used to fill the cache of the layer once committed
+            self.read_arrays = arrays
+        self.cells = GridCells(*arrays, angle = self.angle)
+        return(self.cells)
+
+    def materialize(self):
+        """ fills and returns the memory copy """
+        self.cells = None
+        self.copy = QgsVectorLayer("Polygon", 'grid_copy', 'memory')
+        self.copy.setCrs(self.crs)
+        provider = self.copy.dataProvider()
+        provider.addAttributes( self.fields.toList() )
+        self.copy.updateFields()
+        features = [ feat for feat in self.source.getFeatures() ]
+        src_fids = [ feat.id() for feat in features ]
+        res, copied_features = provider.addFeatures(features)
+        self.src_fids = { copy_feat.id() : src_fid for src_fid, copy_feat in zip(src_fids, copied_features) }
+        self.copy_fids = { src_fid : copy_fid for copy_fid, src_fid in self.src_fids.items() }
+        return(self.copy)
+
+    def to_copy_fids(self, fids):
+        """ converts feature ids of the original layer into ids of the copy """
+        return( [ self.copy_fids[fid] for fid in fids ] )
+
+    def diff(self):
+        """ computes deleted (original) feature ids and new features of the copy """
+        kept_fids = set()
+        self.new_features = []
+        for feat in self.copy.getFeatures() :
+            if feat.id() in self.src_fids :
+                kept_fids.add( feat.id() )
+            else :
+                self.new_features.append(feat)
+        self.deleted_fids = [ src_fid for copy_fid, src_fid in self.src_fids.items() if copy_fid not in kept_fids ]
+        return( self.deleted_fids, self.new_features )
+
+    def check(self):
+        """ raises ValueError if cells to be replaced are no longer in the layer """
+        if self.cells is None :
+            return
+        extents = get_cell_extents(self.layer)
+        if self.read_arrays is not None :
+            # the cache is filled with the cells read in the worker thread, features
+            # modified since then are re-read
+            extents.seed(self.read_arrays, self.cache_generation)
+            self.read_arrays = None
+        deleted_fids, cx, cy, src_fids, new_ids = self.cells.changes()
+        try :
+            extents.index( np.union1d(deleted_fids, src_fids) )
+        except KeyError :
+            raise ValueError('Grid layer %s has been edited while the task was running' % self.layer.name())
+
+    def commit(self, journal = None):
+        """ applies the changes of the copy to the original layer, recorded in journal (GridJournal) if provided """
+        if self.cells is None :
+            return( self.commit_copy(journal) )
+        self.check()
+        deleted_fids, cx, cy, src_fids, new_ids = self.cells.changes()
+        deleted_fids = [ int(fid) for fid in deleted_fids ]
+        if len(deleted_fids) == 0 and src_fids.size == 0 :
+            return(True)
+        if journal is not None :
+            removed = read_journal_features(self.layer, deleted_fids)
+        new_fids = replace_cells(self.layer, deleted_fids, cx, cy, src_fids)
+        # provisional ids of new cells -> feature ids of the layer
+        self.fid_map = dict( zip( new_ids.tolist(), new_fids ) )
+        if journal is not None :
+            journal.record(self.layer, removed, new_fids)
+        self.layer.triggerRepaint()
+        return( len(new_fids) == src_fids.size )
+
+    def commit_copy(self, journal = None):
+        """ applies the changes of the memory copy to the original layer """
+        provider = self.layer.dataProvider()
+        if journal is not None :
+            removed = read_journal_features(self.layer, self.deleted_fids)
+        res = True
+        if len(self.deleted_fids) > 0 :
+            res = provider.deleteFeatures(self.deleted_fids)
+        new_fids = []
+        if len(self.new_features) > 0 :
+            added, features = provider.addFeatures(self.new_features)
+            new_fids = [ feat.id() for feat in features ]
+            res = res and added
+        self.fid_map = dict(self.src_fids)
+        self.fid_map.update( { copy_feat.id() : fid for copy_feat, fid in zip(self.new_features, new_fids) } )
+        invalidate_cell_extents(self.layer, list(self.deleted_fids) + new_fids)
+        if journal is not None and ( len(self.deleted_fids) > 0 or len(new_fids) > 0 ) :
+            journal.record(self.layer, removed, new_fids)
+        self.layer.triggerRepaint()
+        return(res)
+
+
+# ======================================================================================
+class QgridderTask(QgsTask):
+    """
+    Description
+    -----------
+    Base class of Qgridder background tasks.
+    on_finished(task, result) is called from the main thread when the task ends.
+    Exceptions raised in the worker thread, or while changes are applied, are
+    stored in self.exception.
+    """
+
+    def __init__(self, description, on_finished = None):
+        super(QgridderTask, self).__init__(description, QgsTask.CanCancel)
+        self.on_finished = on_finished
+        self.exception = None
+
+    def run(self):
+        try :
+            res = self.process()
+        except Exception as e :
+            # the traceback would keep the frames of the worker thread,
+            # and the objects they hold (e.g. open file writers), alive
+            self.exception = e.with_traceback(None)
+            return(False)
+        return( res and not self.isCanceled() )
+
+    def process(self):
+        # to be implemented by subclasses (worker thread)
+        return(True)
+
+    def apply(self):
+        # to be implemented by subclasses (main thread, if successful)
+        pass
+
+    def finished(self, result):
+        if result :
+            try :
+                self.apply()
+            except Exception as e :
+                # e.g. cells edited since the task started
+                self.exception = e.with_traceback(None)
+                result = False
+        if self.on_finished is not None :
+            self.on_finished(self, result)
+
+
+# ======================================================================================
+class RGridTask(QgridderTask):
+    """
+    Description
+    -----------
+    Builds a regular grid file in the background (see make_rgrid).
+    The output file must not exist. It is deleted if the task is canceled or fails.
+
+    Examples
+    --------
+    >>> task = RGridTask('Build grid', bbox, n, m, 'grid.gpkg', 'System', fields, crs)
+    >>> QgsApplication.taskManager().addTask(task)
+    """
+
+    def __init__(self, description, bbox, n, m, file_name, encoding, fields, crs = None,
+            delr = None, delc = None, nproc = 1, angle = 0., on_finished = None):
+        super(RGridTask, self).__init__(description, on_finished)
+        self.bbox = QgsRectangle(bbox)
+        self.n, self.m = n, m
+        self.file_name = file_name
+        self.encoding = encoding
+        self.fields = QgsFields(fields)
+        self.crs = crs
+        self.delr, self.delc = delr, delc
+        self.nproc = nproc
+        self.angle = angle
+        # False if an incomplete output file could not be deleted
+        self.output_deleted = True
+
+    def process(self):
+        # Initialize base rectangle feature
+        rect_feat = QgsFeature()
+        rect_feat.setGeometry( QgsGeometry.fromRect(self.bbox) )
+        rect_feat.initAttributes( self.fields.count() )
+        rect_feat.setAttribute(0, 0)
+
+        writer = create_grid_writer(self.file_name, self.encoding, self.fields, self.crs)
+        try :
+            make_rgrid(rect_feat, self.n, self.m, writer, self,
+                    delr = self.delr, delc = self.delc, nproc = self.nproc, angle = self.angle)
+        finally :
+            # close the file, also on failure, so that it can be deleted.
+            # The writer is destroyed explicitly : references may remain
+            # in the frames of make_rgrid if an exception was raised.
+            sip.delete(writer)
+            del writer
+
+        if self.isCanceled() :
+            return(False)
+
+        # Build spatial index once all features are written
+        build_spatial_index(self.file_name)
+        return(True)
+
+    def finished(self, result):
+        # no truncated grid file is left when the task is canceled or fails
+        if not result :
+            self.output_deleted = self.delete_output()
+        super(RGridTask, self).finished(result)
+
+    def delete_output(self):
+        """ deletes the output file (and shapefile side files), returns False if it is left on disk """
+        try :
+            if self.file_name.lower().endswith('.shp') :
+                res = QgsVectorFileWriter.deleteShapeFile(self.file_name) or not os.path.exists(self.file_name)
+            else :
+                if os.path.exists(self.file_name) :
+                    os.remove(self.file_name)
+                res = True
+        except OSError :
+            res = False
+        if not res :
+            QgsMessageLog.logMessage('Incomplete grid file could not be deleted : ' + self.file_name,
+                    'Qgridder', Qgis.Warning)
+        return(res)
+
+
+# ======================================================================================
+class RefineTask(QgridderTask):
+    """
+    Description
+    -----------
+    Refines a grid layer in the background (see refine_by_split).
+    grid_layer is only modified when the task is successfully completed,
+    and changes are recorded in journal (GridJournal) if provided.
+
+    Examples
+    --------
+    >>> task = RefineTask('Refine grid', grid_layer, fids, 2, 2, {'model':'nested','nmax':2})
+    >>> QgsApplication.taskManager().addTask(task)
+    """
+
+    def __init__(self, description, grid_layer, featIds, n, m, topo_rules, on_finished = None, journal = None):
+        super(RefineTask, self).__init__(description, on_finished)
+        self.journal = journal
+        self.grid_copy = GridLayerCopy(grid_layer)
+        self.featIds = list(featIds)
+        self.n, self.m = n, m
+        self.topo_rules = topo_rules
+
+    def process(self):
+        cells = self.grid_copy.read_cells()
+        grid = get_split_grid(None, self.n, self.m, self.topo_rules, cells, cells.angle)
+        if grid is not None :
+            changes = split_grid_cells(grid, self.featIds, self.n, self.m, self.topo_rules, self)
+            if changes is None or self.isCanceled() :
+                return(False)
+            cells.replace( *changes )
+            return(True)
+        # grids refined by the geometric procedure
+        copy_layer = self.grid_copy.materialize()
+        refine_by_split( self.grid_copy.to_copy_fids(self.featIds), self.n, self.m,
+                self.topo_rules, copy_layer, self )
+        if self.isCanceled() :
+            return(False)
+        self.grid_copy.diff()
+        return(True)
+
+    def apply(self):
+        self.grid_copy.commit(self.journal)
+
+
+# ======================================================================================
+class CoarsenTask(QgridderTask):
+    """
+    Description
+    -----------
+    Coarsens a grid layer in the background (see coarsen_by_merge).
+    grid_layer is only modified when the task is successfully completed,
+    and changes are recorded in journal (GridJournal) if provided.
+
+    Examples
+    --------
+    >>> task = CoarsenTask('Coarsen grid', grid_layer, fids, 2, 2, {'model':'nested','nmax':2})
+    >>> QgsApplication.taskManager().addTask(task)
+    """
+
+    def __init__(self, description, grid_layer, featIds, n, m, topo_rules, on_finished = None, journal = None):
+        super(CoarsenTask, self).__init__(description, on_finished)
+        self.journal = journal
+        self.grid_copy = GridLayerCopy(grid_layer)
+        self.featIds = list(featIds)
+        self.n, self.m = n, m
+        self.topo_rules = topo_rules
+
+    def process(self):
+        cells = self.grid_copy.read_cells()
+        grid = get_merge_grid(None, self.n, self.m, self.topo_rules, cells, cells.angle)
+        changes = merge_grid_cells(grid, self.featIds, self.n, self.m, self.topo_rules, cells, self)
+        if changes is None or self.isCanceled() :
+            return(False)
+        cells.replace( *changes )
+        return(True)
+
+    def apply(self):
+        self.grid_copy.commit(self.journal)
+
+
+# ======================================================================================
+class RefineRulesTask(QgridderTask):
+    """
+    Description
+    -----------
+    Refines a grid layer around the features of rule layers in the background
+    (see refine_by_rules). grid_layer is only modified when the task is successfully completed,
+    and changes are recorded in journal (GridJournal) if provided.
+
+    Examples
+    --------
+    >>> rules = [ {'layer':wells_layer, 'size':5., 'growth':1.2} ]
+    >>> task = RefineRulesTask('Refine grid', grid_layer, rules, {'model':'nested','nmax':2})
+    >>> QgsApplication.taskManager().addTask(task)
+    """
+
+    def __init__(self, description, grid_layer, rules, topo_rules, on_finished = None, journal = None):
+        super(RefineRulesTask, self).__init__(description, on_finished)
+        self.journal = journal
+        self.grid_copy = GridLayerCopy(grid_layer)
+        # thread-safe snapshots of rule layers
+        self.rules = []
+        for rule in rules :
+            rule = dict(rule)
+            rule['layer'] = QgsVectorLayerFeatureSource(rule['layer'])
+            self.rules.append(rule)
+        self.topo_rules = topo_rules
+
+    def process(self):
+        cells = self.grid_copy.read_cells()
+        grid = get_rules_grid(None, self.topo_rules, cells, cells.angle)
+        if grid is not None :
+            rules_data = prepare_refinement_rules(self.rules, self.grid_copy.crs)
+            changes = split_grid_cells_by_rules(grid, rules_data, self.topo_rules, self)
+            if changes is None or self.isCanceled() :
+                return(False)
+            cells.replace( *changes )
+            return(True)
+        # grids refined by successive 2x2 splits
+        copy_layer = self.grid_copy.materialize()
+        refine_by_rules( copy_layer, self.rules, self.topo_rules, self )
+        if self.isCanceled() :
+            return(False)
+        self.grid_copy.diff()
+        return(True)
+
+    def apply(self):
+        self.grid_copy.commit(self.journal)
+
+
+# ======================================================================================
+class Check3DTask(QgridderTask):
+    """
+    Description
+    -----------
+    Checks and corrects a pseudo-3D grid in the background (see correct_pseudo3D_grid).
+    Layers are only modified when the task is successfully completed, and changes
+    are recorded in journal (GridJournal, one step per layer) if provided.
+    The vertical connectivity of the corrected stack, with feature ids
+    of the layers, is then available in self.connectivity.
+
+    Examples
+    --------
+    >>> task = Check3DTask('Check 3D grid', all_layers, {'model':'nested','nmax':2,'pmax':4})
+    >>> QgsApplication.taskManager().addTask(task)
+    """
+
+    def __init__(self, description, all_layers, topo_rules, nproc = 1, on_finished = None, journal = None):
+        super(Check3DTask, self).__init__(description, on_finished)
+        self.journal = journal
+        self.grid_copies = [ GridLayerCopy(grid_layer) for grid_layer in all_layers ]
+        self.topo_rules = topo_rules
+        self.nproc = nproc
+        self.connectivity = None
+
+    def process(self):
+        all_cells = [ grid_copy.read_cells() for grid_copy in self.grid_copies ]
+        if all( [ get_split_grid(None, 2, 2, self.topo_rules, cells, cells.angle) is not None
+                for cells in all_cells ] ) :
+            # structured or nested grids, corrected on cell arrays
+            self.connectivity = correct_pseudo3D_grid(all_cells, self.topo_rules, nproc = self.nproc, progress_bar = self)
+            return( self.connectivity is not None and not self.isCanceled() )
+        # grids refined by the geometric procedure
+        copy_layers = [ grid_copy.materialize() for grid_copy in self.grid_copies ]
+        self.connectivity = correct_pseudo3D_grid(copy_layers, self.topo_rules, nproc = self.nproc, progress_bar = self)
+        if self.isCanceled() :
+            return(False)
+        for grid_copy in self.grid_copies :
+            grid_copy.diff()
+        return(True)
+
+    def apply(self):
+        # no layer is modified if one of them has been edited since the check started
+        for grid_copy in self.grid_copies :
+            grid_copy.check()
+        for grid_copy in self.grid_copies :
+            grid_copy.commit(self.journal)
+        # connectivity with feature ids of the layers instead of the copies (provisional ids)
+        self.connectivity = self.connectivity.remap( [ grid_copy.fid_map for grid_copy in self.grid_copies ] )
+
@@ -0,0 +1,569 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ qgridder_utils_vertical.py
+                                 Qgridder - A QGIS plugin
+
+ This file gathers the vertical (inter-layer) checks of pseudo-3D grids
+ on Numpy arrays of cell extents and areas, without Qgis objects, so that
+ they can run in worker processes on arrays shared between processes.
+
+ Qgridder Builds 2D regular and unstructured grids and comes together with
+ pre- and post-processing capabilities for spatially distributed modeling.
+
+                              -------------------
+        begin                : 2013-04-08
+        copyright            : (C) 2013 by Pryet
+        email                : alexandre.pryet@ensegid.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import numpy as np
+
+try :
+    from multiprocessing import shared_memory
+except ImportError :
+    # Python < 3.8 : cell arrays are sent to worker processes (pickled)
+    shared_memory = None
+
+# ======================================================================================
+
+# Global variables
+
+# columns of the float arrays of cells : bounding boxes, areas, and xmin sorted
+CELL_XMIN, CELL_XMAX, CELL_YMIN, CELL_YMAX, CELL_AREA, CELL_SORTED_XMIN = range(6)
+# columns of the integer arrays of cells : feature ids, and order of cells by xmin
+CELL_FID, CELL_ORDER = range(2)
+# True if cell arrays can be shared with worker processes (see SharedLayerArrays)
+HAS_SHARED_MEMORY = shared_memory is not None
+
+# ======================================================================================
+def attach_shared_memory(name):
+    """
+    Description
+    ----------
+    Attaches an existing shared memory block created by the parent process,
+    which owns it. Worker processes share the resource tracker of their parent,
+    so that the block is only unlinked by its owner.
+
+    Parameters
+    ----------
+    name : name of the shared memory block
+
+    Returns
+    -------
+    multiprocessing.shared_memory.SharedMemory
+
+    Examples
+    --------
+    >>> shm = attach_shared_memory(descriptor['float'])
+    """
+    try :
+        return( shared_memory.SharedMemory(name = name, track = False) )
+    except TypeError :
+        # Python < 3.13
+        return( shared_memory.SharedMemory(name = name) )
+
+
+# ======================================================================================
+class LayerCellArrays(object):
+    """
+    Description
+    -----------
+    Cell extents and areas of a grid layer, as Numpy arrays. Cells are also
+    sorted by xmin, so that the cells overlapping a rectangle are found with
+    binary searches (see overlapping_cells). Overlaps between layers are
+    computed with overlap_pairs.
+
+    Attributes
+    ----------
+    cells : float array of shape (N, 6), columns CELL_XMIN ... CELL_SORTED_XMIN
+    ints : integer array of shape (N, 2), columns CELL_FID, CELL_ORDER
+    fids : array of feature ids (sorted when built from a CellExtentCache)
+    max_width : maximum cell width
+
+    Examples
+    --------
+    >>> arrays = LayerCellArrays.from_extents( get_cell_extents(grid_layer) )
+    >>> positions = arrays.overlapping(xmin, xmax, ymin, ymax)
+    """
+
+    def __init__(self, fids, xmin, xmax, ymin, ymax, areas):
+        fids = np.asarray(fids, dtype=np.int64)
+        n = fids.size
+        order = np.argsort(xmin, kind = 'stable')
+        self.cells, self.ints = self._allocate(n)
+        for col, values in zip( (CELL_XMIN, CELL_XMAX, CELL_YMIN, CELL_YMAX, CELL_AREA),
+                (xmin, xmax, ymin, ymax, areas) ) :
+            self.cells[:, col] = values
+        self.cells[:, CELL_SORTED_XMIN] = self.cells[order, CELL_XMIN]
+        self.ints[:, CELL_FID] = fids
+        self.ints[:, CELL_ORDER] = order
+        self.max_width = float( np.max(self.cells[:, CELL_XMAX] - self.cells[:, CELL_XMIN]) ) if n > 0 else 0.
+
+    def _allocate(self, n):
+        # float and integer arrays of n cells
+        return( np.empty( (n, 6), dtype = np.float64 ), np.empty( (n, 2), dtype = np.int64 ) )
+
+    @classmethod
+    def from_extents(cls, extents):
+        """ builds the arrays from a CellExtentCache (see extents.py) """
+        xmin, xmax, ymin, ymax = extents.extents()
+        return( cls(extents.fids, xmin, xmax, ymin, ymax, extents.areas()) )
+
+    def __len__(self):
+        return( self.ints.shape[0] )
+
+    @property
+    def fids(self):
+        return( self.ints[:, CELL_FID] )
+
+    @property
+    def arrays(self):
+        """ (cells, ints, max_width), as used by check3D_cells """
+        return( self.cells, self.ints, self.max_width )
+
+    @property
+    def descriptor(self):
+        """ picklable arrays for worker processes (see check3D_chunk), copied to each worker """
+        return( self.arrays )
+
+    def index(self, fids):
+        """ positions of fids in the arrays (fids must be sorted, see from_extents) """
+        fids = np.atleast_1d( np.asarray(fids, dtype=np.int64) )
+        pos = np.clip( np.searchsorted(self.fids, fids), 0, max(len(self) - 1, 0) )
+        if len(self) == 0 or np.any( self.fids[pos] != fids ) :
+            raise KeyError('Feature ids not found in layer : %s' % fids)
+        return(pos)
+
+    def overlapping(self, xmin, xmax, ymin, ymax, tolerance = 1e-6):
+        """
+        Description
+        ----------
+        Returns the positions of the cells overlapping (with a positive area)
+        at least one of the rectangles (xmin, xmax, ymin, ymax)
+
+        Parameters
+        ----------
+        xmin, xmax, ymin, ymax : arrays of rectangle bounds
+        tolerance : absolute tolerance, cells sharing an edge do not overlap
+
+        Returns
+        -------
+        sorted array of cell positions
+        """
+        bounds = [ np.atleast_1d( np.asarray(v, dtype=np.float64) ) for v in (xmin, xmax, ymin, ymax) ]
+        rects = np.zeros( (bounds[0].size, 6), dtype = np.float64 )
+        for col, values in zip( (CELL_XMIN, CELL_XMAX, CELL_YMIN, CELL_YMAX), bounds ) :
+            rects[:, col] = values
+        ia, ib, area = overlap_pairs( (rects, None, 0.), self.arrays, tolerance = tolerance )
+        return( np.unique(ib) )
+
+    def close(self):
+        """ releases the arrays """
+        self.cells, self.ints = None, None
+
+
+# ======================================================================================
+class SharedLayerArrays(LayerCellArrays):
+    """
+    Description
+    -----------
+    LayerCellArrays exported to shared memory, so that worker processes can
+    read them without copy (see check3D_chunk). Requires Python >= 3.8
+    (see HAS_SHARED_MEMORY).
+    The owner must call close() once the arrays are no longer used.
+
+    Attributes
+    ----------
+    descriptor : picklable description of the shared blocks, for workers
+
+    Examples
+    --------
+    >>> shared = SharedLayerArrays(fids, xmin, xmax, ymin, ymax, areas)
+    >>> pool.apply(check3D_chunk, ([shared.descriptor], 0, np.arange(100), 4))
+    >>> shared.close()
+    """
+
+    def __init__(self, fids, xmin, xmax, ymin, ymax, areas):
+        super(SharedLayerArrays, self).__init__(fids, xmin, xmax, ymin, ymax, areas)
+        self._descriptor = { 'float' : self._float_shm.name, 'int' : self._int_shm.name,
+                'n' : len(self), 'max_width' : self.max_width }
+
+    @property
+    def descriptor(self):
+        """ picklable description of the shared blocks, for workers """
+        return( self._descriptor )
+
+    def _allocate(self, n):
+        self._float_shm = shared_memory.SharedMemory( create = True, size = max(n, 1)*6*8 )
+        self._int_shm = shared_memory.SharedMemory( create = True, size = max(n, 1)*2*8 )
+        return( np.ndarray( (n, 6), dtype = np.float64, buffer = self._float_shm.buf ),
+                np.ndarray( (n, 2), dtype = np.int64, buffer = self._int_shm.buf ) )
+
+    def close(self):
+        """ releases the shared memory blocks """
+        super(SharedLayerArrays, self).close()
+        for shm in (self._float_shm, self._int_shm) :
+            shm.close()
+            shm.unlink()
+
+
+# ======================================================================================
+def overlapping_cells(layer, xmin, xmax, ymin, ymax, tolerance = 1e-6):
+    """
+    Description
+    ----------
+    Returns the positions of the cells of layer overlapping the rectangle
+    (xmin, xmax, ymin, ymax) with a positive area
+
+    Parameters
+    ----------
+    layer : (cells, ints, max_width) arrays of a layer (see LayerCellArrays)
+    xmin, xmax, ymin, ymax : bounds of the rectangle
+    tolerance : absolute tolerance, cells sharing an edge do not overlap
+
+    Returns
+    -------
+    array of cell positions
+
+    Examples
+    --------
+    >>> positions = overlapping_cells(arrays.arrays, 0., 10., 0., 10.)
+    """
+    cells, ints, max_width = layer
+    # shrink the rectangle of tolerance, so that neighbor cells are not selected
+    xmin, xmax = xmin + tolerance, xmax - tolerance
+    ymin, ymax = ymin + tolerance, ymax - tolerance
+    # candidates with xmin in [xmin - max_width, xmax]
+    lo = np.searchsorted( cells[:, CELL_SORTED_XMIN], xmin - max_width, 'left' )
+    hi = np.searchsorted( cells[:, CELL_SORTED_XMIN], xmax, 'right' )
+    candidates = ints[lo:hi, CELL_ORDER]
+    overlap = (cells[candidates, CELL_XMAX] >= xmin) & (cells[candidates, CELL_YMIN] <= ymax) & \
+            (cells[candidates, CELL_YMAX] >= ymin)
+    return( candidates[overlap] )
+
+
+# ======================================================================================
+def _bucket_entries(xmin, xmax, ymin, ymax, x0, y0, size, nx):
+    # (bucket id, cell index) entries of cells covering several buckets of a uniform grid
+    ix0 = np.floor( (xmin - x0) / size ).astype(np.int64)
+    ix1 = np.floor( (xmax - x0) / size ).astype(np.int64)
+    iy0 = np.floor( (ymin - y0) / size ).astype(np.int64)
+    iy1 = np.floor( (ymax - y0) / size ).astype(np.int64)
+    nbx, nby = ix1 - ix0 + 1, iy1 - iy0 + 1
+    counts = nbx * nby
+    cell = np.repeat( np.arange(xmin.size), counts )
+    # rank of each entry among the buckets of its cell
+    rank = np.arange(cell.size) - np.repeat( np.cumsum(counts) - counts, counts )
+    iy, ix = np.divmod( rank, nbx[cell] )
+    return( (iy0[cell] + iy) * nx + ix0[cell] + ix, cell )
+
+
+# ======================================================================================
+def overlap_pairs(layer_a, layer_b, positions_a = None, tolerance = 1e-6):
+    """
+    Description
+    ----------
+    Finds all the pairs of overlapping cells (with a positive area) between two layers,
+    for axis-aligned rectangular cells, without per-cell loop : cells are hashed into
+    the buckets of a uniform grid (a cell larger than a bucket covers several buckets),
+    candidate pairs are found by a sorted join on bucket ids, and each pair is kept
+    once, in the bucket containing the lower-left corner of its intersection.
+
+    Parameters
+    ----------
+    layer_a, layer_b : (cells, ints, max_width) arrays of the layers (see LayerCellArrays.arrays)
+    positions_a (optional) : positions of the cells of layer_a to consider (all by default)
+    tolerance : absolute tolerance, cells sharing an edge do not overlap
+
+    Returns
+    -------
+    (ia, ib, area) : positions of overlapping cells in layer_a and layer_b,
+    and area of their intersection, sorted by ia
+
+    Examples
+    --------
+    >>> ia, ib, area = overlap_pairs(arrays_a.arrays, arrays_b.arrays)
+    """
+    cells_a, cells_b = layer_a[0], layer_b[0]
+    if positions_a is None :
+        positions_a = np.arange(cells_a.shape[0])
+    positions_a = np.asarray(positions_a, dtype=np.int64)
+    empty = np.array([], dtype=np.int64)
+    if positions_a.size == 0 or cells_b.shape[0] == 0 :
+        return( empty, empty, np.array([], dtype=float) )
+
+    # shrink cells of a of tolerance, so that neighbor cells are not selected
+    ax0, ax1, ay0, ay1 = [ cells_a[positions_a, col] + sign*tolerance for col, sign in
+            ( (CELL_XMIN, 1), (CELL_XMAX, -1), (CELL_YMIN, 1), (CELL_YMAX, -1) ) ]
+    bx0, bx1, by0, by1 = [ cells_b[:, col] for col in (CELL_XMIN, CELL_XMAX, CELL_YMIN, CELL_YMAX) ]
+
+    # uniform grid of buckets, of the size of the larger median cell size of both layers
+    size = max( np.median( np.maximum(ax1 - ax0, ay1 - ay0) ), np.median( np.maximum(bx1 - bx0, by1 - by0) ) )
+    x0, y0 = min( ax0.min(), bx0.min() ), min( ay0.min(), by0.min() )
+    size = max( size, tolerance )
+    nx = int( np.floor( (max( ax1.max(), bx1.max() ) - x0) / size ) ) + 1
+
+    # entries of both layers, and sorted join on bucket ids
+    key_a, ea = _bucket_entries(ax0, ax1, ay0, ay1, x0, y0, size, nx)
+    key_b, eb = _bucket_entries(bx0, bx1, by0, by1, x0, y0, size, nx)
+    order = np.argsort(key_b, kind = 'stable')
+    key_b, eb = key_b[order], eb[order]
+    start = np.searchsorted(key_b, key_a, 'left')
+    counts = np.searchsorted(key_b, key_a, 'right') - start
+    ia = np.repeat(ea, counts)
+    key = np.repeat(key_a, counts)
+    ib = eb[ np.repeat(start, counts) + np.arange(ia.size) - np.repeat( np.cumsum(counts) - counts, counts ) ]
+
+    # overlapping pairs, kept in the bucket of the lower-left corner of their intersection
+    ix0, iy0 = np.maximum(ax0[ia], bx0[ib]), np.maximum(ay0[ia], by0[ib])
+    valid = (bx0[ib] <= ax1[ia]) & (bx1[ib] >= ax0[ia]) & (by0[ib] <= ay1[ia]) & (by1[ib] >= ay0[ia])
+    anchor = np.floor( (iy0 - y0) / size ).astype(np.int64) * nx + np.floor( (ix0 - x0) / size ).astype(np.int64)
+    valid &= anchor == key
+    ia, ib = ia[valid], ib[valid]
+
+    # intersection areas, with the original cell bounds
+    ia = positions_a[ia]
+    width = np.minimum(cells_a[ia, CELL_XMAX], bx1[ib]) - np.maximum(cells_a[ia, CELL_XMIN], bx0[ib])
+    height = np.minimum(cells_a[ia, CELL_YMAX], by1[ib]) - np.maximum(cells_a[ia, CELL_YMIN], by0[ib])
+    order = np.lexsort( (ib, ia) )
+    return( ia[order], ib[order], (width * height)[order] )
+
+
+# ======================================================================================
+def layer_overlaps(layer_a, layer_b, positions_a = None, tolerance = 1e-6):
+    """
+    Description
+    ----------
+    For each cell of layer_a, counts the overlapping cells of layer_b and sums
+    their overlap area (see overlap_pairs).
+
+    Parameters
+    ----------
+    layer_a, layer_b : (cells, ints, max_width) arrays of the layers (see LayerCellArrays.arrays)
+    positions_a (optional) : positions of the cells of layer_a to consider (all by default)
+    tolerance : absolute tolerance, cells sharing an edge do not overlap
+
+    Returns
+    -------
+    (count, overlap_area, cells_area) : arrays (same order as positions_a) of the number
+    of overlapping cells, of the total area of intersections, and of the total area
+    of the overlapping cells
+
+    Examples
+    --------
+    >>> count, overlap_area, cells_area = layer_overlaps(arrays_a.arrays, arrays_b.arrays)
+    """
+    if positions_a is None :
+        positions_a = np.arange(layer_a[0].shape[0])
+    positions_a = np.asarray(positions_a, dtype=np.int64)
+    ia, ib, area = overlap_pairs(layer_a, layer_b, positions_a, tolerance)
+    # rank of cells in positions_a
+    local = np.full(layer_a[0].shape[0], -1, dtype=np.int64)
+    local[positions_a] = np.arange(positions_a.size)
+    ka = local[ia]
+    count = np.bincount(ka, minlength = positions_a.size)
+    overlap_area = np.bincount(ka, weights = area, minlength = positions_a.size)
+    cells_area = np.bincount(ka, weights = layer_b[0][ib, CELL_AREA], minlength = positions_a.size)
+    return( count, overlap_area, cells_area )
+
+
+# ======================================================================================
+def check3D_cells(layers, layer_num, positions, pmax, tolerance = 1e-6):
+    """
+    Description
+    ----------
+    Checks the 3D topology of cells of layer layer_num (see check3D_features) :
+    for each cell, the first layer below (and above) with cells overlapping it is
+    considered. The cell has to be split if it is overlapped by more than pmax cells,
+    or if the total area of the overlapping cells is lower than its own area.
+
+    Parameters
+    ----------
+    layers : list of (cells, ints, max_width) arrays for each layer of the stack,
+             from top to bottom (see LayerCellArrays.arrays)
+    layer_num : number of the checked layer
+    positions : positions of the checked cells in the arrays of layer layer_num
+    pmax : maximum number of overlapping cells
+    tolerance : absolute tolerance, cells sharing an edge do not overlap
+
+    Returns
+    -------
+    array of feature ids of cells to split, in the order of positions
+
+    Examples
+    --------
+    >>> fids = check3D_cells([ arrays.arrays for arrays in all_arrays ], 2, np.arange(1000), 4)
+    """
+    cells, ints, max_width = layers[layer_num]
+    nLayers = len(layers)
+    positions = np.asarray(positions, dtype=np.int64)
+    to_fix = np.zeros(positions.size, dtype=bool)
+    # layers below, from the nearest, and layers above, from the nearest
+    for layer_range in ( range(layer_num + 1, nLayers), range(layer_num - 1, -1, -1) ) :
+        # cells without overlapping cells in the layers checked so far
+        pending = np.arange(positions.size)
+        for l in layer_range :
+            if pending.size == 0 :
+                break
+            count, overlap_area, cells_area = layer_overlaps(layers[layer_num], layers[l],
+                    positions[pending], tolerance)
+            found = count > 0
+            to_fix[ pending[ found & ( (count > pmax) | (cells_area < cells[positions[pending], CELL_AREA] - tolerance) ) ] ] = True
+            # features found in this direction
+            pending = pending[~found]
+    return( ints[positions[to_fix], CELL_FID] )
+
+
+# ======================================================================================
+def check3D_chunk(descriptors, layer_num, positions, pmax, tolerance = 1e-6):
+    """
+    Description
+    ----------
+    Worker function of the parallel 3D check : attaches the shared arrays of
+    all layers (descriptors of SharedLayerArrays) and runs check3D_cells on
+    cells positions of layer layer_num. No Qgis object is used.
+    Descriptors of LayerCellArrays (arrays sent to the worker) are also accepted.
+
+    Returns
+    -------
+    array of feature ids of cells to split
+
+    Examples
+    --------
+    >>> fids = pool.apply( check3D_chunk, ([shared.descriptor for shared in all_shared], 0, np.arange(100), 4) )
+    """
+    blocks = []
+    layers = []
+    try :
+        for descriptor in descriptors :
+            if not isinstance(descriptor, dict) :
+                # (cells, ints, max_width)
+                layers.append(descriptor)
+                continue
+            float_shm = attach_shared_memory( descriptor['float'] )
+            int_shm = attach_shared_memory( descriptor['int'] )
+            blocks += [ float_shm, int_shm ]
+            n = descriptor['n']
+            layers.append( ( np.ndarray( (n, 6), dtype = np.float64, buffer = float_shm.buf ),
+                np.ndarray( (n, 2), dtype = np.int64, buffer = int_shm.buf ), descriptor['max_width'] ) )
+        fix = check3D_cells(layers, layer_num, positions, pmax, tolerance)
+    finally :
+        # views on shared buffers must be released before closing
+        layers = None
+        for shm in blocks :
+            shm.close()
+    return(fix)
+
+
+# ======================================================================================
+class VerticalConnectivity(object):
+    """
+    Description
+    -----------
+    Vertical connections of a pseudo-3D grid : for each pair of successive layers
+    (k, k+1), the cells of layer k+1 overlapping each cell of layer k, with the
+    shared area, in compressed sparse row (CSR) arrays :
+    connections of the i-th cell of fids[k] are indices[k][indptr[k][i]:indptr[k][i+1]]
+    (feature ids in layer k+1), with shared areas areas[k][indptr[k][i]:indptr[k][i+1]].
+
+    Attributes
+    ----------
+    fids : list of arrays of feature ids of layer k (rows)
+    indptr : list of arrays of row offsets, of size fids[k].size + 1
+    indices : list of arrays of feature ids of layer k+1
+    areas : list of arrays of shared areas
+
+    Examples
+    --------
+    >>> connectivity = VerticalConnectivity.from_arrays([ arrays.arrays for arrays in all_arrays ])
+    >>> fids, areas = connectivity.connections(0, 12)
+    >>> connectivity.save('connectivity.npz')
+    >>> connectivity = VerticalConnectivity.load('connectivity.npz')
+    """
+
+    def __init__(self, fids, indptr, indices, areas):
+        self.fids = [ np.asarray(v, dtype=np.int64) for v in fids ]
+        self.indptr = [ np.asarray(v, dtype=np.int64) for v in indptr ]
+        self.indices = [ np.asarray(v, dtype=np.int64) for v in indices ]
+        self.areas = [ np.asarray(v, dtype=np.float64) for v in areas ]
+
+    @classmethod
+    def from_arrays(cls, layers, tolerance = 1e-6):
+        """ computes the connections of the layers, (cells, ints, max_width) arrays from top to bottom (see overlap_pairs) """
+        fids, indptr, indices, areas = [], [], [], []
+        for k in range( len(layers) - 1 ) :
+            ia, ib, area = overlap_pairs(layers[k], layers[k+1], tolerance = tolerance)
+            # rows by increasing feature ids
+            row_fids = layers[k][1][:, CELL_FID]
+            rows = np.argsort(row_fids, kind = 'stable')
+            rank = np.empty(rows.size, dtype=np.int64)
+            rank[rows] = np.arange(rows.size)
+            order = np.lexsort( (ib, rank[ia]) )
+            fids.append( row_fids[rows] )
+            indptr.append( np.concatenate( ( [0], np.cumsum( np.bincount(rank[ia], minlength = rows.size) ) ) ) )
+            indices.append( layers[k+1][1][ib[order], CELL_FID] )
+            areas.append( area[order] )
+        return( cls(fids, indptr, indices, areas) )
+
+    def __len__(self):
+        """ number of layer pairs """
+        return( len(self.fids) )
+
+    def connections(self, k, fid):
+        """ feature ids of layer k+1 connected to cell fid of layer k, and shared areas """
+        row = np.searchsorted(self.fids[k], fid)
+        if row >= self.fids[k].size or self.fids[k][row] != fid :
+            raise KeyError('Feature id %d not found in layer %d' % (fid, k))
+        start, end = self.indptr[k][row], self.indptr[k][row+1]
+        return( self.indices[k][start:end], self.areas[k][start:end] )
+
+    def remap(self, fid_maps):
+        """
+        Description
+        ----------
+        Returns the connectivity with feature ids converted by fid_maps,
+        a list of dictionaries {old fid : new fid}, one for each layer.
+        Feature ids missing from a dictionary are kept.
+        """
+        def convert(fids, fid_map) :
+            return( np.array( [ fid_map.get(fid, fid) for fid in fids.tolist() ], dtype=np.int64 ) )
+        fids, indptr, indices, areas = [], [], [], []
+        for k in range( len(self) ) :
+            row_fids = convert(self.fids[k], fid_maps[k])
+            rows = np.argsort(row_fids, kind = 'stable')
+            # reorder rows, keeping the connections of each row
+            counts = np.diff(self.indptr[k])[rows]
+            starts = np.repeat(self.indptr[k][:-1][rows], counts)
+            entries = starts + np.arange(starts.size) - np.repeat( np.cumsum(counts) - counts, counts )
+            fids.append( row_fids[rows] )
+            indptr.append( np.concatenate( ( [0], np.cumsum(counts) ) ) )
+            indices.append( convert(self.indices[k][entries], fid_maps[k+1]) )
+            areas.append( self.areas[k][entries] )
+        return( VerticalConnectivity(fids, indptr, indices, areas) )
+
+    def save(self, file_name):
+        """ writes the connectivity to a Numpy .npz file """
+        arrays = {}
+        for k in range( len(self) ) :
+            for name in ('fids', 'indptr', 'indices', 'areas') :
+                arrays['%s_%d' % (name, k)] = getattr(self, name)[k]
+        np.savez(file_name, n_pairs = len(self), **arrays)
+
+    @classmethod
+    def load(cls, file_name):
+        """ reads a connectivity written by save """
+        with np.load(file_name) as data :
+            n = int( data['n_pairs'] )
+            return( cls( *[ [ data['%s_%d' % (name, k)] for k in range(n) ]
+                for name in ('fids', 'indptr', 'indices', 'areas') ] ) )
@@ -101,6 +101,41 @@ class Ui_QGridderNew(object):
         self.labelNumberCells.setObjectName("labelNumberCells")
         self.horizontalLayout_9.addWidget(self.labelNumberCells)
         self.gridLayout.addLayout(self.horizontalLayout_9, 1, 0, 1, 1)
+        self.horizontalLayout_10 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_10.setObjectName("horizontalLayout_10")
+        self.checkGraded = QtWidgets.QCheckBox(self.groupBox_2)
+        self.checkGraded.setObjectName("checkGraded")
+        self.horizontalLayout_10.addWidget(self.checkGraded)
+        self.label_9 = QtWidgets.QLabel(self.groupBox_2)
+        self.label_9.setObjectName("label_9")
+        self.horizontalLayout_10.addWidget(self.label_9)
+        self.sboxResMin = QtWidgets.QDoubleSpinBox(self.groupBox_2)
+        self.sboxResMin.setMaximum(1000000000.0)
+        self.sboxResMin.setObjectName("sboxResMin")
+        self.horizontalLayout_10.addWidget(self.sboxResMin)
+        self.label_10 = QtWidgets.QLabel(self.groupBox_2)
+        self.label_10.setObjectName("label_10")
+        self.horizontalLayout_10.addWidget(self.label_10)
+        self.sboxGrowth = QtWidgets.QDoubleSpinBox(self.groupBox_2)
+        self.sboxGrowth.setMinimum(1.0)
+        self.sboxGrowth.setMaximum(10.0)
+        self.sboxGrowth.setSingleStep(0.05)
+        self.sboxGrowth.setProperty("value", 1.2)
+        self.sboxGrowth.setObjectName("sboxGrowth")
+        self.horizontalLayout_10.addWidget(self.sboxGrowth)
+        self.gridLayout.addLayout(self.horizontalLayout_10, 2, 0, 1, 1)
+        self.horizontalLayout_11 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_11.setObjectName("horizontalLayout_11")
+        self.label_11 = QtWidgets.QLabel(self.groupBox_2)
+        self.label_11.setObjectName("label_11")
+        self.horizontalLayout_11.addWidget(self.label_11)
+        self.sboxAngle = QtWidgets.QDoubleSpinBox(self.groupBox_2)
+        self.sboxAngle.setDecimals(4)
+        self.sboxAngle.setMinimum(-180.0)
+        self.sboxAngle.setMaximum(180.0)
+        self.sboxAngle.setObjectName("sboxAngle")
+        self.horizontalLayout_11.addWidget(self.sboxAngle)
+        self.gridLayout.addLayout(self.horizontalLayout_11, 3, 0, 1, 1)
         self.verticalLayout_7.addWidget(self.groupBox_2)
         self.groupBox_3 = QtWidgets.QGroupBox(QGridderNew)
         self.groupBox_3.setObjectName("groupBox_3")
@@ -109,6 +144,9 @@ class Ui_QGridderNew(object):
         self.checkLoadLayer = QtWidgets.QCheckBox(self.groupBox_3)
         self.checkLoadLayer.setObjectName("checkLoadLayer")
         self.gridLayout_8.addWidget(self.checkLoadLayer, 2, 0, 1, 1)
+        self.checkVirtual = QtWidgets.QCheckBox(self.groupBox_3)
+        self.checkVirtual.setObjectName("checkVirtual")
+        self.gridLayout_8.addWidget(self.checkVirtual, 3, 0, 1, 1)
         self.gridLayout_7 = QtWidgets.QGridLayout()
         self.gridLayout_7.setObjectName("gridLayout_7")
         self.textOutFilename = QtWidgets.QLineEdit(self.groupBox_3)
@@ -151,10 +189,15 @@ class Ui_QGridderNew(object):
         QGridderNew.setTabOrder(self.textYmax, self.sboxXres)
         QGridderNew.setTabOrder(self.sboxXres, self.sboxYres)
         QGridderNew.setTabOrder(self.sboxYres, self.checkRatio)
-        QGridderNew.setTabOrder(self.checkRatio, self.textOutFilename)
+        QGridderNew.setTabOrder(self.checkRatio, self.checkGraded)
+        QGridderNew.setTabOrder(self.checkGraded, self.sboxResMin)
+        QGridderNew.setTabOrder(self.sboxResMin, self.sboxGrowth)
+        QGridderNew.setTabOrder(self.sboxGrowth, self.sboxAngle)
+        QGridderNew.setTabOrder(self.sboxAngle, self.textOutFilename)
         QGridderNew.setTabOrder(self.textOutFilename, self.buttonBrowse)
         QGridderNew.setTabOrder(self.buttonBrowse, self.checkLoadLayer)
-        QGridderNew.setTabOrder(self.checkLoadLayer, self.buttonWriteGrid)
+        QGridderNew.setTabOrder(self.checkLoadLayer, self.checkVirtual)
+        QGridderNew.setTabOrder(self.checkVirtual, self.buttonWriteGrid)
 
     def retranslateUi(self, QGridderNew):
         _translate = QtCore.QCoreApplication.translate
@@ -177,8 +220,13 @@ class Ui_QGridderNew(object):
         self.label_5.setText(_translate("QGridderNew", "X"))
         self.checkRatio.setText(_translate("QGridderNew", " 1:1 ratio"))
         self.label_13.setText(_translate("QGridderNew", "Estimated number of grid cells : "))
+        self.checkGraded.setText(_translate("QGridderNew", "Graded around source layer features"))
+        self.label_9.setText(_translate("QGridderNew", "Min"))
+        self.label_10.setText(_translate("QGridderNew", "Growth"))
+        self.label_11.setText(_translate("QGridderNew", "Rotation (degrees, counter-clockwise, around X Min, Y Min)"))
         self.groupBox_3.setTitle(_translate("QGridderNew", "Output"))
         self.checkLoadLayer.setText(_translate("QGridderNew", "Load layer after creation"))
+        self.checkVirtual.setText(_translate("QGridderNew", "Virtual layer (cells generated on the fly, no file written)"))
         self.textOutFilename.setText(_translate("QGridderNew", "grid.shp"))
         self.buttonBrowse.setText(_translate("QGridderNew", "Browse..."))
         self.label.setText(_translate("QGridderNew", "Output layer"))
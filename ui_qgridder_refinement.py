@@ -11,7 +11,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_QGridderRefinement(object):
     def setupUi(self, QGridderRefinement):
         QGridderRefinement.setObjectName("QGridderRefinement")
-        QGridderRefinement.resize(548, 233)
+        QGridderRefinement.resize(548, 266)
         self.verticalLayout_7 = QtWidgets.QVBoxLayout(QGridderRefinement)
         self.verticalLayout_7.setObjectName("verticalLayout_7")
         self.horizontalLayout_11 = QtWidgets.QHBoxLayout()
@@ -61,6 +61,39 @@ class Ui_QGridderRefinement(object):
         spacerItem = QtWidgets.QSpacerItem(128, 21, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
         self.horizontalLayout_8.addItem(spacerItem)
         self.verticalLayout_7.addLayout(self.horizontalLayout_8)
+        self.horizontalLayout_3 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_3.setObjectName("horizontalLayout_3")
+        self.labelRefineLayer = QtWidgets.QLabel(QGridderRefinement)
+        self.labelRefineLayer.setObjectName("labelRefineLayer")
+        self.horizontalLayout_3.addWidget(self.labelRefineLayer)
+        self.listRefineLayer = QtWidgets.QComboBox(QGridderRefinement)
+        self.listRefineLayer.setObjectName("listRefineLayer")
+        self.horizontalLayout_3.addWidget(self.listRefineLayer)
+        self.labelTargetSize = QtWidgets.QLabel(QGridderRefinement)
+        self.labelTargetSize.setObjectName("labelTargetSize")
+        self.horizontalLayout_3.addWidget(self.labelTargetSize)
+        self.sboxTargetSize = QtWidgets.QDoubleSpinBox(QGridderRefinement)
+        self.sboxTargetSize.setDecimals(3)
+        self.sboxTargetSize.setMinimum(0.001)
+        self.sboxTargetSize.setMaximum(1000000000.0)
+        self.sboxTargetSize.setProperty("value", 10.0)
+        self.sboxTargetSize.setObjectName("sboxTargetSize")
+        self.horizontalLayout_3.addWidget(self.sboxTargetSize)
+        self.labelGrowth = QtWidgets.QLabel(QGridderRefinement)
+        self.labelGrowth.setObjectName("labelGrowth")
+        self.horizontalLayout_3.addWidget(self.labelGrowth)
+        self.sboxGrowth = QtWidgets.QDoubleSpinBox(QGridderRefinement)
+        self.sboxGrowth.setDecimals(2)
+        self.sboxGrowth.setMinimum(1.0)
+        self.sboxGrowth.setMaximum(10.0)
+        self.sboxGrowth.setSingleStep(0.1)
+        self.sboxGrowth.setProperty("value", 1.2)
+        self.sboxGrowth.setObjectName("sboxGrowth")
+        self.horizontalLayout_3.addWidget(self.sboxGrowth)
+        self.buttonAutoRefine = QtWidgets.QPushButton(QGridderRefinement)
+        self.buttonAutoRefine.setObjectName("buttonAutoRefine")
+        self.horizontalLayout_3.addWidget(self.buttonAutoRefine)
+        self.verticalLayout_7.addLayout(self.horizontalLayout_3)
         self.horizontalLayout_2 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_2.setObjectName("horizontalLayout_2")
         self.progressBarRegularRefine = QtWidgets.QProgressBar(QGridderRefinement)
@@ -79,6 +112,13 @@ class Ui_QGridderRefinement(object):
         self.buttonUndoRefine.setEnabled(False)
         self.buttonUndoRefine.setObjectName("buttonUndoRefine")
         self.horizontalLayout_2.addWidget(self.buttonUndoRefine)
+        self.buttonRedoRefine = QtWidgets.QPushButton(QGridderRefinement)
+        self.buttonRedoRefine.setEnabled(False)
+        self.buttonRedoRefine.setObjectName("buttonRedoRefine")
+        self.horizontalLayout_2.addWidget(self.buttonRedoRefine)
+        self.buttonCoarsen = QtWidgets.QPushButton(QGridderRefinement)
+        self.buttonCoarsen.setObjectName("buttonCoarsen")
+        self.horizontalLayout_2.addWidget(self.buttonCoarsen)
         self.buttonRefine = QtWidgets.QPushButton(QGridderRefinement)
         self.buttonRefine.setObjectName("buttonRefine")
         self.horizontalLayout_2.addWidget(self.buttonRefine)
@@ -101,5 +141,12 @@ class Ui_QGridderRefinement(object):
         self.labelIterations.setText(_translate("QGridderRefinement", "Iterations : "))
         self.labelIter.setText(_translate("QGridderRefinement", "0"))
         self.buttonUndoRefine.setText(_translate("QGridderRefinement", "Undo"))
+        self.buttonRedoRefine.setText(_translate("QGridderRefinement", "Redo"))
+        self.buttonCoarsen.setText(_translate("QGridderRefinement", "Coarsen selection"))
         self.buttonRefine.setText(_translate("QGridderRefinement", "Refine selection "))
+        self.labelRefineLayer.setText(_translate("QGridderRefinement", "Refine around :"))
+        self.labelTargetSize.setText(_translate("QGridderRefinement", "cell size :"))
+        self.labelGrowth.setText(_translate("QGridderRefinement", "growth :"))
+        self.sboxGrowth.setToolTip(_translate("QGridderRefinement", "Growth rate of cell size away from features (1 : only cells intersecting features)"))
+        self.buttonAutoRefine.setText(_translate("QGridderRefinement", "Refine around layer"))
 
@@ -35,6 +35,18 @@ class Ui_QGridderSettings(object):
         self.checkGridBackup.setObjectName("checkGridBackup")
         self.horizontalLayout_5.addWidget(self.checkGridBackup)
         self.verticalLayout_3.addLayout(self.horizontalLayout_5)
+        self.horizontalLayout_13 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_13.setObjectName("horizontalLayout_13")
+        self.labelProcesses = QtWidgets.QLabel(self.groupBox_4)
+        self.labelProcesses.setObjectName("labelProcesses")
+        self.horizontalLayout_13.addWidget(self.labelProcesses)
+        self.sboxProcesses = QtWidgets.QSpinBox(self.groupBox_4)
+        self.sboxProcesses.setMinimum(1)
+        self.sboxProcesses.setMaximum(256)
+        self.sboxProcesses.setProperty("value", 1)
+        self.sboxProcesses.setObjectName("sboxProcesses")
+        self.horizontalLayout_13.addWidget(self.sboxProcesses)
+        self.verticalLayout_3.addLayout(self.horizontalLayout_13)
         self.verticalLayout_2.addWidget(self.groupBox_4)
         self.groupBox = QtWidgets.QGroupBox(QGridderSettings)
         self.groupBox.setObjectName("groupBox")
@@ -163,6 +175,7 @@ class Ui_QGridderSettings(object):
         self.groupBox_4.setTitle(_translate("QGridderSettings", "Grid refinement"))
         self.label_22.setText(_translate("QGridderSettings", "Model type :"))
         self.checkGridBackup.setText(_translate("QGridderSettings", "Backup grids when refining "))
+        self.labelProcesses.setText(_translate("QGridderSettings", "Number of processes (grid build, 3D check) :"))
         self.groupBox.setTitle(_translate("QGridderSettings", "Plotting"))
         self.checkPlotSimul.setText(_translate("QGridderSettings", "Plot simulated  values"))
         self.textObsDir.setText(_translate("QGridderSettings", "obs_dir"))